@@ -0,0 +1,158 @@
+"""
+Stale-while-revalidate cache for the API's query results
+
+Each entry has two ages that matter:
+
+- younger than `soft_ttl`: served as is
+- between `soft_ttl` and `hard_ttl`: served immediately while one background
+  refresh per key reloads it
+- older than `hard_ttl`, or missing: loaded in the request, with concurrent
+  requests for the same key waiting on a single load
+
+If a load fails (e.g. MySQL is unreachable) and any previous value exists, the
+previous value is served instead of an error, however old it is. `None`
+results are never cached.
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class SWRCache:
+    """
+    Args:
+        soft_ttl (float): Seconds an entry is served without refreshing
+        hard_ttl (float): Seconds after which a request waits for a fresh load
+        max_entries (int): Least recently used keys beyond this are dropped
+        clock (callable): Returns the current time in seconds
+    """
+
+    def __init__(self, name, soft_ttl, hard_ttl, max_entries=1024, clock=time.time):
+        self.name = name
+        self.soft_ttl = soft_ttl
+        self.hard_ttl = max(hard_ttl, soft_ttl)
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Striped per-key locks: loads of one key are serialized without a lock per key
+        self._load_locks = [threading.Lock() for _ in range(64)]
+        self._refreshing = {}
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix=f"swr-{name}")
+
+    def get(self, key, load):
+        """Return the value for key, calling load() when it has to be (re)loaded."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None:
+            value, stored_at = entry
+            age = self._clock() - stored_at
+            if age < self.soft_ttl:
+                return value
+            if age < self.hard_ttl:
+                self._refresh_in_background(key, load)
+                return value
+
+        with self._load_lock(key):
+            # Another request may have loaded it while this one waited
+            with self._lock:
+                current = self._entries.get(key)
+            if current is not None and current is not entry and self._clock() - current[1] < self.hard_ttl:
+                return current[0]
+            try:
+                return self._load(key, load)
+            except Exception as e:
+                if current is None:
+                    raise
+                print(f"{self.name} cache: serving stale value for {key!r}: {e}")
+                return current[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def wait_idle(self, timeout=None):
+        """Block until background refreshes started so far have finished (for tests)."""
+        with self._lock:
+            futures = [f for f in self._refreshing.values() if f is not None]
+        wait(futures, timeout=timeout)
+
+    def _load(self, key, load):
+        value = load()
+        if value is not None:
+            with self._lock:
+                self._entries[key] = (value, self._clock())
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def _load_lock(self, key):
+        return self._load_locks[hash(key) % len(self._load_locks)]
+
+    def _refresh_in_background(self, key, load):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing[key] = None
+        future = self._executor.submit(self._refresh, key, load)
+        with self._lock:
+            # The refresh may already have finished and removed its marker
+            if key in self._refreshing:
+                self._refreshing[key] = future
+
+    def _refresh(self, key, load):
+        try:
+            with self._load_lock(key):
+                self._load(key, load)
+        except Exception as e:
+            # Keep serving the stale value; the next request past soft_ttl retries
+            print(f"{self.name} cache: background refresh of {key!r} failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.pop(key, None)
+
+
+class NegativeCache:
+    """
+    Keys known not to exist, each remembered for `ttl` seconds
+
+    Args:
+        ttl (float): Seconds a key is remembered
+        max_entries (int): Oldest keys beyond this are dropped, so random keys cannot grow it without bound
+        clock (callable): Returns the current time in seconds
+    """
+
+    def __init__(self, ttl, max_entries=10000, clock=time.time):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            added_at = self._entries.get(key)
+            if added_at is None:
+                return False
+            if self._clock() - added_at < self.ttl:
+                return True
+            del self._entries[key]
+            return False
+
+    def add(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = self._clock()
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,20 +1,40 @@
 # app.py
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from starlette.datastructures import Headers
 from typing import List, Optional
 import os
+import re
+import anyio
+import itertools
+import threading
 import configparser
+from contextlib import asynccontextmanager
 from datetime import datetime
 from time import time as _time
 
 from query_data import (
     query_info_last_updated,
     query_all_ranking_players,
+    query_match_changes,
+    query_player_stats,
+    query_upcoming_matches,
+    query_latest_match_change_id,
+    query_player_exists,
+    current_dimensions,
+    invalidate_dimensions,
     get_current_season
 )
+from calendar_store import HotCalendarStore, accepts_gzip, etag_matches
+from api_cache import NegativeCache, SWRCache
+from player_resolver import is_placeholder
+from update_feed import UpdateFeed
+from upcoming_index import UpcomingIndex
+from calendar_manifest import AccessLog, ManifestReader, entry_etag, legacy_path, publish_calendar_stream
+from upstream import snooker_breaker, transport_stats
 
 # 读取配置文件
 config = configparser.ConfigParser()
@@ -27,7 +47,19 @@ if config.has_section('cors') and config.has_option('cors', 'allowed_origins'):
     if origins_str.strip():
         allowed_origins = [origin.strip() for origin in origins_str.split(',')]
 
-app = FastAPI(title="Snooker Calendar API", version="1.0.0")
+@asynccontextmanager
+async def _lifespan(app):
+    # 预热在后台进行：/healthz 立即可用，/readyz 在预热完成后才返回 200
+    if config.getboolean('cache', 'warm_up', fallback=True):
+        _start_warm_up()
+    # 访问记录定时写入 access.json，关闭时写入剩余部分，安静时段的访问也不会丢失
+    _access_log.start()
+    try:
+        yield
+    finally:
+        _access_log.stop()
+
+app = FastAPI(title="Snooker Calendar API", version="1.0.0", lifespan=_lifespan)
 
 # 添加CORS中间件
 app.add_middleware(
@@ -38,8 +70,36 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 热点日历的内存缓存（按字节数限制的 LRU，按 mtime 失效）
+_hot_calendars = HotCalendarStore(
+    max_bytes=config.getint('cache', 'hot_calendar_bytes', fallback=64 * 1024 * 1024),
+    max_entry_bytes=config.getint('cache', 'hot_calendar_entry_bytes', fallback=2 * 1024 * 1024),
+)
+
+# 已发布日历的清单：存在性、ETag 和元数据都从这里获取，无需访问文件系统
+_manifest = ManifestReader("ics_calendars")
+# 记录每个日历最近被请求的日期，供 calendar_gc.py 的保留策略使用
+_access_log = AccessLog("ics_calendars")
+
+_STATIC_CALENDAR_NAME = re.compile(r"^(\d+)\.ics$")
+
+class CalendarStaticFiles(StaticFiles):
+    """
+    静态日历文件：/static/{player_id}.ics 通过清单解析到分片存储的文件，
+    热点文件从内存返回，附带由 X-PUBLISHED-TTL 推导的 Cache-Control
+    """
+
+    async def get_response(self, path, scope):
+        match = _STATIC_CALENDAR_NAME.match(path)
+        if match and scope["method"] in ("GET", "HEAD"):
+            response = await anyio.to_thread.run_sync(
+                _player_calendar_response, int(match.group(1)), Headers(scope=scope))
+            if response is not None:
+                return response
+        return await super().get_response(path, scope)
+
 # 挂载静态文件
-app.mount("/static", StaticFiles(directory="ics_calendars"), name="static")
+app.mount("/static", CalendarStaticFiles(directory="ics_calendars"), name="static")
 
 class PlayerFilter(BaseModel):
     nationality: Optional[str] = None
@@ -48,11 +108,281 @@ class PlayerFilter(BaseModel):
     has_upcoming_matches: Optional[bool] = None
 
 # --------------- In-memory cache ---------------
-_players_cache: dict = {}
-_PLAYERS_CACHE_TTL = 300  # 5 minutes
+# 软 TTL 内直接返回；软硬 TTL 之间先返回旧值并在后台刷新；数据库不可用时回退到旧值
+_players_cache = SWRCache(
+    "players",
+    soft_ttl=config.getint('cache', 'players_soft_ttl', fallback=300),  # 5 minutes
+    hard_ttl=config.getint('cache', 'players_hard_ttl', fallback=3600),
+    clock=lambda: _time(),
+)
+
+_last_updated_cache = SWRCache(
+    "last_updated",
+    soft_ttl=config.getint('cache', 'last_updated_soft_ttl', fallback=60),  # 1 minute
+    hard_ttl=config.getint('cache', 'last_updated_hard_ttl', fallback=600),
+    clock=lambda: _time(),
+)
+
+# 确认不存在的球员 ID：有效期内直接返回 404，不再查询数据库或调用 snooker.org
+# 维度存储的同步版本变化时整体清空（见 _is_known_player），新同步的球员不必等到过期
+_unknown_players = NegativeCache(
+    ttl=config.getint('cache', 'unknown_player_ttl', fallback=3600),  # 1 hour
+    max_entries=config.getint('cache', 'unknown_player_entries', fallback=10000),
+    clock=lambda: _time(),
+)
+# 负缓存记录时维度存储的同步版本
+_unknown_players_version = None
+
+def _update_snapshot():
+    """更新通知所比较的状态：日历清单版本与各日历哈希，以及各类数据的最后更新时间"""
+    manifest = _manifest.current()
+    calendars = {
+        "version": manifest.get("version", 0),
+        "published_at": manifest.get("published_at"),
+        "hashes": {pid: entry["hash"] for pid, entry in manifest.get("calendars", {}).items()},
+    }
+    try:
+        info = {
+            row.info: row.lastupdated.isoformat() if row.lastupdated else None
+            for row in query_info_last_updated() or []
+        }
+    except Exception:
+        # 数据库不可用时本轮只比较日历清单
+        info = None
+    return {"calendars": calendars, "info": info}
+
+def _on_data_update(event, data):
+    """数据更新后丢弃相关缓存，让收到通知的客户端立即取到新数据"""
+    if event in ("players", "events"):
+        # 下次访问时检查同步版本，必要时重新加载维度存储
+        invalidate_dimensions()
+    if event in ("rankings", "players"):
+        _players_cache.clear()
+        # 未来比赛索引中预先关联了排名和球员信息
+        _upcoming.invalidate()
+    if event != "calendars":
+        _last_updated_cache.clear()
+
+_updates = UpdateFeed(
+    _update_snapshot,
+    interval=config.getfloat('updates', 'poll_seconds', fallback=5.0),
+    on_update=_on_data_update,
+)
+
+# 未来比赛的时间索引：跟随比赛变更记录增量更新
+_upcoming = UpcomingIndex(
+    lambda match_ids: query_upcoming_matches(match_ids),
+    lambda since, limit: query_match_changes(since=since, limit=limit),
+    lambda: query_latest_match_change_id(),
+    check_interval=config.getfloat('cache', 'upcoming_check_seconds', fallback=30.0),
+)
+
+# X-PUBLISHED-TTL 位于日历头部，只需读取文件开头即可
+_CALENDAR_HEADER_BYTES = 2048
+_TTL_PATTERN = re.compile(rb"^X-PUBLISHED-TTL:(\S+)", re.MULTILINE)
+_DURATION_PATTERN = re.compile(r"^P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$")
+
 
-_last_updated_cache: dict = {"data": None, "ts": 0}
-_LAST_UPDATED_CACHE_TTL = 60  # 1 minute
+def _parse_ics_duration(value: str) -> Optional[int]:
+    """将 ICS DURATION（如 PT15M、P1D）转换为秒数，无法解析时返回 None"""
+    match = _DURATION_PATTERN.match(value)
+    if not match or not any(match.groups()):
+        return None
+    weeks, days, hours, minutes, seconds = (int(g or 0) for g in match.groups())
+    return (((weeks * 7 + days) * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
+def _max_age_from_header(head: bytes) -> Optional[int]:
+    """从日历头部的 X-PUBLISHED-TTL 读取客户端缓存时长（秒）"""
+    match = _TTL_PATTERN.search(head)
+    if not match:
+        return None
+    return _parse_ics_duration(match.group(1).decode('ascii', 'ignore'))
+
+
+def _calendar_max_age(filepath: str) -> Optional[int]:
+    """从日历文件的 X-PUBLISHED-TTL 读取客户端缓存时长（秒）"""
+    try:
+        with open(filepath, 'rb') as f:
+            head = f.read(_CALENDAR_HEADER_BYTES)
+    except OSError:
+        return None
+    return _max_age_from_header(head)
+
+
+def _calendar_response(filepath: str, request_headers, filename: Optional[str] = None,
+                       etag: Optional[str] = None):
+    """
+    返回日历文件的响应，文件不存在时返回 None
+
+    热点文件直接从内存返回（支持 If-None-Match 和 gzip），冷文件交给 FileResponse。
+    传入 etag 时表示文件来自清单（内容寻址、不会再改变），以清单中的哈希作为 ETag
+    """
+    if etag is not None and etag_matches(request_headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    entry, stat_result = _hot_calendars.lookup(filepath, immutable=etag is not None)
+    if entry is None and stat_result is None:
+        return None
+
+    if entry is None:
+        headers = {"ETag": etag} if etag else {}
+        max_age = _calendar_max_age(filepath)
+        if max_age is not None:
+            headers["Cache-Control"] = f"public, max-age={max_age}"
+        return FileResponse(
+            filepath,
+            media_type='text/calendar',
+            filename=filename,
+            headers=headers,
+            stat_result=stat_result
+        )
+
+    etag = etag or entry.etag
+    headers = {"ETag": etag, "Last-Modified": entry.last_modified, "Vary": "Accept-Encoding"}
+    max_age = _max_age_from_header(entry.body[:_CALENDAR_HEADER_BYTES])
+    if max_age is not None:
+        headers["Cache-Control"] = f"public, max-age={max_age}"
+    if etag_matches(request_headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    if filename:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    body = entry.body
+    if accepts_gzip(request_headers.get("accept-encoding")):
+        body = _hot_calendars.gzip_body(filepath, entry)
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, media_type='text/calendar', headers=headers)
+
+
+def _player_calendar_response(player_id: int, request_headers, filename: Optional[str] = None):
+    """按清单返回玩家日历；清单中没有的旧文件仍按文件名直接提供"""
+    meta = _manifest.get(player_id)
+    if meta is not None:
+        _access_log.record(player_id)
+        return _calendar_response(_manifest.object_path(meta), request_headers, filename, etag=entry_etag(meta))
+    response = _calendar_response(legacy_path(_manifest.output_dir, player_id), request_headers, filename)
+    if response is not None:
+        _access_log.record(player_id)
+    return response
+
+
+def _is_known_player(player_id: int) -> bool:
+    """
+    只有已知球员才值得实时生成（需要调用 snooker.org）
+
+    先查维度存储中的 players/rankings，快照中没有的 ID 再查一次数据库（快照加载后才入库的球员），
+    确认不存在的 ID 记入负缓存。数据库无法查询时放行，不把有效 ID 误记为不存在。
+    current_dimensions 会定期检查同步版本，版本变化说明可能同步了新球员，此时清空负缓存；
+    这样不依赖是否有 SSE 客户端在订阅更新通知
+    """
+    global _unknown_players_version
+    if is_placeholder(player_id):
+        return False
+    store = current_dimensions()
+    if store is not None and store.version != _unknown_players_version:
+        _unknown_players.clear()
+        _unknown_players_version = store.version
+    if player_id in _unknown_players:
+        return False
+    if store is not None and (player_id in store.players or player_id in store.rankings):
+        return True
+    try:
+        exists = query_player_exists(player_id)
+    except Exception as e:
+        print(f"Could not check player {player_id}: {e}")
+        return True
+    if not exists:
+        _unknown_players.add(player_id)
+    return exists
+
+
+def _publish_stream(player_id: int, chunks):
+    """边向客户端输出边写入内容寻址文件，完整写完后才发布到清单"""
+    yield from publish_calendar_stream(player_id, chunks, _manifest.output_dir)
+    _manifest.invalidate()
+
+
+# 启动预热：负载均衡只把流量发给缓存已就绪的工作进程
+_WARM_CALENDARS = config.getint('cache', 'warm_calendars', fallback=32)
+_readiness = {"ready": False, "started_at": None, "finished_at": None, "steps": {}}
+_warm_up_lock = threading.Lock()
+
+
+def _warm_up():
+    """
+    依次加载当前赛季、维度存储（排名快照）、球员列表首页和更新时间缓存、清单、
+    未来比赛索引，以及排名靠前球员的日历。单个步骤失败只记录下来，不阻止就绪：
+    这些缓存在请求时仍会按需加载
+    """
+    _readiness["started_at"] = _readiness["started_at"] or datetime.utcnow().isoformat()
+    season = None
+
+    def step(name, func):
+        started = _time()
+        try:
+            result = func()
+            _readiness["steps"][name] = {"ok": True, "seconds": round(_time() - started, 3), "result": result}
+            return result
+        except Exception as e:
+            print(f"Warm-up step {name} failed: {e}")
+            _readiness["steps"][name] = {"ok": False, "seconds": round(_time() - started, 3), "error": str(e)}
+            return None
+
+    def load_dimensions():
+        store = current_dimensions(season)
+        if store is None:
+            raise RuntimeError("dimension store is not available")
+        return {"players": len(store.players), "rankings": len(store.ranked)}
+
+    def load_calendars():
+        store = current_dimensions(season)
+        warmed = 0
+        for ranking in (store.ranked if store is not None else ())[:_WARM_CALENDARS]:
+            meta = _manifest.get(ranking.player_id)
+            if meta is not None and _hot_calendars.preload(_manifest.object_path(meta)):
+                warmed += 1
+        return warmed
+
+    season = step("season", get_current_season)
+    step("dimensions", load_dimensions)
+    step("players", lambda: len(_players_cache.get(
+        (1, 50, None), lambda: query_all_ranking_players(page=1, limit=50, search=None)) or []))
+    step("last_updated", lambda: len(_last_updated_cache.get("all", lambda: query_info_last_updated()) or []))
+    step("manifest", lambda: len(_manifest.current()["calendars"]))
+    step("upcoming", lambda: len(_upcoming.upcoming(24)))
+    step("calendars", load_calendars)
+    _readiness["finished_at"] = datetime.utcnow().isoformat()
+    _readiness["ready"] = True
+
+
+def _start_warm_up():
+    """每个进程只预热一次"""
+    with _warm_up_lock:
+        if _readiness["started_at"] is not None:
+            return
+        _readiness["started_at"] = datetime.utcnow().isoformat()
+    threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
+
+
+@app.get("/healthz")
+def healthz():
+    """存活检查：进程能处理请求即返回 200，不访问数据库"""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readyz():
+    """就绪检查：启动预热完成前返回 503；附带预热各步骤结果和 snooker.org 断路器、连接池状态"""
+    body = {
+        "ready": _readiness["ready"],
+        "warm_up": {key: _readiness[key] for key in ("started_at", "finished_at", "steps")},
+        "upstream": snooker_breaker.snapshot(),
+        "transport": transport_stats(),
+    }
+    if not _readiness["ready"]:
+        return JSONResponse(body, status_code=503)
+    return body
 
 
 @app.get("/api/players")
@@ -63,60 +393,133 @@ def get_players(
 ):
     """获取玩家列表"""
     try:
-        cache_key = (page, limit, search)
-        now = _time()
-        if cache_key in _players_cache:
-            data, ts = _players_cache[cache_key]
-            if now - ts < _PLAYERS_CACHE_TTL:
-                return data
-
-        players = query_all_ranking_players(page=page, limit=limit, search=search)
-        if players is not None:
-            _players_cache[cache_key] = (players, now)
-        return players
+        return _players_cache.get(
+            (page, limit, search),
+            lambda: query_all_ranking_players(page=page, limit=limit, search=search),
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/players/{player_id}/stats")
+def get_player_stats(player_id: int, season: Optional[int] = None):
+    """获取球员的赛季统计：胜负场、胜负局、奖金（rounds.actual_money）与排名积分（rounds.points）"""
+    try:
+        stats = query_player_stats(player_id, season)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if stats is None:
+        raise HTTPException(status_code=404, detail="No stats for this player and season")
+    return stats
+
+
+@app.get("/api/upcoming")
+def get_upcoming_matches(hours: int = 24, ranked_only: bool = True):
+    """
+    获取未来 N 小时内（含正在进行）的比赛，附带球员、排名、赛事和轮次信息
+
+    ranked_only 为真时只返回至少有一名有排名球员的比赛
+    """
+    if not 1 <= hours <= 24 * 14:
+        raise HTTPException(status_code=400, detail="hours must be between 1 and 336")
+    try:
+        matches = _upcoming.upcoming(hours)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if ranked_only:
+        matches = [
+            m for m in matches
+            if any(side and side['position'] is not None for side in (m['player1'], m['player2']))
+        ]
+    return {"hours": hours, "count": len(matches), "matches": matches}
 
 
 @app.get("/api/calendar/{player_id}")
-def download_player_calendar(player_id: int):
+def download_player_calendar(player_id: int, request: Request):
     """下载指定玩家的ICS日历文件"""
     try:
-        # 检查文件是否存在
-        filepath = f"ics_calendars/{player_id}.ics"
-        if not os.path.exists(filepath):
-            # 如果不存在，实时生成
-            from player_matches_to_ics import generate_player_calendar
-            ics_content = generate_player_calendar(player_id, get_current_season())
+        # 检查清单中是否已发布
+        response = _player_calendar_response(player_id, request.headers, filename=f"player_{player_id}.ics")
+        if response is None:
+            # 未知球员直接返回 404，避免爬虫用随机 ID 消耗 snooker.org 配额和工作线程
+            if not _is_known_player(player_id):
+                raise HTTPException(status_code=404, detail="Unknown player")
+            # 如果不存在，实时生成：分块流式返回，同时写入磁盘缓存
+            from player_matches_to_ics import stream_player_calendar
+            season = get_current_season()
+            # 生成时的球员、赛事和轮次查找使用共享的维度存储
+            current_dimensions(season)
+            chunks = stream_player_calendar(player_id, season)
             
-            if not ics_content:
+            if chunks is None:
                 raise HTTPException(status_code=404, detail="No matches found")
             
-            # 保存文件
-            os.makedirs(f"ics_calendars", exist_ok=True)
-            with open(filepath, 'wb') as f:
-                f.write(ics_content)
+            # 第一个分块是日历头部，其中包含 X-PUBLISHED-TTL
+            header = next(chunks)
+            headers = {"Content-Disposition": f'attachment; filename="player_{player_id}.ics"'}
+            max_age = _max_age_from_header(header)
+            if max_age is not None:
+                headers["Cache-Control"] = f"public, max-age={max_age}"
+            return StreamingResponse(
+                _publish_stream(player_id, itertools.chain([header], chunks)),
+                media_type='text/calendar',
+                headers=headers
+            )
         
-        return FileResponse(
-            filepath, 
-            media_type='text/calendar',
-            filename=f"player_{player_id}.ics"
-        )
+        return response
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/calendar/{player_id}/meta")
+def get_player_calendar_meta(player_id: int):
+    """获取已发布日历的元数据（哈希、大小、比赛数、生成时间）"""
+    meta = _manifest.get(player_id)
+    if meta is None:
+        raise HTTPException(status_code=404, detail="Calendar not published")
+    return {"player_id": player_id, "etag": entry_etag(meta), **meta}
+
 @app.get("/api/info/lastupdated")
 def get_last_updated_info():
     """获取最后更新时间"""
     try:
-        now = _time()
-        if _last_updated_cache["data"] is not None and now - _last_updated_cache["ts"] < _LAST_UPDATED_CACHE_TTL:
-            return _last_updated_cache["data"]
-
-        last_updated = query_info_last_updated()
-        if last_updated is not None:
-            _last_updated_cache["data"] = last_updated
-            _last_updated_cache["ts"] = now
-        return last_updated
+        return _last_updated_cache.get("all", lambda: query_info_last_updated())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/changes")
+def get_match_changes(since: int = 0, limit: int = 500):
+    """
+    获取比赛变更记录（新比赛、改期、比分更新、赛果）
+
+    以变更 id 作为游标：将返回的 next_since 作为下一次请求的 since 参数
+    """
+    if since < 0 or not 1 <= limit <= 1000:
+        raise HTTPException(status_code=400, detail="since must be >= 0 and limit between 1 and 1000")
+    try:
+        changes = query_match_changes(since=since, limit=limit)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "changes": changes,
+        "next_since": changes[-1]["id"] if changes else since,
+    }
+
+@app.get("/api/updates")
+async def stream_updates(request: Request):
+    """
+    数据更新通知（Server-Sent Events）
+
+    排名、赛事或日历发布时推送一条消息（日历消息包含受影响的球员 ID 和清单版本），
+    客户端无需再轮询 /api/info/lastupdated 和 /api/players
+    """
+    try:
+        last_event_id = int(request.headers.get("last-event-id", ""))
+    except ValueError:
+        last_event_id = None
+    return StreamingResponse(
+        _updates.stream(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
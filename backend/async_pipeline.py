@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+asyncio pipeline for the fetch -> transform -> persist -> render flow
+
+Async counterparts of fetch_and_store_events, fetch_and_store_players and
+generate_all_players_calendars. snooker.org calls run concurrently in worker
+threads under a shared rate limit instead of sleeping between items, ICS
+rendering runs in a process pool, and database writes are batched. Everything
+a calendar looks up is fetched in this process before it is handed to the
+pool, so render workers do no database or snooker.org I/O.
+
+Usage:
+    python async_pipeline.py events|players|calendars
+"""
+import asyncio
+import configparser
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from upstream import create_snooker_client, snooker_breaker, transport_stats, CircuitOpenError
+
+
+def load_config(filename='config.txt'):
+    config = configparser.ConfigParser()
+    config.read(filename)
+
+    # Load database configuration
+    db_config = {key: value for key, value in config['database'].items()}
+
+    # Load API configuration
+    api_config = {key: value for key, value in config['api'].items()}
+
+    return db_config, api_config
+
+db_config, api_config = load_config()
+
+# Rows per database commit in the persist stage
+PERSIST_BATCH_SIZE = 20
+
+
+class AsyncRateLimiter:
+    """
+    Spaces request starts at least `interval` seconds apart and caps how many
+    requests are in flight, so throughput is bound by the upstream quota.
+    """
+
+    def __init__(self, interval, max_concurrency):
+        self.interval = interval
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._lock = asyncio.Lock()
+        self._next_start = 0.0
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_start - now
+            self._next_start = max(now, self._next_start) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._semaphore.release()
+
+
+def default_rate_limiter():
+    interval = float(api_config.get('request_delay_seconds', 1))
+    max_concurrency = int(api_config.get('max_concurrency', 4))
+    return AsyncRateLimiter(interval, max_concurrency)
+
+
+# requests.Session is not guaranteed thread-safe, so each worker thread keeps its own client;
+# the clients share one keep-alive connection pool (upstream.snooker_transport)
+_thread_clients = threading.local()
+
+def _thread_client():
+    client = getattr(_thread_clients, 'client', None)
+    if client is None:
+        client = create_snooker_client()
+        _thread_clients.client = client
+    return client
+
+async def call_api(limiter, method, *args):
+    """Run SnookerOrgApi.<method>(*args) in a worker thread under the rate limit."""
+    async with limiter:
+        return await asyncio.to_thread(lambda: getattr(_thread_client(), method)(*args))
+
+
+async def _persist_stage(queue, persist_batch, batch_size=PERSIST_BATCH_SIZE):
+    """Drain `queue` until a None sentinel, writing items in batches; returns the item count."""
+    batch = []
+    count = 0
+    while True:
+        item = await queue.get()
+        if item is not None:
+            batch.append(item)
+        if batch and (item is None or len(batch) >= batch_size):
+            # A failed batch must not stop the stage, or producers would block on a full queue
+            try:
+                await asyncio.to_thread(persist_batch, batch)
+                count += len(batch)
+            except Exception as e:
+                print(f"✗ Dropped a batch of {len(batch)} items: {e}")
+            batch = []
+        if item is None:
+            return count
+
+
+async def _run_pipeline(producers, persist_batch):
+    """Run producer coroutines that put items on a shared queue into the persist stage."""
+    queue = asyncio.Queue(maxsize=PERSIST_BATCH_SIZE * 4)
+    persister = asyncio.create_task(_persist_stage(queue, persist_batch))
+    try:
+        results = await asyncio.gather(*(producer(queue) for producer in producers), return_exceptions=True)
+    finally:
+        await queue.put(None)
+    stored = await persister
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"✗ Pipeline item failed: {result}")
+    return stored
+
+
+# --------------- Events ---------------
+
+def _persist_events(batch):
+    from fetch_events import Event, Round, engine
+    import sqlalchemy as sqla
+
+    session = sqla.orm.sessionmaker(bind=engine)()
+    try:
+        for event_data, rounds in batch:
+            session.merge(Event(event_data))
+            for round_data in rounds or []:
+                session.merge(Round(round_data))
+        session.commit()
+        print(f"Stored {len(batch)} events with their rounds")
+    except Exception as e:
+        print(f"Error storing event batch: {e}")
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+async def async_fetch_and_store_events(season=None, limiter=None):
+    """Async fetch_and_store_events: rounds for all events are fetched concurrently."""
+    from query_data import get_current_season
+
+    limiter = limiter or default_rate_limiter()
+    if season is None:
+        season = await asyncio.to_thread(get_current_season)
+    events = await call_api(limiter, 'season_events', season) or []
+    print(f"Found {len(events)} events for season {season}")
+
+    def producer(event_data):
+        async def produce(queue):
+            rounds = await call_api(limiter, 'round_info_by_event', event_data.ID)
+            await queue.put((event_data, rounds))
+        return produce
+
+    stored = await _run_pipeline([producer(e) for e in events], _persist_events)
+    print(f"Finished fetching all events and rounds ({stored}/{len(events)} stored)")
+    return stored
+
+
+# --------------- Players ---------------
+
+def _persist_players(batch):
+    from fetch_players import Player, engine
+    import sqlalchemy as sqla
+
+    session = sqla.orm.sessionmaker(bind=engine)()
+    try:
+        for player_data in batch:
+            session.merge(Player(player_data))
+        session.commit()
+        print(f"Stored {len(batch)} players")
+    except Exception as e:
+        print(f"Error storing player batch: {e}")
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def _persist_rankings(rankings):
+    from fetch_players import Ranking, engine
+    import sqlalchemy as sqla
+
+    session = sqla.orm.sessionmaker(bind=engine)()
+    try:
+        for ranking in rankings:
+            session.merge(Ranking(ranking))
+        session.commit()
+    finally:
+        session.close()
+
+async def async_fetch_and_store_players(limiter=None):
+    """Async fetch_and_store_players: player records are fetched concurrently."""
+    from query_data import get_current_season
+
+    limiter = limiter or default_rate_limiter()
+    season = await asyncio.to_thread(get_current_season)
+    rankings = await call_api(limiter, 'rankings', api_config['ranking_type'], season) or []
+    print(f"Found {len(rankings)} rankings")
+    await asyncio.to_thread(_persist_rankings, rankings)
+    print("Rankings stored successfully")
+
+    def producer(player_id):
+        async def produce(queue):
+            player_data = await call_api(limiter, 'player', player_id)
+            if player_data is not None:
+                await queue.put(player_data)
+        return produce
+
+    stored = await _run_pipeline([producer(r.PlayerID) for r in rankings], _persist_players)
+    print(f"Finished fetching all players ({stored}/{len(rankings)} stored)")
+    return stored
+
+
+# --------------- Calendars ---------------
+
+def _persist_calendars(batch):
+    import sqlalchemy as sqla
+    import batch_ics_generator as big
+    from calendar_manifest import publish_entries, store_calendar
+
+    output_dir = "ics_calendars"
+    os.makedirs(output_dir, exist_ok=True)
+    published = {}
+    session = sqla.orm.sessionmaker(bind=big.engine)()
+    try:
+        for run_id, player_id, ics_content, schedule, checked_at in batch:
+            schedule_row = session.query(big.IcsSchedule).filter_by(playerid=player_id).first() or big.IcsSchedule(player_id)
+            schedule_row.checked_at = checked_at
+            schedule_row.next_match = big._to_naive_utc(schedule.get('next_match'))
+            schedule_row.last_match = big._to_naive_utc(schedule.get('last_match'))
+            schedule_row.live = bool(schedule.get('live'))
+            session.add(schedule_row)
+
+            if ics_content:
+                published[player_id] = store_calendar(ics_content, output_dir)
+                session.merge(big.IcsLastUpdated(player_id, datetime.now()))
+
+            session.query(big.IcsBatchRunPlayer).filter(
+                big.IcsBatchRunPlayer.run_id == run_id,
+                big.IcsBatchRunPlayer.playerid == player_id
+            ).update({
+                big.IcsBatchRunPlayer.status: big.PLAYER_DONE,
+                big.IcsBatchRunPlayer.completed_at: datetime.utcnow(),
+                big.IcsBatchRunPlayer.error: None
+            }, synchronize_session=False)
+            session.query(big.IcsBatchRun).filter(big.IcsBatchRun.run_id == run_id).update(
+                {big.IcsBatchRun.updated_at: datetime.utcnow()}, synchronize_session=False)
+        # The whole batch becomes visible in one manifest version
+        if published:
+            version = publish_entries(output_dir, published, keep_newer=True)
+            print(f"✓ Published {len(published)} calendars (manifest v{version})")
+        session.commit()
+    except Exception as e:
+        print(f"Error storing calendar batch: {e}")
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+async def async_generate_all_players_calendars(year=None, player_ids=None, limiter=None, max_render_workers=2,
+                                               redo=None):
+    """
+    Async generate_all_players_calendars
+
+    Matches are fetched concurrently under the rate limit, the lookups each
+    calendar needs are prefetched here, calendars are rendered from them in a
+    process pool and files plus bookkeeping rows are written in batches.
+    Runs are checkpointed exactly like the synchronous generator.
+
+    Returns:
+        set: Players the run still has unfinished, or None if the rankings could not be read
+    """
+    import batch_ics_generator as big
+    from query_data import get_current_season, preload_lookup_caches
+    from player_matches_to_ics import prefetch_calendar_lookups, render_player_calendar
+
+    limiter = limiter or default_rate_limiter()
+    if year is None:
+        year = await asyncio.to_thread(get_current_season)
+
+    ranked = await asyncio.to_thread(big.query_all_ranking_players)
+    if not ranked:
+        print("No ranking players found or error occurred")
+        return None
+    players = ranked
+    if player_ids is not None:
+        wanted = set(player_ids)
+        players = [p for p in players if p.get('player_id') in wanted]
+
+    per_player_timeout = 300  # 5分钟
+    # 超过两倍超时仍标记为进行中的玩家视为中断
+    stale_before = datetime.utcnow() - timedelta(seconds=per_player_timeout * 2)
+    run_id, resumed = await asyncio.to_thread(
+        big.start_or_resume_run, year, [p.get('player_id') for p in players], redo=redo or ())
+    # Leftovers of a resumed run are processed too, so the run can finish
+    by_id = {p.get('player_id'): p for p in ranked}
+    todo = await asyncio.to_thread(big.unfinished_run_players, run_id)
+    for player_id in todo:
+        if player_id not in by_id:
+            await asyncio.to_thread(big.finish_run_player, run_id, player_id, big.PLAYER_DONE, "no longer ranked")
+    players = [by_id[player_id] for player_id in todo if player_id in by_id]
+    print(f"{'Resuming' if resumed else 'Starting'} batch run {run_id} ({len(players)} players)")
+
+    loop = asyncio.get_running_loop()
+    # Load (or refresh) the dimension store the lookups are prefetched from
+    await asyncio.to_thread(preload_lookup_caches, year)
+    render_pool = ProcessPoolExecutor(max_workers=max_render_workers, initializer=big.init_generation_worker)
+
+    def producer(player):
+        player_id = player.get('player_id')
+
+        async def produce(queue):
+            if big.format_player_name(player) is None:
+                print(f"Skipping player ID: {player_id} due to missing name info")
+                await asyncio.to_thread(big.finish_run_player, run_id, player_id, big.PLAYER_DONE, "missing name info")
+                return
+            if snooker_breaker.state == snooker_breaker.OPEN:
+                # Not claimed, so the player stays pending for the next run
+                raise CircuitOpenError(f"snooker.org circuit is open; skipped player {player_id}")
+            if not await asyncio.to_thread(big.claim_run_player, run_id, player_id, stale_before):
+                return
+            try:
+                matches = await call_api(limiter, 'player_matches', player_id, year)
+                lookups = await asyncio.to_thread(prefetch_calendar_lookups, player_id, matches)
+                ics_content, schedule = await asyncio.wait_for(
+                    loop.run_in_executor(render_pool, render_player_calendar, player_id, year, matches, lookups),
+                    timeout=per_player_timeout)
+            except CircuitOpenError:
+                # Leave the player for the next run; its last good calendar stays published
+                await asyncio.to_thread(big.finish_run_player, run_id, player_id, big.PLAYER_PENDING)
+                raise
+            except Exception as e:
+                await asyncio.to_thread(big.finish_run_player, run_id, player_id, big.PLAYER_FAILED, str(e) or type(e).__name__)
+                raise
+            await queue.put((run_id, player_id, ics_content, schedule, datetime.utcnow()))
+        return produce
+
+    try:
+        stored = await _run_pipeline([producer(p) for p in players], _persist_calendars)
+    finally:
+        render_pool.shutdown(wait=False, cancel_futures=True)
+    await asyncio.to_thread(big.close_run_if_finished, run_id)
+    print(f"\nCompleted: {stored}/{len(players)} players processed")
+    print(f"snooker.org connections: {transport_stats()}")
+    return set(await asyncio.to_thread(big.unfinished_run_players, run_id))
+
+
+def main():
+    jobs = {
+        'events': async_fetch_and_store_events,
+        'players': async_fetch_and_store_players,
+        'calendars': async_generate_all_players_calendars,
+    }
+    if len(sys.argv) < 2 or sys.argv[1] not in jobs:
+        print("Usage: python async_pipeline.py events|players|calendars")
+        sys.exit(1)
+    asyncio.run(jobs[sys.argv[1]]())
+
+
+if __name__ == '__main__':
+    main()
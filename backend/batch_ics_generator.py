@@ -5,11 +5,15 @@ import time
 import sqlalchemy as sqla
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from datetime import datetime
+from datetime import datetime, timezone, timedelta
 from player_matches_to_ics import generate_player_calendar
-from query_data import query_all_ranking_players,get_current_season
+from calendar_manifest import ManifestBatch, publish_calendar, store_calendar
+from upstream import snooker_breaker, reset_transport, CircuitOpenError
+from query_data import query_all_ranking_players,get_current_season,lookup_snapshot
 import multiprocessing
 import time
+import uuid
+from contextlib import nullcontext
 
 
 
@@ -44,6 +48,51 @@ class IcsLastUpdated(Base):
         self.playerid = pid
         self.lastupdated = lastupdated
 
+class IcsSchedule(Base):
+    """Per-player match timing seen at the last generation, used for refresh tiers."""
+    __tablename__ = 'icsschedule'
+    playerid = sqla.Column(sqla.Integer, primary_key=True)
+    checked_at = sqla.Column(sqla.DateTime)
+    next_match = sqla.Column(sqla.DateTime)
+    last_match = sqla.Column(sqla.DateTime)
+    live = sqla.Column(sqla.Boolean, default=False)
+
+    def __init__(self, pid):
+        self.playerid = pid
+
+class IcsBatchRun(Base):
+    """One batch generation pass; unfinished runs are resumed by the next pass."""
+    __tablename__ = 'icsbatchrun'
+    run_id = sqla.Column(sqla.String(36), primary_key=True)
+    kind = sqla.Column(sqla.String(16))
+    season = sqla.Column(sqla.Integer)
+    status = sqla.Column(sqla.String(16))
+    started_at = sqla.Column(sqla.DateTime)
+    updated_at = sqla.Column(sqla.DateTime)
+    finished_at = sqla.Column(sqla.DateTime)
+
+class IcsBatchRunPlayer(Base):
+    """Per-player checkpoint within a batch run."""
+    __tablename__ = 'icsbatchrunplayer'
+    run_id = sqla.Column(sqla.String(36), primary_key=True)
+    playerid = sqla.Column(sqla.Integer, primary_key=True)
+    position = sqla.Column(sqla.Integer)
+    status = sqla.Column(sqla.String(16))
+    started_at = sqla.Column(sqla.DateTime)
+    completed_at = sqla.Column(sqla.DateTime)
+    error = sqla.Column(sqla.Text)
+
+RUN_RUNNING = 'running'
+RUN_COMPLETED = 'completed'
+RUN_ABANDONED = 'abandoned'
+PLAYER_PENDING = 'pending'
+PLAYER_RUNNING = 'running'
+PLAYER_DONE = 'done'
+PLAYER_FAILED = 'failed'
+
+# A run with no player finished for this long is abandoned instead of resumed
+RUN_STALE_AFTER = timedelta(hours=6)
+
 def init_db():
     Base.metadata.create_all(engine)
 
@@ -59,18 +108,298 @@ def update_ics_last_updated(player_id, timestamp):
     session.commit()
     session.close()
 
+def _to_naive_utc(value):
+    """Store aware datetimes as naive UTC, matching the other DateTime columns."""
+    if value is None:
+        return None
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+def update_ics_schedule(player_id, schedule, checked_at):
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    record = session.query(IcsSchedule).filter_by(playerid=player_id).first()
+    if not record:
+        record = IcsSchedule(player_id)
+        session.add(record)
+    record.checked_at = checked_at
+    record.next_match = _to_naive_utc(schedule.get('next_match'))
+    record.last_match = _to_naive_utc(schedule.get('last_match'))
+    record.live = bool(schedule.get('live'))
+    session.commit()
+    session.close()
+
+def expire_ics_schedules(player_ids):
+    """Forget when these players were last checked, so the next tick treats their calendars as due."""
+    player_ids = list(player_ids)
+    if not player_ids:
+        return 0
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    try:
+        expired = session.query(IcsSchedule).filter(IcsSchedule.playerid.in_(player_ids)).update(
+            {IcsSchedule.checked_at: None}, synchronize_session=False)
+        session.commit()
+        return expired
+    finally:
+        session.close()
+
+def query_ics_schedules():
+    """Return {player_id: IcsSchedule} for every player checked so far."""
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    try:
+        return {record.playerid: record for record in session.query(IcsSchedule).all()}
+    finally:
+        session.close()
+
+def start_or_resume_run(year, player_ids, kind='batch', now=None, redo=()):
+    """
+    Resume the latest unfinished run of this kind for the season, or start a new one
+
+    Players not yet part of a resumed run are appended to it, so a tick that
+    picks up a crashed run still covers everything it was asked to do. The
+    run's `updated_at` only moves when a player finishes; a run that made no
+    progress for RUN_STALE_AFTER is marked abandoned instead of resumed, so its
+    leftover players cannot keep it open forever.
+
+    Args:
+        redo (iterable): Players to generate again even if a resumed run already
+                         finished them (e.g. their matches changed since)
+
+    Returns:
+        tuple: (run_id, resumed)
+    """
+    now = now or datetime.utcnow()
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    try:
+        session.query(IcsBatchRun).filter(
+            IcsBatchRun.kind == kind,
+            IcsBatchRun.season == year,
+            IcsBatchRun.status == RUN_RUNNING,
+            IcsBatchRun.updated_at < now - RUN_STALE_AFTER
+        ).update({
+            IcsBatchRun.status: RUN_ABANDONED,
+            IcsBatchRun.finished_at: now
+        }, synchronize_session=False)
+        run = session.query(IcsBatchRun).filter(
+            IcsBatchRun.kind == kind,
+            IcsBatchRun.season == year,
+            IcsBatchRun.status == RUN_RUNNING
+        ).order_by(IcsBatchRun.started_at.desc()).first()
+
+        resumed = run is not None
+        if run is None:
+            run = IcsBatchRun(run_id=str(uuid.uuid4()), kind=kind, season=year, status=RUN_RUNNING,
+                              started_at=now, updated_at=now)
+            session.add(run)
+            known = set()
+            position = 0
+        else:
+            rows = session.query(IcsBatchRunPlayer.playerid, IcsBatchRunPlayer.position).filter(
+                IcsBatchRunPlayer.run_id == run.run_id).all()
+            known = {row.playerid for row in rows}
+            position = max((row.position for row in rows), default=-1) + 1
+            redo = set(redo) & known
+            if redo:
+                session.query(IcsBatchRunPlayer).filter(
+                    IcsBatchRunPlayer.run_id == run.run_id,
+                    IcsBatchRunPlayer.playerid.in_(list(redo)),
+                    IcsBatchRunPlayer.status == PLAYER_DONE
+                ).update({IcsBatchRunPlayer.status: PLAYER_PENDING}, synchronize_session=False)
+
+        for player_id in player_ids:
+            if player_id in known:
+                continue
+            known.add(player_id)
+            session.add(IcsBatchRunPlayer(run_id=run.run_id, playerid=player_id, position=position,
+                                          status=PLAYER_PENDING))
+            position += 1
+        session.commit()
+        return run.run_id, resumed
+    finally:
+        session.close()
+
+def unfinished_run_players(run_id):
+    """Player IDs of the run that are not done yet (pending, in progress or failed), in run order."""
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    try:
+        rows = session.query(IcsBatchRunPlayer.playerid).filter(
+            IcsBatchRunPlayer.run_id == run_id,
+            IcsBatchRunPlayer.status != PLAYER_DONE
+        ).order_by(IcsBatchRunPlayer.position).all()
+        return [row.playerid for row in rows]
+    finally:
+        session.close()
+
+def claim_run_player(run_id, player_id, stale_before, now=None):
+    """
+    Mark a player as in progress unless it is done or another run worker holds it
+
+    A player left 'running' since before stale_before (crashed worker) or
+    'failed' is retried.
+    """
+    now = now or datetime.utcnow()
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    try:
+        claimed = session.query(IcsBatchRunPlayer).filter(
+            IcsBatchRunPlayer.run_id == run_id,
+            IcsBatchRunPlayer.playerid == player_id,
+            sqla.or_(
+                IcsBatchRunPlayer.status.in_([PLAYER_PENDING, PLAYER_FAILED]),
+                sqla.and_(IcsBatchRunPlayer.status == PLAYER_RUNNING,
+                          IcsBatchRunPlayer.started_at < stale_before)
+            )
+        ).update({
+            IcsBatchRunPlayer.status: PLAYER_RUNNING,
+            IcsBatchRunPlayer.started_at: now
+        }, synchronize_session=False)
+        session.commit()
+        return claimed == 1
+    finally:
+        session.close()
+
+def finish_run_player(run_id, player_id, status, error=None, now=None):
+    """Record a player's outcome; this is the run's progress mark that keeps it from going stale."""
+    now = now or datetime.utcnow()
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    try:
+        session.query(IcsBatchRunPlayer).filter(
+            IcsBatchRunPlayer.run_id == run_id,
+            IcsBatchRunPlayer.playerid == player_id
+        ).update({
+            IcsBatchRunPlayer.status: status,
+            IcsBatchRunPlayer.completed_at: now,
+            IcsBatchRunPlayer.error: error
+        }, synchronize_session=False)
+        session.query(IcsBatchRun).filter(IcsBatchRun.run_id == run_id).update(
+            {IcsBatchRun.updated_at: now}, synchronize_session=False)
+        session.commit()
+    finally:
+        session.close()
+
+def close_run_if_finished(run_id):
+    """Mark the run completed once no player is pending or in progress."""
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    try:
+        remaining = session.query(IcsBatchRunPlayer).filter(
+            IcsBatchRunPlayer.run_id == run_id,
+            IcsBatchRunPlayer.status.in_([PLAYER_PENDING, PLAYER_RUNNING])
+        ).count()
+        if remaining == 0:
+            now = datetime.utcnow()
+            session.query(IcsBatchRun).filter(IcsBatchRun.run_id == run_id).update({
+                IcsBatchRun.status: RUN_COMPLETED,
+                IcsBatchRun.updated_at: now,
+                IcsBatchRun.finished_at: now
+            }, synchronize_session=False)
+            session.commit()
+        return remaining == 0
+    finally:
+        session.close()
+
 # batch_ics_generator.py
 import multiprocessing
 import time
 
+def init_generation_worker():
+    """
+    生成子进程的初始化函数
+
+    fork 出的子进程继承了父进程连接池中的 MySQL 连接，与父进程共用会损坏连接，
+    因此丢弃继承的连接池（不关闭父进程的连接），子进程按需建立自己的连接。
+    API 客户端在每次调用时新建，不会共用父进程的 HTTP 会话。
+    维度存储由父进程在 fork 前通过 lookup_snapshot 加载，子进程写时复制共享；
+    异步流水线的渲染进程则直接收到预取好的查找结果，不需要维度存储。
+    """
+    import query_data
+    import fetch_players
+    for shared_engine in (engine, query_data.engine, fetch_players.engine):
+        shared_engine.dispose(close=False)
+    # 断路器由父进程判断；子进程继承的半开探测名额不应拦住这次请求
+    snooker_breaker.reset()
+    # 继承自父进程的 keep-alive 连接不能在两个进程间共用
+    reset_transport()
+
 def generate_player_calendar_with_timeout(player_id, year, timeout):
     """在独立进程中运行生成日历的函数"""
-    from player_matches_to_ics import generate_player_calendar
-    return generate_player_calendar(player_id, year)
+    from player_matches_to_ics import build_player_calendar
+    return build_player_calendar(player_id, year)
+
+def format_player_name(player):
+    """按 surname_first 拼接排名记录中的球员姓名，缺少姓名时返回 None"""
+    firstname = player.get('firstname')
+    lastname = player.get('lastname')
+    if not (firstname or lastname):
+        return None
+    if player.get('surname_first'):
+        return f"{lastname or ''} {firstname or ''}".strip()
+    return f"{firstname or ''} {lastname or ''}".strip()
+
+def generate_and_store_calendar(player_id, player_name, year, output_dir="ics_calendars", timeout=300,
+                                publisher=None):
+    """
+    在子进程中生成单个玩家的日历并写入 output_dir
+
+    Args:
+        publisher (ManifestBatch): 可选，日历交给它与其他玩家一起发布；默认立即单独发布
+
+    Returns:
+        bool: 成功写入日历返回 True，没有比赛返回 False
 
-def generate_all_players_calendars(year=None):
+    Raises:
+        multiprocessing.TimeoutError: 超过 timeout 秒仍未生成完成
+    """
+    # 使用多进程实现超时
+    with multiprocessing.Pool(1, initializer=init_generation_worker) as pool:
+        result = pool.apply_async(generate_player_calendar_with_timeout,
+                                 (player_id, year, timeout))
+
+        try:
+            # 等待结果，设置超时
+            ics_content, schedule = result.get(timeout=timeout)
+        except multiprocessing.TimeoutError:
+            print(f"✗ Timeout generating calendar for {player_name} (ID: {player_id}) after {timeout} seconds")
+            # 终止进程
+            pool.terminate()
+            pool.join()
+            raise
+
+    # 即使没有比赛也记录检查时间，避免该球员在每个周期都被重新生成
+    update_ics_schedule(player_id, schedule, datetime.utcnow())
+
+    if not ics_content:
+        print(f"⚠ No matches found for {player_name}")
+        return False
+
+    # 先写入内容寻址文件，再原子地发布清单，读取方不会看到写了一半的日历
+    if publisher is not None:
+        entry = store_calendar(ics_content, output_dir)
+        publisher.add(player_id, entry)
+    else:
+        entry = publish_calendar(player_id, ics_content, output_dir)
+
+    update_ics_last_updated(player_id, datetime.now())
+    print(f"✓ Saved: {player_id}.ics ({entry['event_count']} events, {entry['hash'][:12]})")
+    return True
+
+def generate_all_players_calendars(year=None, player_ids=None, player_guard=None, run_kind='batch', redo=None):
     """
     为所有活跃玩家生成ICS日历文件
+
+    Args:
+        year (int): 赛季，默认当前赛季
+        player_ids (iterable): 只为这些玩家生成（仍限于排名球员），默认全部
+        player_guard (callable): 可选，player_guard(player_id) 返回的上下文管理器包裹每个玩家的生成
+        run_kind (str): 检查点所属的运行类型，只有同类型的未完成运行会被续跑
+        redo (iterable): 即使续跑的运行中已完成也要重新生成的玩家（如比赛在此后有变化）
+
+    Returns:
+        set: 运行中仍未完成（待处理、失败或被其他进程占用）的玩家 ID；查询排名失败时返回 None
     """
     if year is None:
         from query_data import get_current_season
@@ -80,80 +409,94 @@ def generate_all_players_calendars(year=None):
     output_dir = f"ics_calendars"
     os.makedirs(output_dir, exist_ok=True)
 
-    players = query_all_ranking_players()
+    ranked = query_all_ranking_players()
 
-    if not players:
+    if not ranked:
         print("No ranking players found or error occurred")
-        return
+        return None
+
+    players = ranked
+    if player_ids is not None:
+        wanted = set(player_ids)
+        players = [p for p in players if p.get('player_id') in wanted]
 
     success_count = 0
-    total_count = len(players)
     
     # 设置每个玩家的超时时间（秒）
     per_player_timeout = 300  # 5分钟
+    # 超过两倍超时仍标记为进行中的玩家视为中断，可重新生成
+    stale_after = timedelta(seconds=per_player_timeout * 2)
 
-    for i, player in enumerate(players, 1):
-        player_id = player.get('player_id')
-        
-        # 处理玩家姓名
-        firstname = player.get('firstname')
-        lastname = player.get('lastname')
-        surname_first = player.get('surname_first')
+    run_id, resumed = start_or_resume_run(year, [p.get('player_id') for p in players], run_kind, redo=redo or ())
+    print(f"{'Resuming' if resumed else 'Starting'} batch run {run_id}")
+
+    # 续跑时连同检查点中上次留下的玩家一起处理，而不只是本次传入的玩家，运行才能结束
+    by_id = {p.get('player_id'): p for p in ranked}
+    todo = unfinished_run_players(run_id)
+    total_count = len(todo)
+
+    def published(player_ids):
+        # 日历随清单发布后才算完成，发布前中断的玩家会在续跑时重新生成
+        for published_id in player_ids:
+            finish_run_player(run_id, published_id, PLAYER_DONE)
+
+    # 在 fork 子进程之前加载（或按同步版本刷新）维度存储，所有子进程写时复制共享，而不是每个任务重新查询
+    # 清单每次发布都整体重写，所以成批发布，而不是每个玩家重写一次
+    with lookup_snapshot(year), ManifestBatch(output_dir, on_publish=published) as publisher:
+        for i, player_id in enumerate(todo, 1):
+            player = by_id.get(player_id)
+            if player is None:
+                print(f"[{i}/{total_count}] Skipping player ID: {player_id}: no longer ranked")
+                finish_run_player(run_id, player_id, PLAYER_DONE, "no longer ranked")
+                continue
         
-        if firstname or lastname:
-            if surname_first:
-                player_name = f"{lastname or ''} {firstname or ''}".strip()
-            else:
-                player_name = f"{firstname or ''} {lastname or ''}".strip()
-        else:
-            print(f"[{i}/{total_count}] Skipping player ID: {player_id} due to missing name info")
-            continue
+            # 处理玩家姓名
+            player_name = format_player_name(player)
+            if player_name is None:
+                print(f"[{i}/{total_count}] Skipping player ID: {player_id} due to missing name info")
+                finish_run_player(run_id, player_id, PLAYER_DONE, "missing name info")
+                continue
+
+            if not claim_run_player(run_id, player_id, datetime.utcnow() - stale_after):
+                print(f"[{i}/{total_count}] Skipping {player_name} (ID: {player_id}): in progress in run {run_id}")
+                continue
             
-        print(f"[{i}/{total_count}] Generating calendar for {player_name} (ID: {player_id})...")
+            print(f"[{i}/{total_count}] Generating calendar for {player_name} (ID: {player_id})...")
         
-        try:
-            # 使用多进程实现超时
-            with multiprocessing.Pool(1) as pool:
-                result = pool.apply_async(generate_player_calendar_with_timeout, 
-                                         (player_id, year, per_player_timeout))
-                
-                try:
-                    # 等待结果，设置超时
-                    ics_content = result.get(timeout=per_player_timeout)
-                    
-                    if ics_content:
-                        filename = f"{player_id}.ics"
-                        filepath = os.path.join(output_dir, filename)
-                        
-                        with open(filepath, 'wb') as f:
-                            f.write(ics_content)
-
-                        update_ics_last_updated(player_id, datetime.now())
-                        success_count += 1
-                        print(f"✓ Saved: {filepath}")
-                    else:
-                        print(f"⚠ No matches found for {player_name}")
-                        
-                except multiprocessing.TimeoutError:
-                    print(f"✗ Timeout generating calendar for {player_name} (ID: {player_id}) after {per_player_timeout} seconds")
-                    # 终止进程
-                    pool.terminate()
-                    pool.join()
-                    continue
-                    
-        except Exception as e:
-            print(f"✗ Error generating calendar for {player_name}: {e}")
-            # 记录详细错误信息以便调试
-            import traceback
-            traceback.print_exc()
-            continue
+            try:
+                guard = player_guard(player_id) if player_guard else nullcontext()
+                # 子进程里的请求失败会传回父进程，由父进程的断路器计数
+                with guard, snooker_breaker.call():
+                    stored = generate_and_store_calendar(player_id, player_name, year, output_dir,
+                                                         per_player_timeout, publisher=publisher)
+                if stored:
+                    success_count += 1
+                else:
+                    finish_run_player(run_id, player_id, PLAYER_DONE)
+            except CircuitOpenError as e:
+                # snooker.org 不可用：保留上次生成的日历，剩余玩家留在检查点中等待下次续跑
+                finish_run_player(run_id, player_id, PLAYER_PENDING)
+                print(f"✗ Stopping batch run {run_id}: {e}")
+                break
+            except multiprocessing.TimeoutError:
+                finish_run_player(run_id, player_id, PLAYER_FAILED, f"timeout after {per_player_timeout} seconds")
+                continue
+            except Exception as e:
+                print(f"✗ Error generating calendar for {player_name}: {e}")
+                # 记录详细错误信息以便调试
+                import traceback
+                traceback.print_exc()
+                finish_run_player(run_id, player_id, PLAYER_FAILED, str(e))
+                continue
         
-        # 添加延迟避免API限制
-        wait_time = int(api_config.get('request_delay_seconds', 1))
-        print(f"Waiting {wait_time} seconds...")
-        time.sleep(wait_time)
+            # 添加延迟避免API限制
+            wait_time = int(api_config.get('request_delay_seconds', 1))
+            print(f"Waiting {wait_time} seconds...")
+            time.sleep(wait_time)
     
+    close_run_if_finished(run_id)
     print(f"\nCompleted: {success_count}/{total_count} calendars generated successfully")
+    return set(unfinished_run_players(run_id))
     
 if __name__ == '__main__':
     init_db()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Garbage collection and reconciliation for ics_calendars/
+
+Retention policy: a published calendar is kept while its player is in the
+current rankings, or while it was requested or generated within the last
+`retention_days`. Everything else is unpublished, and content-addressed objects
+no manifest entry points at are deleted once they are older than a grace
+period (so an object written just before its manifest update is never lost).
+
+Flat <player_id>.ics files from before the manifest are removed once the
+manifest has superseded them, or under the same retention rule.
+
+Usage:
+    python calendar_gc.py [--retention-days N] [--dry-run]
+"""
+import argparse
+import os
+import re
+import time
+from datetime import datetime, timedelta
+
+from calendar_manifest import (
+    DEFAULT_DIR, OBJECTS_DIR, ManifestLock,
+    forget_access, load_access_log, load_manifest, remove_entries,
+)
+
+DEFAULT_RETENTION_DAYS = 30
+# Unreferenced objects and temp files younger than this may belong to a publish in progress
+DEFAULT_GRACE_SECONDS = 3600
+
+_LEGACY_NAME = re.compile(r"^(\d+)\.ics$")
+
+
+def _last_activity(player_id, entry, access):
+    """Most recent of generation and request, as a naive UTC datetime (or None)."""
+    times = []
+    if entry is not None and entry.get('generated_at'):
+        times.append(datetime.fromisoformat(entry['generated_at']))
+    if access.get(str(player_id)):
+        times.append(datetime.fromisoformat(access[str(player_id)]) + timedelta(days=1))
+    return max(times) if times else None
+
+
+def _remove(path, dry_run):
+    try:
+        size = os.path.getsize(path)
+        if not dry_run:
+            os.remove(path)
+        return size
+    except OSError:
+        return 0
+
+
+def reconcile_calendars(keep_ids, output_dir=DEFAULT_DIR, retention_days=DEFAULT_RETENTION_DAYS,
+                        grace_seconds=DEFAULT_GRACE_SECONDS, dry_run=False, now=None):
+    """
+    Apply the retention policy and sweep unreferenced files
+
+    Args:
+        keep_ids (iterable): Player IDs that are always kept (current rankings)
+        dry_run (bool): Report what would be removed without removing it
+        now (datetime): Naive UTC "now", for tests
+
+    Returns:
+        dict: pruned_players, removed_objects, removed_legacy, removed_tmp,
+        reclaimed_bytes and kept_players
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=retention_days)
+    keep_ids = {int(pid) for pid in keep_ids}
+    report = {'pruned_players': 0, 'removed_objects': 0, 'removed_legacy': 0,
+              'removed_tmp': 0, 'reclaimed_bytes': 0, 'kept_players': 0}
+    if not os.path.isdir(output_dir):
+        return report
+
+    manifest = load_manifest(output_dir)
+    access = load_access_log(output_dir)
+
+    expired = {}
+    for key, entry in manifest['calendars'].items():
+        player_id = int(key)
+        last_activity = _last_activity(player_id, entry, access)
+        if player_id in keep_ids or (last_activity is not None and last_activity >= cutoff):
+            report['kept_players'] += 1
+        else:
+            expired[player_id] = entry['hash']
+
+    pruned = list(expired) if dry_run else remove_entries(output_dir, expired)
+    report['pruned_players'] = len(pruned)
+    if pruned and not dry_run:
+        forget_access(output_dir, pruned)
+
+    # Legacy flat files: superseded by the manifest, or expired under the same rule
+    published = set(load_manifest(output_dir)['calendars']) - {str(pid) for pid in pruned}
+    for name in os.listdir(output_dir):
+        path = os.path.join(output_dir, name)
+        match = _LEGACY_NAME.match(name)
+        if match:
+            player_id = int(match.group(1))
+            if match.group(1) not in published:
+                if player_id in keep_ids:
+                    continue
+                last_activity = _last_activity(player_id, None, access)
+                mtime = datetime.utcfromtimestamp(os.path.getmtime(path))
+                if max(mtime, last_activity or mtime) >= cutoff:
+                    continue
+            report['reclaimed_bytes'] += _remove(path, dry_run)
+            report['removed_legacy'] += 1
+        elif name.endswith('.tmp') and time.time() - os.path.getmtime(path) > grace_seconds:
+            report['reclaimed_bytes'] += _remove(path, dry_run)
+            report['removed_tmp'] += 1
+
+    # Sweep objects under the manifest lock so nothing is published or reused (touched) mid-sweep
+    objects_root = os.path.join(output_dir, OBJECTS_DIR)
+    if os.path.isdir(objects_root):
+        with ManifestLock(output_dir):
+            referenced = {entry['hash'] for entry in load_manifest(output_dir)['calendars'].values()}
+            if dry_run:
+                referenced -= set(expired.values())
+            for shard in os.listdir(objects_root):
+                shard_dir = os.path.join(objects_root, shard)
+                if not os.path.isdir(shard_dir):
+                    # Temp files are written at the top of objects/ before they are sharded
+                    if shard.endswith('.tmp') and time.time() - os.path.getmtime(shard_dir) > grace_seconds:
+                        report['reclaimed_bytes'] += _remove(shard_dir, dry_run)
+                        report['removed_tmp'] += 1
+                    continue
+                for name in os.listdir(shard_dir):
+                    path = os.path.join(shard_dir, name)
+                    if name[:-len('.ics')] in referenced:
+                        continue
+                    if time.time() - os.path.getmtime(path) <= grace_seconds:
+                        continue
+                    report['reclaimed_bytes'] += _remove(path, dry_run)
+                    report['removed_objects'] += 1
+                if not dry_run and not os.listdir(shard_dir):
+                    os.rmdir(shard_dir)
+
+    return report
+
+
+def run_calendar_gc(retention_days=DEFAULT_RETENTION_DAYS, dry_run=False, output_dir=DEFAULT_DIR):
+    """Reconcile ics_calendars/ against the current rankings and print the report."""
+    from query_data import query_all_ranking_players
+
+    players = query_all_ranking_players()
+    if not players:
+        # Without the rankings every calendar would look unranked; do not prune
+        print("Could not load rankings; skipping calendar garbage collection")
+        return None
+    report = reconcile_calendars([p['player_id'] for p in players], output_dir,
+                                 retention_days=retention_days, dry_run=dry_run)
+    print(f"{'Would reclaim' if dry_run else 'Reclaimed'} {report['reclaimed_bytes'] / 1024:.1f} KiB: "
+          f"{report['pruned_players']} calendars unpublished, {report['removed_objects']} objects, "
+          f"{report['removed_legacy']} legacy files, {report['removed_tmp']} temp files removed; "
+          f"{report['kept_players']} calendars kept")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Garbage-collect ics_calendars/")
+    parser.add_argument('--retention-days', type=int, default=DEFAULT_RETENTION_DAYS)
+    parser.add_argument('--dry-run', action='store_true', help="report without removing anything")
+    args = parser.parse_args()
+    run_calendar_gc(args.retention_days, args.dry_run)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,421 @@
+"""
+Atomic, versioned publication of generated calendars
+
+Calendars are written once into content-addressed files under
+`ics_calendars/objects/<hash[:2]>/<hash>.ics` and then published by atomically
+replacing `ics_calendars/manifest.json`, which maps
+
+    player_id -> {hash, size, event_count, generated_at}
+
+Readers either see the previous manifest or the new one, and every object a
+manifest points at is complete, so there are no torn reads. Objects are
+sharded by the first two hex digits of their hash so no directory grows past a
+few hundred entries; `/static/<player_id>.ics` is resolved through the
+manifest. Flat `<player_id>.ics` files from before the manifest are still
+served until calendar_gc.py removes them.
+
+`access.json` records the last day each calendar was requested, so the
+garbage collector can apply its retention policy.
+
+Writers serialize manifest updates with an exclusive lock on
+`manifest.lock`, so the batch generator, the live job, queue workers and the
+API can publish concurrently.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX hosts fall back to an in-process lock
+    fcntl = None
+
+DEFAULT_DIR = "ics_calendars"
+MANIFEST_NAME = "manifest.json"
+ACCESS_LOG_NAME = "access.json"
+OBJECTS_DIR = "objects"
+
+_local_lock = threading.Lock()
+
+
+def object_path(output_dir, digest):
+    return os.path.join(output_dir, OBJECTS_DIR, digest[:2], f"{digest}.ics")
+
+
+def legacy_path(output_dir, player_id):
+    """Flat <player_id>.ics file written before calendars were published through the manifest."""
+    return os.path.join(output_dir, f"{player_id}.ics")
+
+
+def entry_etag(entry):
+    return f'"{entry["hash"][:32]}"'
+
+
+def load_manifest(output_dir=DEFAULT_DIR):
+    """Return the published manifest, or an empty one if nothing was published yet."""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'version': 0, 'published_at': None, 'calendars': {}}
+
+
+class ManifestLock:
+    """Exclusive lock across threads and processes sharing output_dir."""
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, 'manifest.lock')
+
+    def __enter__(self):
+        _local_lock.acquire()
+        if fcntl is not None:
+            self.fd = open(self.path, 'a')
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            self.fd.close()
+        _local_lock.release()
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _write_manifest(output_dir, manifest):
+    """Publish manifest as the next version. Caller holds the manifest lock."""
+    manifest['version'] = manifest.get('version', 0) + 1
+    manifest['published_at'] = datetime.utcnow().isoformat()
+    _write_atomic(os.path.join(output_dir, MANIFEST_NAME),
+                  json.dumps(manifest, separators=(',', ':')).encode('utf-8'))
+    return manifest['version']
+
+
+def publish_entries(output_dir, updates, keep_newer=False):
+    """
+    Merge {player_id: entry} into the manifest and publish it as one new version
+
+    With keep_newer, an entry is skipped if the manifest already holds one
+    generated later (published by another writer while this one waited).
+    """
+    with ManifestLock(output_dir):
+        manifest = load_manifest(output_dir)
+        for player_id, entry in updates.items():
+            current = manifest['calendars'].get(str(player_id))
+            if keep_newer and current is not None and current.get('generated_at', '') > entry['generated_at']:
+                continue
+            manifest['calendars'][str(player_id)] = entry
+        return _write_manifest(output_dir, manifest)
+
+
+def remove_entries(output_dir, expected):
+    """
+    Unpublish calendars, given {player_id: hash} as seen by the caller
+
+    Entries republished with a different hash in the meantime are left alone.
+
+    Returns:
+        list: The player IDs that were removed
+    """
+    with ManifestLock(output_dir):
+        manifest = load_manifest(output_dir)
+        removed = []
+        for player_id, digest in expected.items():
+            entry = manifest['calendars'].get(str(player_id))
+            if entry is not None and entry['hash'] == digest:
+                del manifest['calendars'][str(player_id)]
+                removed.append(player_id)
+        if removed:
+            _write_manifest(output_dir, manifest)
+    return removed
+
+
+def _store_object(output_dir, digest, tmp_path, attempts=3):
+    path = object_path(output_dir, digest)
+    for attempt in range(attempts):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            # Same content already stored; objects are immutable. Touch it so the garbage
+            # collector's grace period covers the publish that follows. The sweep holds the
+            # manifest lock from its mtime check to the unlink, so check and touch under it
+            # too: either the sweep removes the object first or it sees the new mtime.
+            with ManifestLock(output_dir):
+                reused = os.path.exists(path)
+                if reused:
+                    os.utime(path)
+            if reused:
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, path)
+            return path
+        except FileNotFoundError:
+            # The garbage collector removed the (then empty) shard directory or an
+            # unreferenced copy of this object in between; recreate it and retry
+            if attempt == attempts - 1 or not os.path.exists(tmp_path):
+                raise
+
+
+def store_calendar(ics_content, output_dir=DEFAULT_DIR, generated_at=None):
+    """
+    Write a calendar as a content-addressed object without publishing it
+
+    Returns:
+        dict: The manifest entry to pass to publish_entries()
+    """
+    digest = hashlib.sha256(ics_content).hexdigest()
+    os.makedirs(os.path.join(output_dir, OBJECTS_DIR), exist_ok=True)
+    tmp_path = os.path.join(output_dir, OBJECTS_DIR, f"{digest}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(ics_content)
+        f.flush()
+        os.fsync(f.fileno())
+    _store_object(output_dir, digest, tmp_path)
+    return {
+        'hash': digest,
+        'size': len(ics_content),
+        'event_count': ics_content.count(b'BEGIN:VEVENT'),
+        'generated_at': (generated_at or datetime.utcnow()).isoformat(),
+    }
+
+
+def publish_calendar(player_id, ics_content, output_dir=DEFAULT_DIR, generated_at=None):
+    """
+    Store a calendar as a content-addressed object and publish it in the manifest
+
+    Returns:
+        dict: The manifest entry for the player
+    """
+    entry = store_calendar(ics_content, output_dir, generated_at)
+    publish_entries(output_dir, {player_id: entry})
+    return entry
+
+
+class ManifestBatch:
+    """
+    Collects stored calendars and publishes them together
+
+    Every publish rewrites the whole manifest, so a run that published each
+    calendar on its own would write it once per player. Entries added here are
+    published as one new version once `max_entries` are waiting or the oldest
+    has waited `max_delay` seconds, and on flush() / leaving the `with` block.
+    A waiting entry never replaces a calendar another writer generated after it.
+    `on_publish(player_ids)` is called after each successful publish, so callers
+    can checkpoint players only once their calendar is actually visible.
+    """
+
+    def __init__(self, output_dir=DEFAULT_DIR, max_entries=50, max_delay=60.0, on_publish=None):
+        self.output_dir = output_dir
+        self.max_entries = max_entries
+        self.max_delay = max_delay
+        self.on_publish = on_publish
+        self._pending = {}
+        self._since = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+    def add(self, player_id, entry):
+        """Queue a manifest entry from store_calendar(); may publish the batch."""
+        if not self._pending:
+            self._since = time.monotonic()
+        self._pending[player_id] = entry
+        if len(self._pending) >= self.max_entries or time.monotonic() - self._since >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        """Publish everything waiting as one manifest version; returns the version or None."""
+        if not self._pending:
+            return None
+        pending = self._pending
+        version = publish_entries(self.output_dir, pending, keep_newer=True)
+        self._pending = {}
+        if self.on_publish is not None:
+            self.on_publish(list(pending))
+        return version
+
+
+def publish_calendar_stream(player_id, chunks, output_dir=DEFAULT_DIR):
+    """
+    Pass calendar chunks through while storing and publishing them
+
+    The calendar is only published once the last chunk has been written; if the
+    stream fails or is abandoned, the partial object is removed.
+
+    Yields:
+        bytes: The chunks from `chunks`, unchanged
+    """
+    os.makedirs(os.path.join(output_dir, OBJECTS_DIR), exist_ok=True)
+    tmp_path = os.path.join(output_dir, OBJECTS_DIR, f"stream-{player_id}.{os.getpid()}.{id(chunks)}.tmp")
+    hasher = hashlib.sha256()
+    size = 0
+    event_count = 0
+    published = False
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                hasher.update(chunk)
+                size += len(chunk)
+                event_count += chunk.count(b'BEGIN:VEVENT')
+                yield chunk
+            f.flush()
+            os.fsync(f.fileno())
+        digest = hasher.hexdigest()
+        _store_object(output_dir, digest, tmp_path)
+        publish_entries(output_dir, {player_id: {
+            'hash': digest,
+            'size': size,
+            'event_count': event_count,
+            'generated_at': datetime.utcnow().isoformat(),
+        }})
+        published = True
+    finally:
+        if not published and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class ManifestReader:
+    """
+    Cached view of the published manifest for the API
+
+    The manifest file is re-checked at most every `check_interval` seconds and
+    only re-parsed when its mtime changes, so most lookups touch no files.
+    """
+
+    def __init__(self, output_dir=DEFAULT_DIR, check_interval=1.0):
+        self.output_dir = output_dir
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._manifest = {'version': 0, 'published_at': None, 'calendars': {}}
+        self._mtime_ns = None
+        self._checked_at = 0.0
+
+    def current(self):
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            with self._lock:
+                if now - self._checked_at >= self.check_interval:
+                    self._reload_if_changed()
+                    self._checked_at = now
+        return self._manifest
+
+    def get(self, player_id):
+        return self.current()['calendars'].get(str(player_id))
+
+    def object_path(self, entry):
+        return object_path(self.output_dir, entry['hash'])
+
+    def invalidate(self):
+        """Force the next lookup to re-check the manifest file (e.g. after publishing)."""
+        self._checked_at = 0.0
+
+    def _reload_if_changed(self):
+        try:
+            mtime_ns = os.stat(os.path.join(self.output_dir, MANIFEST_NAME)).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if mtime_ns != self._mtime_ns:
+            self._manifest = load_manifest(self.output_dir)
+            self._mtime_ns = mtime_ns
+
+
+def load_access_log(output_dir=DEFAULT_DIR):
+    """Return {player_id: 'YYYY-MM-DD'} of the last day each calendar was requested."""
+    try:
+        with open(os.path.join(output_dir, ACCESS_LOG_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def forget_access(output_dir, player_ids):
+    with ManifestLock(output_dir):
+        access = load_access_log(output_dir)
+        if any(access.pop(str(pid), None) is not None for pid in list(player_ids)):
+            _write_atomic(os.path.join(output_dir, ACCESS_LOG_NAME),
+                          json.dumps(access, separators=(',', ':')).encode('utf-8'))
+
+
+class AccessLog:
+    """
+    Records which calendars are requested, at day granularity
+
+    Requests only touch an in-memory dict; the first request for a player on a
+    new day marks the log dirty, and it is merged into access.json at most
+    every `flush_interval` seconds. start() adds a background flush every
+    `flush_interval` so quiet periods are written too, and stop() flushes what
+    is left at shutdown.
+    """
+
+    def __init__(self, output_dir=DEFAULT_DIR, flush_interval=300.0):
+        self.output_dir = output_dir
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._seen = {}
+        self._dirty = {}
+        self._flushed_at = time.monotonic()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Flush in a background thread every flush_interval seconds until stop()."""
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._flush_periodically, name='access-log', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background flush and write out anything still buffered."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def record(self, player_id, today=None):
+        day = (today or datetime.utcnow().date()).isoformat()
+        key = str(player_id)
+        if self._seen.get(key) == day:
+            return
+        with self._lock:
+            self._seen[key] = day
+            self._dirty[key] = day
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            self._flushed_at = time.monotonic()
+        if not dirty or not os.path.isdir(self.output_dir):
+            return
+        try:
+            with ManifestLock(self.output_dir):
+                access = load_access_log(self.output_dir)
+                for key, day in dirty.items():
+                    if access.get(key, '') < day:
+                        access[key] = day
+                _write_atomic(os.path.join(self.output_dir, ACCESS_LOG_NAME),
+                              json.dumps(access, separators=(',', ':')).encode('utf-8'))
+        except OSError as e:
+            print(f"Error writing calendar access log: {e}")
+            with self._lock:
+                for key, day in dirty.items():
+                    self._dirty.setdefault(key, day)
@@ -0,0 +1,237 @@
+"""
+In-process store of hot calendar bodies for the API
+
+The same top-ranked players' calendars are requested over and over. Instead of
+opening and reading their files on every hit, the store keeps their bytes,
+ETag and a lazily built gzip variant in a byte-bounded LRU. A single os.stat
+per hit validates an entry against the file's mtime and size, so a regenerated
+calendar is picked up on the next request. Content-addressed files published
+through the manifest never change, so their hits skip the stat entirely.
+
+A file is only admitted on its second request within the admission window;
+one-off requests keep going through FileResponse, which can hand the file to
+the server as a zero-copy send where the server supports it.
+"""
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from email.utils import formatdate
+
+
+class CalendarEntry:
+    __slots__ = ('body', 'etag', 'last_modified', 'mtime_ns', 'size', 'gzip_body')
+
+    def __init__(self, body, stat_result):
+        self.body = body
+        self.mtime_ns = stat_result.st_mtime_ns
+        self.size = stat_result.st_size
+        self.etag = file_etag(stat_result)
+        self.last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+        self.gzip_body = None
+
+    @property
+    def nbytes(self):
+        return len(self.body) + (len(self.gzip_body) if self.gzip_body else 0)
+
+
+def file_etag(stat_result):
+    """Same ETag Starlette's FileResponse sends, so cold and hot hits validate alike."""
+    etag_base = str(stat_result.st_mtime) + "-" + str(stat_result.st_size)
+    return f'"{hashlib.md5(etag_base.encode(), usedforsecurity=False).hexdigest()}"'
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Whether an If-None-Match header matches etag
+
+    The header is `*` or a comma-separated list of entity tags; tags are
+    compared weakly (a `W/` prefix is ignored), as RFC 9110 requires for
+    If-None-Match. A tag that merely contains etag does not match.
+    """
+    if not if_none_match:
+        return False
+    etag = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def accepts_gzip(accept_encoding):
+    """
+    Whether an Accept-Encoding header allows a gzip response
+
+    `gzip` (or its alias `x-gzip`) must be listed with a non-zero q-value, or
+    be covered by `*` without being excluded explicitly; `gzip;q=0` refuses it.
+    """
+    if not accept_encoding:
+        return False
+    qvalues = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value.strip())
+                except ValueError:
+                    q = 0.0
+        qvalues[coding] = q
+    for coding in ('gzip', 'x-gzip'):
+        if coding in qvalues:
+            return qvalues[coding] > 0
+    return qvalues.get('*', 0) > 0
+
+
+class HotCalendarStore:
+    """
+    Byte-bounded LRU of calendar files, invalidated by mtime/size
+
+    Args:
+        max_bytes (int): Total bytes kept across bodies and gzip variants
+        max_entry_bytes (int): Files larger than this are never cached
+        admission_window (int): How many recent one-off misses are remembered for admission
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entry_bytes=2 * 1024 * 1024, admission_window=1024):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.admission_window = admission_window
+        self._entries = OrderedDict()
+        self._seen = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, filepath, immutable=False):
+        """
+        Return the cached entry for filepath, loading it if it has become hot
+
+        Args:
+            immutable (bool): The file is content-addressed; a cached entry is
+                returned without re-validating it against the file
+
+        Returns:
+            tuple: (entry or None, stat_result). entry is None for cold files;
+            both are None when the file does not exist. stat_result is also
+            None for immutable hits.
+        """
+        if immutable:
+            with self._lock:
+                entry = self._entries.get(filepath)
+                if entry is not None:
+                    self._entries.move_to_end(filepath)
+                    self.hits += 1
+                    return entry, None
+        try:
+            stat_result = os.stat(filepath)
+        except OSError:
+            self.invalidate(filepath)
+            return None, None
+
+        with self._lock:
+            entry = self._entries.get(filepath)
+            if entry is not None:
+                if entry.mtime_ns == stat_result.st_mtime_ns and entry.size == stat_result.st_size:
+                    self._entries.move_to_end(filepath)
+                    self.hits += 1
+                    return entry, stat_result
+                self._remove(filepath)
+
+            self.misses += 1
+            if stat_result.st_size > self.max_entry_bytes or not self._admit(filepath, stat_result):
+                return None, stat_result
+
+        return self._load(filepath), stat_result
+
+    def preload(self, filepath):
+        """
+        Load a file without waiting for its second request (startup warm-up)
+
+        Files that are too large, or that would push out entries already cached, are skipped.
+
+        Returns:
+            bool: Whether the file is cached now
+        """
+        try:
+            size = os.stat(filepath).st_size
+        except OSError:
+            return False
+        with self._lock:
+            if filepath in self._entries:
+                return True
+            if size > self.max_entry_bytes or self._bytes + size > self.max_bytes:
+                return False
+        return self._load(filepath) is not None
+
+    def gzip_body(self, filepath, entry):
+        """Compressed variant of an entry, built once and charged to the byte budget."""
+        if entry.gzip_body is None:
+            compressed = gzip.compress(entry.body, compresslevel=6)
+            with self._lock:
+                if entry.gzip_body is None:
+                    entry.gzip_body = compressed
+                    if self._entries.get(filepath) is entry:
+                        self._bytes += len(compressed)
+                        self._evict()
+        return entry.gzip_body
+
+    def invalidate(self, filepath):
+        with self._lock:
+            self._remove(filepath)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._seen.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'hits': self.hits, 'misses': self.misses}
+
+    def _admit(self, filepath, stat_result):
+        """Second request for the same version of a file makes it hot. Caller holds the lock."""
+        if self._seen.pop(filepath, None) == stat_result.st_mtime_ns:
+            return True
+        self._seen[filepath] = stat_result.st_mtime_ns
+        while len(self._seen) > self.admission_window:
+            self._seen.popitem(last=False)
+        return False
+
+    def _load(self, filepath):
+        try:
+            with open(filepath, 'rb') as f:
+                stat_result = os.fstat(f.fileno())
+                body = f.read()
+        except OSError:
+            return None
+        entry = CalendarEntry(body, stat_result)
+        with self._lock:
+            self._remove(filepath)
+            self._entries[filepath] = entry
+            self._bytes += entry.nbytes
+            self._evict()
+        return entry
+
+    def _remove(self, filepath):
+        entry = self._entries.pop(filepath, None)
+        if entry is not None:
+            self._bytes -= entry.nbytes
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.nbytes
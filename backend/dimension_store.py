@@ -0,0 +1,123 @@
+"""
+Read-mostly in-memory store of the dimension tables (players, events, rounds, rankings)
+
+Each row is kept as a compact `__slots__` record built once when the store is
+loaded, so a lookup is a dict probe that hands back an existing object instead
+of building a dict from an ORM row. Records are read-only mappings with the
+same keys the lookup dicts always had (`info['lastname']`, `info.get('born')`),
+so callers do not change.
+
+A store is an immutable snapshot of one sync version: query_data loads a new
+one when the `infolastupdated` timestamps of players or events move, and swaps
+it in with a single assignment. Readers that already hold the old store finish
+with it; nothing is ever updated in place. Forked generator processes inherit
+the loaded store and share it copy-on-write.
+"""
+from collections.abc import Mapping
+
+
+class Record(Mapping):
+    """Immutable mapping over the record's slots."""
+    __slots__ = ()
+    _fields = frozenset()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in self._fields:
+            return getattr(self, key)
+        return default
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+    def __reduce__(self):
+        # Pickled when sent to or from worker processes
+        return type(self), tuple(getattr(self, name) for name in self.__slots__)
+
+
+class PlayerRecord(Record):
+    __slots__ = ('type', 'firstname', 'lastname', 'surname_first', 'nationality', 'born', 'num_ranking_titles')
+    _fields = frozenset(__slots__)
+
+
+class EventRecord(Record):
+    __slots__ = ('name', 'start_date', 'end_date', 'season', 'type', 'venue', 'city', 'country', 'sex',
+                 'age_group', 'url', 'stage', 'ranking_type', 'defending_champion')
+    _fields = frozenset(__slots__)
+
+
+class RoundRecord(Record):
+    __slots__ = ('round_name', 'distance', 'main_event', 'note', 'value_type', 'rank', 'money',
+                 'seed_gets_half', 'actual_money', 'currency')
+    _fields = frozenset(__slots__)
+
+
+class RankingRecord(Record):
+    __slots__ = ('position', 'sum_value', 'player_id')
+    _fields = frozenset(__slots__)
+
+
+class DimensionStore:
+    """
+    One loaded snapshot of the dimension tables
+
+    Args:
+        version: Sync version the snapshot was loaded at (compared, never interpreted)
+        season (int): Season whose events and rounds were loaded; None for all seasons
+        players (dict): {player_id: PlayerRecord}
+        events (dict): {event_id: EventRecord}
+        rounds (dict): {event_id: {round: RoundRecord}}
+        ranked (list): RankingRecords ordered by position
+    """
+    __slots__ = ('version', 'season', 'players', 'events', 'rounds', 'rankings', 'ranked')
+
+    def __init__(self, version, season, players, events, rounds, ranked):
+        self.version = version
+        self.season = season
+        self.players = players
+        self.events = events
+        self.rounds = rounds
+        self.ranked = tuple(ranked)
+        # A player's best position wins if the table lists them twice
+        rankings = {}
+        for ranking in self.ranked:
+            rankings.setdefault(ranking.player_id, ranking)
+        self.rankings = rankings
+
+    def player(self, player_id):
+        return self.players.get(player_id)
+
+    def event(self, event_id):
+        return self.events.get(event_id)
+
+    def round(self, event_id, round_num):
+        # Nested dicts, so the lookup does not build an (event, round) key
+        event_rounds = self.rounds.get(event_id)
+        return event_rounds.get(round_num) if event_rounds is not None else None
+
+    def ranking(self, player_id):
+        return self.rankings.get(player_id)
+
+    def summary(self):
+        return (f"{len(self.players)} players, {len(self.events)} events, "
+                f"{sum(len(r) for r in self.rounds.values())} rounds, {len(self.ranked)} rankings")
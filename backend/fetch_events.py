@@ -1,7 +1,7 @@
 import configparser
 import sqlalchemy as sqla
 import time
-from snooker.api import SnookerOrgApi
+from upstream import create_snooker_client, snooker_breaker, CircuitOpenError
 from query_data import get_current_season
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -165,7 +165,7 @@ def fetch_single_event(event_data, client=None, session=None):
     """
     # Initialize client if not provided
     if client is None:
-        client = SnookerOrgApi(headers={'X-Requested-By': api_config['x_requested_by']})
+        client = create_snooker_client()
 
     # Initialize session if not provided
     if session is None:
@@ -213,7 +213,7 @@ def fetch_and_store_events(season=None):
         season (int): The season year to fetch events for
     """
     # Initialize API client
-    client = SnookerOrgApi(headers={'X-Requested-By': api_config['x_requested_by']})
+    client = create_snooker_client()
     if season is None:
         season = get_current_season()
     # Get events for the season
@@ -228,6 +228,10 @@ def fetch_and_store_events(season=None):
     for i, event_data in enumerate(events):
         success = fetch_single_event(event_data, client=client, session=session)
         if not success:
+            if snooker_breaker.state == snooker_breaker.OPEN:
+                # The remaining events would fail too; keep what is stored and let the next run retry
+                session.close()
+                raise CircuitOpenError(f"snooker.org circuit opened after {i}/{len(events)} events")
             continue
 
         # Wait between requests (except for the last one)
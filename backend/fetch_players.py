@@ -1,7 +1,7 @@
 import configparser
 import sqlalchemy as sqla
 import time
-from snooker.api import SnookerOrgApi
+from upstream import create_snooker_client, snooker_breaker, CircuitOpenError
 from sqlalchemy.ext.declarative import declarative_base
 from query_data import get_current_season
 # Function to load configuration from config.txt
@@ -115,7 +115,7 @@ def fetch_single_player(player_id, client=None, session=None):
     """
     # Initialize client if not provided
     if client is None:
-        client = SnookerOrgApi(headers={'X-Requested-By': api_config['x_requested_by']})
+        client = create_snooker_client()
 
     # Initialize session if not provided
     if session is None:
@@ -150,7 +150,7 @@ def fetch_single_player(player_id, client=None, session=None):
 
 def fetch_and_store_players():
     # Initialize API client
-    client = SnookerOrgApi(headers={'X-Requested-By': api_config['x_requested_by']})
+    client = create_snooker_client()
 
     # Get rankings
     rankings = client.rankings(api_config['ranking_type'], get_current_season())
@@ -174,6 +174,10 @@ def fetch_and_store_players():
 
         success = fetch_single_player(player_id, client=client, session=session)
         if not success:
+            if snooker_breaker.state == snooker_breaker.OPEN:
+                # The remaining players would fail too; keep what is stored and let the next run retry
+                session.close()
+                raise CircuitOpenError(f"snooker.org circuit opened after {i}/{len(rankings)} players")
             continue
 
         # Wait between requests (except for the last one)
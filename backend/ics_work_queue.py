@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+DB-backed work queue for generating calendars on several scheduler nodes
+
+Each player is one row in `icsworkqueue`. Workers claim disjoint batches by
+taking a time-limited lease, extend it with heartbeats while they work and
+report the result. A lease that expires (crashed or stalled worker) is picked
+up again by any other worker.
+
+Usage:
+    python ics_work_queue.py enqueue [--db-url URL]
+    python ics_work_queue.py worker [--db-url URL] [--batch-size N] [--drain]
+    python ics_work_queue.py stats [--db-url URL]
+"""
+import argparse
+import configparser
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+import sqlalchemy as sqla
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+from upstream import CircuitOpenError, snooker_breaker
+
+Base = declarative_base()
+
+STATUS_PENDING = 'pending'
+STATUS_LEASED = 'leased'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+class IcsWorkItem(Base):
+    __tablename__ = 'icsworkqueue'
+    playerid = sqla.Column(sqla.Integer, primary_key=True)
+    status = sqla.Column(sqla.String(16), nullable=False, default=STATUS_PENDING, index=True)
+    lease_owner = sqla.Column(sqla.String(255))
+    lease_expires = sqla.Column(sqla.DateTime)
+    heartbeat_at = sqla.Column(sqla.DateTime)
+    attempts = sqla.Column(sqla.Integer, nullable=False, default=0)
+    last_error = sqla.Column(sqla.Text)
+    enqueued_at = sqla.Column(sqla.DateTime)
+    finished_at = sqla.Column(sqla.DateTime)
+
+
+def load_config(filename='config.txt'):
+    config = configparser.ConfigParser()
+    config.read(filename)
+
+    # Load database configuration
+    db_config = {key: value for key, value in config['database'].items()}
+
+    # Load API configuration
+    api_config = {key: value for key, value in config['api'].items()}
+
+    return db_config, api_config
+
+
+def create_queue_engine(url=None):
+    """
+    Create the engine the queue lives in
+
+    Args:
+        url (str): SQLAlchemy URL, e.g. sqlite:///queue.db for local testing.
+                   Defaults to `queue_url` in config.txt, then the main MySQL database.
+    """
+    if url is None:
+        db_config, _ = load_config()
+        url = db_config.get('queue_url') or (
+            f"mysql+pymysql://{db_config['user']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}"
+        )
+    if url.startswith('sqlite'):
+        return sqla.create_engine(url)
+    return sqla.create_engine(url, pool_size=10, max_overflow=-1, pool_pre_ping=True, pool_recycle=3600)
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class WorkQueue:
+    """
+    Per-player leases over the icsworkqueue table
+
+    Claims use a conditional UPDATE per row, so two workers racing for the same
+    player cannot both win, on SQLite and MySQL alike.
+    """
+
+    def __init__(self, engine, lease_seconds=600, max_attempts=3):
+        self.engine = engine
+        self.lease = timedelta(seconds=lease_seconds)
+        self.max_attempts = max_attempts
+        self.Session = sessionmaker(bind=engine)
+
+    def init_db(self):
+        Base.metadata.create_all(self.engine)
+
+    def enqueue(self, player_ids, now=None):
+        """Queue players for generation; players currently under a live lease are left alone."""
+        now = now or datetime.utcnow()
+        player_ids = list(player_ids)
+        session = self.Session()
+        try:
+            existing = {
+                item.playerid: item
+                for item in session.query(IcsWorkItem).filter(IcsWorkItem.playerid.in_(player_ids))
+            }
+            queued = 0
+            for player_id in player_ids:
+                item = existing.get(player_id)
+                if item is None:
+                    session.add(IcsWorkItem(playerid=player_id, status=STATUS_PENDING, attempts=0, enqueued_at=now))
+                elif item.status == STATUS_LEASED and item.lease_expires and item.lease_expires > now:
+                    continue
+                else:
+                    item.status = STATUS_PENDING
+                    item.attempts = 0
+                    item.lease_owner = None
+                    item.lease_expires = None
+                    item.enqueued_at = now
+                queued += 1
+            session.commit()
+            return queued
+        except sqla.exc.IntegrityError:
+            # Another instance inserted one of the new players first; redo the batch row by row
+            session.rollback()
+            return sum(self._enqueue_one(session, player_id, now) for player_id in player_ids)
+        finally:
+            session.close()
+
+    def _enqueue_one(self, session, player_id, now):
+        """Re-queue or insert one player in its own transaction; returns False if it is under a live lease."""
+        requeue = {
+            IcsWorkItem.status: STATUS_PENDING,
+            IcsWorkItem.attempts: 0,
+            IcsWorkItem.lease_owner: None,
+            IcsWorkItem.lease_expires: None,
+            IcsWorkItem.enqueued_at: now,
+        }
+        not_leased = sqla.or_(
+            IcsWorkItem.status != STATUS_LEASED,
+            IcsWorkItem.lease_expires.is_(None),
+            IcsWorkItem.lease_expires <= now,
+        )
+        # A concurrent insert of the same player makes the second attempt an update
+        for _ in range(2):
+            updated = session.query(IcsWorkItem).filter(
+                IcsWorkItem.playerid == player_id, not_leased
+            ).update(requeue, synchronize_session=False)
+            if updated:
+                session.commit()
+                return True
+            if session.query(IcsWorkItem.playerid).filter(IcsWorkItem.playerid == player_id).first():
+                session.rollback()
+                return False
+            try:
+                session.add(IcsWorkItem(playerid=player_id, status=STATUS_PENDING, attempts=0, enqueued_at=now))
+                session.commit()
+                return True
+            except sqla.exc.IntegrityError:
+                session.rollback()
+        return False
+
+    def claim(self, worker_id, limit, now=None):
+        """Lease up to `limit` pending or expired players to `worker_id`; returns their IDs."""
+        now = now or datetime.utcnow()
+        claimable = sqla.or_(
+            IcsWorkItem.status == STATUS_PENDING,
+            sqla.and_(IcsWorkItem.status == STATUS_LEASED, IcsWorkItem.lease_expires < now),
+        )
+        session = self.Session()
+        try:
+            # Leases that keep expiring on the same player give up after max_attempts
+            session.query(IcsWorkItem).filter(
+                IcsWorkItem.status == STATUS_LEASED,
+                IcsWorkItem.lease_expires < now,
+                IcsWorkItem.attempts >= self.max_attempts,
+            ).update({
+                IcsWorkItem.status: STATUS_FAILED,
+                IcsWorkItem.last_error: 'lease expired',
+                IcsWorkItem.lease_owner: None,
+                IcsWorkItem.lease_expires: None,
+            }, synchronize_session=False)
+            session.commit()
+
+            # Over-fetch a little: other workers may win some of these rows
+            candidates = [
+                row.playerid for row in session.query(IcsWorkItem.playerid)
+                .filter(claimable)
+                .order_by(IcsWorkItem.enqueued_at, IcsWorkItem.playerid)
+                .limit(limit * 2)
+            ]
+            claimed = []
+            for player_id in candidates:
+                if len(claimed) >= limit:
+                    break
+                won = session.query(IcsWorkItem).filter(
+                    IcsWorkItem.playerid == player_id, claimable
+                ).update({
+                    IcsWorkItem.status: STATUS_LEASED,
+                    IcsWorkItem.lease_owner: worker_id,
+                    IcsWorkItem.lease_expires: now + self.lease,
+                    IcsWorkItem.heartbeat_at: now,
+                    IcsWorkItem.attempts: IcsWorkItem.attempts + 1,
+                }, synchronize_session=False)
+                session.commit()
+                if won == 1:
+                    claimed.append(player_id)
+            return claimed
+        finally:
+            session.close()
+
+    def heartbeat(self, worker_id, player_ids, now=None):
+        """Extend the leases `worker_id` still holds; returns how many were extended."""
+        now = now or datetime.utcnow()
+        if not player_ids:
+            return 0
+        session = self.Session()
+        try:
+            extended = session.query(IcsWorkItem).filter(
+                IcsWorkItem.playerid.in_(list(player_ids)),
+                IcsWorkItem.status == STATUS_LEASED,
+                IcsWorkItem.lease_owner == worker_id,
+            ).update({
+                IcsWorkItem.lease_expires: now + self.lease,
+                IcsWorkItem.heartbeat_at: now,
+            }, synchronize_session=False)
+            session.commit()
+            return extended
+        finally:
+            session.close()
+
+    def complete(self, worker_id, player_id, ok, error=None, now=None):
+        """
+        Report a leased player's result
+
+        Failed players go back to pending until max_attempts is reached.
+        Returns False if the lease was lost to another worker in the meantime.
+        """
+        now = now or datetime.utcnow()
+        session = self.Session()
+        try:
+            item = session.query(IcsWorkItem).filter(
+                IcsWorkItem.playerid == player_id,
+                IcsWorkItem.status == STATUS_LEASED,
+                IcsWorkItem.lease_owner == worker_id,
+            ).first()
+            if item is None:
+                return False
+            if ok:
+                item.status = STATUS_DONE
+                item.last_error = None
+            elif item.attempts >= self.max_attempts:
+                item.status = STATUS_FAILED
+                item.last_error = error
+            else:
+                item.status = STATUS_PENDING
+                item.last_error = error
+            item.lease_owner = None
+            item.lease_expires = None
+            item.finished_at = now
+            session.commit()
+            return True
+        finally:
+            session.close()
+
+    def release(self, worker_id, player_ids):
+        """Hand leased players back without counting the attempt (e.g. the upstream is down)."""
+        session = self.Session()
+        try:
+            released = session.query(IcsWorkItem).filter(
+                IcsWorkItem.playerid.in_(list(player_ids)),
+                IcsWorkItem.status == STATUS_LEASED,
+                IcsWorkItem.lease_owner == worker_id,
+            ).update({
+                IcsWorkItem.status: STATUS_PENDING,
+                IcsWorkItem.lease_owner: None,
+                IcsWorkItem.lease_expires: None,
+                IcsWorkItem.attempts: IcsWorkItem.attempts - 1,
+            }, synchronize_session=False)
+            session.commit()
+            return released
+        finally:
+            session.close()
+
+    def unfinished(self, player_ids, enqueued_since):
+        """
+        Players not generated since they were queued at enqueued_since
+
+        Pending, failed, still leased and unknown players count, and so does a
+        player done by a lease that was already running when it was queued.
+        """
+        player_ids = list(player_ids)
+        session = self.Session()
+        try:
+            done = {row[0] for row in session.query(IcsWorkItem.playerid).filter(
+                IcsWorkItem.playerid.in_(player_ids),
+                IcsWorkItem.status == STATUS_DONE,
+                IcsWorkItem.enqueued_at >= enqueued_since,
+            )}
+            return set(player_ids) - done
+        finally:
+            session.close()
+
+    def stats(self):
+        """Return {status: count}."""
+        session = self.Session()
+        try:
+            rows = session.query(IcsWorkItem.status, sqla.func.count()).group_by(IcsWorkItem.status).all()
+            return {status: count for status, count in rows}
+        finally:
+            session.close()
+
+
+class _Heartbeat(threading.Thread):
+    """Keeps a worker's current batch leased while it is being processed."""
+
+    def __init__(self, queue, worker_id, player_ids):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.worker_id = worker_id
+        self.player_ids = set(player_ids)
+        self.stopped = threading.Event()
+        self.interval = max(queue.lease.total_seconds() / 3, 1)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.queue.heartbeat(self.worker_id, list(self.player_ids))
+            except Exception as e:
+                print(f"Heartbeat failed for {self.worker_id}: {e}")
+
+    def done(self, player_id):
+        self.player_ids.discard(player_id)
+
+    def stop(self):
+        self.stopped.set()
+
+
+def generate_queued_player(player_id, year=None):
+    """Default work function: generate and store one player's calendar."""
+    from batch_ics_generator import generate_and_store_calendar, format_player_name
+    from query_data import query_player_info, get_current_season
+
+    if year is None:
+        year = get_current_season()
+    player_name = format_player_name(query_player_info(player_id) or {}) or f"Player {player_id}"
+    os.makedirs("ics_calendars", exist_ok=True)
+    with snooker_breaker.call():
+        return generate_and_store_calendar(player_id, player_name, year)
+
+
+def run_worker(queue, worker_id=None, batch_size=5, process=None, drain=False, idle_sleep=30):
+    """
+    Claim and process batches until the queue is empty (drain=True) or forever
+
+    Args:
+        queue (WorkQueue): Queue to work on
+        worker_id (str): Lease owner name, defaults to host:pid
+        batch_size (int): Players claimed per lease
+        process (callable): process(player_id) -> bool, defaults to generate_queued_player
+        drain (bool): Return once nothing is claimable instead of polling
+        idle_sleep (int): Seconds to wait between polls of an empty queue
+
+    Returns:
+        int: Number of players processed successfully
+    """
+    worker_id = worker_id or default_worker_id()
+    process = process or generate_queued_player
+    success_count = 0
+
+    while True:
+        claimed = queue.claim(worker_id, batch_size)
+        if not claimed:
+            if drain:
+                return success_count
+            time.sleep(idle_sleep)
+            continue
+
+        print(f"[{worker_id}] Claimed {len(claimed)} players: {claimed}")
+        heartbeat = _Heartbeat(queue, worker_id, claimed)
+        heartbeat.start()
+        circuit_open = False
+        try:
+            for index, player_id in enumerate(claimed):
+                try:
+                    ok, error = bool(process(player_id)), None
+                except CircuitOpenError as e:
+                    # Give the rest of the batch back untouched; other workers see the same outage
+                    print(f"✗ {e}; releasing {len(claimed) - index} players")
+                    heartbeat.stop()
+                    queue.release(worker_id, claimed[index:])
+                    circuit_open = True
+                    break
+                except Exception as e:
+                    print(f"✗ Error generating calendar for player {player_id}: {e}")
+                    ok, error = False, str(e)
+                heartbeat.done(player_id)
+                if not queue.complete(worker_id, player_id, ok, error):
+                    print(f"⚠ Lease on player {player_id} was lost before completion")
+                elif ok:
+                    success_count += 1
+        finally:
+            heartbeat.stop()
+        if circuit_open:
+            if drain:
+                return success_count
+            time.sleep(idle_sleep)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calendar generation work queue")
+    parser.add_argument('command', choices=['enqueue', 'worker', 'stats'])
+    parser.add_argument('--db-url', default=None, help="SQLAlchemy URL, defaults to config.txt")
+    parser.add_argument('--batch-size', type=int, default=5)
+    parser.add_argument('--lease-seconds', type=int, default=600)
+    parser.add_argument('--drain', action='store_true', help="exit once the queue is empty")
+    args = parser.parse_args()
+
+    queue = WorkQueue(create_queue_engine(args.db_url), lease_seconds=args.lease_seconds)
+    queue.init_db()
+
+    if args.command == 'enqueue':
+        from query_data import query_all_ranking_players
+        player_ids = [p['player_id'] for p in query_all_ranking_players()]
+        print(f"Queued {queue.enqueue(player_ids)} players")
+    elif args.command == 'worker':
+        count = run_worker(queue, batch_size=args.batch_size, drain=args.drain)
+        print(f"Completed: {count} calendars generated successfully")
+    else:
+        print(queue.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Match change feed
+
+Every match sync diffs the matches fetched from snooker.org against the last
+stored state of each match (`matchstate`) and appends one row per change to
+`matchchange`:
+
+- new: the match was not seen before
+- players: the line-up changed (e.g. a qualifier was drawn in)
+- rescheduled: the scheduled or start time moved
+- score: the score or the running status changed before there is a winner
+- result: a winner or an end time was recorded
+
+Consumers (the calendar generator, /api/changes) read the log by its
+auto-increment id. Each named consumer keeps a cursor in `matchchangecursor`,
+so it only sees changes it has not processed yet. Players a consumer could
+not process are kept in `matchchangeretry` and handed to it again with the
+next pending changes, so the cursor can move on without losing them.
+
+Usage:
+    python match_changes.py sync [--db-url URL]
+    python match_changes.py show [--db-url URL] [--since ID]
+"""
+import argparse
+import time
+from datetime import datetime
+import sqlalchemy as sqla
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+Base = declarative_base()
+
+CHANGE_NEW = 'new'
+CHANGE_PLAYERS = 'players'
+CHANGE_RESCHEDULED = 'rescheduled'
+CHANGE_SCORE = 'score'
+CHANGE_RESULT = 'result'
+
+DEFAULT_CONSUMER = 'calendars'
+
+
+class MatchState(Base):
+    __tablename__ = 'matchstate'
+    match_id = sqla.Column(sqla.Integer, primary_key=True)
+    event_id = sqla.Column(sqla.Integer, index=True)
+    round = sqla.Column(sqla.Integer)
+    number = sqla.Column(sqla.Integer)
+    player1_id = sqla.Column(sqla.Integer)
+    player2_id = sqla.Column(sqla.Integer)
+    score1 = sqla.Column(sqla.Integer)
+    score2 = sqla.Column(sqla.Integer)
+    winner_id = sqla.Column(sqla.Integer)
+    status = sqla.Column(sqla.Integer)
+    unfinished = sqla.Column(sqla.Boolean)
+    scheduled_date = sqla.Column(sqla.String(32))
+    start_date = sqla.Column(sqla.String(32))
+    end_date = sqla.Column(sqla.String(32))
+    updated_at = sqla.Column(sqla.DateTime)
+
+
+class MatchChange(Base):
+    __tablename__ = 'matchchange'
+    id = sqla.Column(sqla.Integer, primary_key=True, autoincrement=True)
+    match_id = sqla.Column(sqla.Integer, nullable=False, index=True)
+    event_id = sqla.Column(sqla.Integer)
+    kind = sqla.Column(sqla.String(16), nullable=False)
+    # Comma-separated IDs of every player whose calendar the change touches (old and new line-up)
+    player_ids = sqla.Column(sqla.String(64))
+    old_value = sqla.Column(sqla.String(255))
+    new_value = sqla.Column(sqla.String(255))
+    detected_at = sqla.Column(sqla.DateTime, index=True)
+
+
+class MatchChangeCursor(Base):
+    __tablename__ = 'matchchangecursor'
+    consumer = sqla.Column(sqla.String(64), primary_key=True)
+    last_id = sqla.Column(sqla.Integer, nullable=False, default=0)
+    updated_at = sqla.Column(sqla.DateTime)
+
+
+class MatchChangeRetry(Base):
+    __tablename__ = 'matchchangeretry'
+    consumer = sqla.Column(sqla.String(64), primary_key=True)
+    player_id = sqla.Column(sqla.Integer, primary_key=True)
+    failed_at = sqla.Column(sqla.DateTime)
+
+
+def _str_or_none(value):
+    return str(value) if value else None
+
+
+def match_fields(match):
+    """Stored fields of a SnookerOrgApi Match."""
+    return {
+        'event_id': match.EventID,
+        'round': match.Round,
+        'number': match.Number,
+        'player1_id': match.Player1ID,
+        'player2_id': match.Player2ID,
+        'score1': match.Score1,
+        'score2': match.Score2,
+        'winner_id': match.WinnerID,
+        'status': match.Status,
+        'unfinished': bool(match.Unfinished),
+        'scheduled_date': _str_or_none(match.ScheduledDate),
+        'start_date': _str_or_none(match.StartDate),
+        'end_date': _str_or_none(match.EndDate),
+    }
+
+
+def _players(fields):
+    return [pid for pid in (fields['player1_id'], fields['player2_id']) if pid]
+
+
+def _time_value(fields):
+    return f"{fields['scheduled_date'] or ''}|{fields['start_date'] or ''}"
+
+
+def _score_value(fields):
+    return f"{fields['score1']}-{fields['score2']}"
+
+
+def diff_match(old, new):
+    """
+    Compare stored fields with freshly fetched ones
+
+    Args:
+        old (dict): Stored fields, or None for a match not seen before
+        new (dict): Fields from match_fields()
+
+    Returns:
+        list: (kind, old_value, new_value) tuples; empty when nothing relevant changed
+    """
+    if old is None:
+        return [(CHANGE_NEW, None, _time_value(new))]
+    changes = []
+    if _players(old) != _players(new):
+        changes.append((CHANGE_PLAYERS, ','.join(map(str, _players(old))), ','.join(map(str, _players(new)))))
+    if _time_value(old) != _time_value(new):
+        changes.append((CHANGE_RESCHEDULED, _time_value(old), _time_value(new)))
+    finished = (new['winner_id'] or 0) > 0 or new['end_date'] is not None
+    if (old['winner_id'], old['end_date']) != (new['winner_id'], new['end_date']) and finished:
+        changes.append((CHANGE_RESULT, _score_value(old), f"{_score_value(new)} winner {new['winner_id']}"))
+    elif (_score_value(old), old['status'], old['unfinished']) != (_score_value(new), new['status'], new['unfinished']):
+        changes.append((CHANGE_SCORE, f"{_score_value(old)} status {old['status']}",
+                        f"{_score_value(new)} status {new['status']}"))
+    return changes
+
+
+def change_dict(change):
+    return {
+        'id': change.id,
+        'match_id': change.match_id,
+        'event_id': change.event_id,
+        'kind': change.kind,
+        'player_ids': [int(pid) for pid in change.player_ids.split(',')] if change.player_ids else [],
+        'old_value': change.old_value,
+        'new_value': change.new_value,
+        'detected_at': change.detected_at.isoformat() if change.detected_at else None,
+    }
+
+
+class MatchChangeLog:
+    """
+    Stored match state plus the append-only change log derived from it
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.Session = sessionmaker(bind=engine)
+
+    def init_db(self):
+        Base.metadata.create_all(self.engine)
+
+    def sync(self, matches, now=None):
+        """
+        Diff fetched matches against the stored state, store them and log the changes
+
+        Args:
+            matches (list): SnookerOrgApi Match objects (e.g. one event's event_matches)
+
+        Returns:
+            list: Change dicts (see change_dict) that were recorded
+        """
+        now = now or datetime.utcnow()
+        matches = [m for m in matches or [] if m is not None]
+        if not matches:
+            return []
+        session = self.Session()
+        try:
+            stored = {
+                state.match_id: state
+                for state in session.query(MatchState).filter(MatchState.match_id.in_([m.ID for m in matches]))
+            }
+            recorded = []
+            for match in matches:
+                new = match_fields(match)
+                state = stored.get(match.ID)
+                old = None if state is None else {key: getattr(state, key) for key in new}
+                changes = diff_match(old, new)
+                if not changes:
+                    continue
+                affected = sorted(set(_players(new)) | (set(_players(old)) if old else set()))
+                for kind, old_value, new_value in changes:
+                    change = MatchChange(
+                        match_id=match.ID, event_id=new['event_id'], kind=kind,
+                        player_ids=','.join(map(str, affected)),
+                        old_value=old_value, new_value=new_value, detected_at=now,
+                    )
+                    session.add(change)
+                    recorded.append(change)
+                if state is None:
+                    state = MatchState(match_id=match.ID)
+                    session.add(state)
+                for key, value in new.items():
+                    setattr(state, key, value)
+                state.updated_at = now
+            session.flush()
+            result = [change_dict(change) for change in recorded]
+            session.commit()
+            return result
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def changes_since(self, since=0, limit=500):
+        """Changes with an id greater than `since`, oldest first."""
+        session = self.Session()
+        try:
+            rows = (session.query(MatchChange)
+                    .filter(MatchChange.id > since)
+                    .order_by(MatchChange.id)
+                    .limit(limit)
+                    .all())
+            return [change_dict(row) for row in rows]
+        finally:
+            session.close()
+
+    def latest_id(self):
+        session = self.Session()
+        try:
+            return session.query(sqla.func.max(MatchChange.id)).scalar() or 0
+        finally:
+            session.close()
+
+    def cursor(self, consumer=DEFAULT_CONSUMER):
+        session = self.Session()
+        try:
+            row = session.get(MatchChangeCursor, consumer)
+            return row.last_id if row else 0
+        finally:
+            session.close()
+
+    def pending_players(self, consumer=DEFAULT_CONSUMER, limit=10000):
+        """
+        Players touched by changes the consumer has not processed yet, plus
+        the players it failed to process last time
+
+        Returns:
+            tuple: (sorted player IDs, id of the newest change read) — pass the
+            id to advance() once those players have been handled
+        """
+        since = self.cursor(consumer)
+        changes = self.changes_since(since, limit)
+        players = {pid for change in changes for pid in change['player_ids']}
+        players.update(self.retry_players(consumer))
+        return sorted(players), (changes[-1]['id'] if changes else since)
+
+    def retry_players(self, consumer=DEFAULT_CONSUMER):
+        session = self.Session()
+        try:
+            return {row[0] for row in session.query(MatchChangeRetry.player_id)
+                    .filter(MatchChangeRetry.consumer == consumer)}
+        finally:
+            session.close()
+
+    def advance(self, up_to_id, consumer=DEFAULT_CONSUMER, now=None, processed=(), failed=()):
+        """
+        Move the consumer's cursor forward to up_to_id; never moves it back
+
+        Args:
+            processed (iterable): Players handled since pending_players(); dropped from the retry set
+            failed (iterable): Players that could not be handled; returned by pending_players() again
+        """
+        now = now or datetime.utcnow()
+        failed = set(failed)
+        done = set(processed) - failed
+        session = self.Session()
+        try:
+            row = session.get(MatchChangeCursor, consumer)
+            if row is None:
+                session.add(MatchChangeCursor(consumer=consumer, last_id=up_to_id, updated_at=now))
+            else:
+                session.query(MatchChangeCursor).filter(
+                    MatchChangeCursor.consumer == consumer,
+                    MatchChangeCursor.last_id < up_to_id,
+                ).update({'last_id': up_to_id, 'updated_at': now}, synchronize_session=False)
+            if done:
+                session.query(MatchChangeRetry).filter(
+                    MatchChangeRetry.consumer == consumer,
+                    MatchChangeRetry.player_id.in_(list(done)),
+                ).delete(synchronize_session=False)
+            for player_id in failed:
+                session.merge(MatchChangeRetry(consumer=consumer, player_id=player_id, failed_at=now))
+            session.commit()
+        finally:
+            session.close()
+
+
+def sync_event_matches(client, change_log, events, wait_time=0):
+    """
+    Fetch every match of the given events and record what changed
+
+    Returns:
+        list: Change dicts recorded across all events
+    """
+    recorded = []
+    for i, event in enumerate(events):
+        recorded.extend(change_log.sync(client.event_matches(event['id']) or []))
+        if wait_time and i < len(events) - 1:
+            time.sleep(wait_time)
+    return recorded
+
+
+def main():
+    from ics_work_queue import create_queue_engine
+
+    parser = argparse.ArgumentParser(description="Match change feed")
+    parser.add_argument('command', choices=['sync', 'show'])
+    parser.add_argument('--db-url', help="SQLAlchemy URL (defaults to the database in config.txt)")
+    parser.add_argument('--since', type=int, default=0)
+    args = parser.parse_args()
+
+    change_log = MatchChangeLog(create_queue_engine(args.db_url))
+    change_log.init_db()
+    if args.command == 'sync':
+        from query_data import query_open_events
+        from upstream import create_snooker_client
+        changes = sync_event_matches(create_snooker_client(), change_log, query_open_events())
+        print(f"Recorded {len(changes)} match changes")
+    else:
+        for change in change_log.changes_since(args.since):
+            print(change)
+
+
+if __name__ == '__main__':
+    main()
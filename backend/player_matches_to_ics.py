@@ -5,11 +5,12 @@ Script to convert snooker player matches to ICS calendar format
 import configparser
 import sys
 from datetime import datetime, timedelta
-from snooker.api import SnookerOrgApi
-from icalendar import Calendar, Event, vText
+from upstream import create_snooker_client
+from icalendar import Calendar, Event, vText, vDuration
 import pytz
-from query_data import query_player_info, query_event_info, query_round_info, query_player_ranking
-from fetch_players import fetch_single_player
+from query_data import lookup_session, query_player_info, query_event_info, query_round_info, query_player_ranking
+from player_resolver import is_placeholder, note_missing_player
+from dimension_store import DimensionStore
 def load_config(filename='config.txt'):
     config = configparser.ConfigParser()
     config.read(filename)
@@ -23,31 +24,194 @@ def load_config(filename='config.txt'):
     return db_config, api_config
 db_config, api_config = load_config()
 
-def get_player_info(player_id):
-    player_info = query_player_info(player_id)
+# Poll-interval tiers advertised to calendar clients (REFRESH-INTERVAL /
+# X-PUBLISHED-TTL), chosen from how close the player's next match is.
+REFRESH_LIVE = timedelta(minutes=5)
+REFRESH_SAME_DAY = timedelta(minutes=15)
+REFRESH_THIS_WEEK = timedelta(hours=1)
+REFRESH_THIS_MONTH = timedelta(hours=6)
+REFRESH_IDLE = timedelta(days=1)
+
+# A started match without a result is only treated as live for this long,
+# so a match the API never closes does not pin the player to the fast tier.
+LIVE_MATCH_WINDOW = timedelta(hours=12)
+
+
+def parse_api_datetime(value):
+    """Parse a snooker.org date string into an aware UTC datetime, or None."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = pytz.utc.localize(parsed)
+    return parsed
+
+
+def summarize_match_schedule(matches, now=None):
+    """
+    Summarize when a player is next (and was last) on the table
+
+    Args:
+        matches: Match objects from the API
+        now (datetime): Reference time, defaults to the current UTC time
+
+    Returns:
+        dict: next_match / last_match (aware UTC datetimes or None) and live (bool)
+    """
+    if now is None:
+        now = datetime.now(pytz.utc)
+
+    next_match = None
+    last_match = None
+    live = False
+    for match in matches or []:
+        start = parse_api_datetime(match.StartDate) or parse_api_datetime(match.ScheduledDate)
+        finished = match.WinnerID > 0 or bool(match.EndDate)
+        if finished:
+            played = parse_api_datetime(match.EndDate) or start
+            if played and (last_match is None or played > last_match):
+                last_match = played
+        elif match.Status == 1 or (start and start <= now < start + LIVE_MATCH_WINDOW):
+            live = True
+        elif start and start > now and (next_match is None or start < next_match):
+            next_match = start
+
+    return {'next_match': next_match, 'last_match': last_match, 'live': live}
+
+
+def refresh_interval_for(schedule, now=None):
+    """
+    Pick how often calendar clients should poll a player's calendar
+
+    Args:
+        schedule (dict): Output of summarize_match_schedule
+        now (datetime): Reference time, defaults to the current UTC time
+
+    Returns:
+        timedelta: Suggested refresh interval
+    """
+    if now is None:
+        now = datetime.now(pytz.utc)
+
+    if schedule['live']:
+        return REFRESH_LIVE
+
+    next_match = schedule['next_match']
+    last_match = schedule['last_match']
+    # A result from the last day usually means the next round is being drawn
+    if last_match and now - last_match < timedelta(days=1):
+        return REFRESH_SAME_DAY
+    if next_match is None:
+        return REFRESH_IDLE
+
+    until_next = next_match - now
+    if until_next < timedelta(days=1):
+        return REFRESH_SAME_DAY
+    if until_next < timedelta(days=7):
+        return REFRESH_THIS_WEEK
+    if until_next < timedelta(days=30):
+        return REFRESH_THIS_MONTH
+    return REFRESH_IDLE
+
+
+def get_player_info(player_id, session=None):
+    # Undecided opponents skip the lookup. Missing players are still looked up every
+    # time, so a calendar names them as soon as the resolver has stored them
+    if is_placeholder(player_id):
+        return None
+    player_info = query_player_info(player_id, session=session)
     if not player_info:
-        fetch_single_player(player_id)
-    player_info = query_player_info(player_id)
+        # Fetched in bulk by the scheduler's next resolution pass, not once per match;
+        # noting is throttled per process
+        note_missing_player(player_id)
     return player_info
 
-def create_match_event(match, player_id):
+
+class DatabaseLookups:
+    """
+    Lookups a calendar needs, served by the dimension store and then the database
+
+    Has the same player/event/round/ranking methods as DimensionStore, so a
+    prefetched store (see prefetch_calendar_lookups) can be passed instead.
+    """
+
+    def __init__(self, session=None):
+        self.session = session
+
+    def player(self, player_id):
+        return get_player_info(player_id, self.session)
+
+    def event(self, event_id):
+        return query_event_info(event_id, session=self.session)
+
+    def round(self, event_id, round_num):
+        return query_round_info(event_id, round_num, session=self.session)
+
+    def ranking(self, player_id):
+        return query_player_ranking(player_id, session=self.session)
+
+
+def prefetch_calendar_lookups(player_id, matches, session=None):
+    """
+    Look up everything rendering these matches needs, up front
+
+    Rendering with the returned store touches neither the database nor
+    snooker.org, so it can run in a worker process. Missing players are noted
+    for the resolver here, in the calling process.
+
+    Returns:
+        DimensionStore: Just the players, events, rounds and rankings of these matches
+    """
+    lookups = DatabaseLookups(session)
+    player_ids = {player_id}
+    for match in matches or []:
+        player_ids.update((match.Player1ID, match.Player2ID))
+    players, events, rounds, ranked = {}, {}, {}, []
+    for pid in player_ids:
+        info = lookups.player(pid)
+        if info is not None:
+            players[pid] = info
+        ranking = lookups.ranking(pid) if info is not None else None
+        if ranking is not None:
+            ranked.append(ranking)
+    for match in matches or []:
+        if match.EventID not in events:
+            info = lookups.event(match.EventID)
+            if info is not None:
+                events[match.EventID] = info
+        event_rounds = rounds.setdefault(match.EventID, {})
+        if match.Round not in event_rounds:
+            info = lookups.round(match.EventID, match.Round)
+            if info is not None:
+                event_rounds[match.Round] = info
+    return DimensionStore(None, None, players, events, rounds, sorted(ranked, key=lambda r: r['position'] or 0))
+
+
+def create_match_event(match, player_id, session=None, lookups=None):
     """
     Create an ICS event for a single match
 
     Args:
         match: Match object from the API
         player_id: The player ID we're generating calendar for
+        session: Optional session reused for the lookups (see query_data.lookup_session)
+        lookups: Optional prefetched lookups (see prefetch_calendar_lookups); overrides session
 
     Returns:
         Event: ICS calendar event
     """
     event = Event()
+    if lookups is None:
+        lookups = DatabaseLookups(session)
 
     # Query additional information
-    player1_info = get_player_info(match.Player1ID)
-    player2_info = get_player_info(match.Player2ID)
-    event_info = query_event_info(match.EventID)
-    round_info = query_round_info(match.EventID, match.Round)
+    player1_info = lookups.player(match.Player1ID)
+    player2_info = lookups.player(match.Player2ID)
+    event_info = lookups.event(match.EventID)
+    round_info = lookups.round(match.EventID, match.Round)
 
     # Check if this is a future match
     is_future_match = match.WinnerID==0
@@ -94,7 +258,7 @@ def create_match_event(match, player_id):
         if is_future_match:
             if player1_info.get('num_ranking_titles') and player1_info['num_ranking_titles'] > 0:
                 description_parts.append(f"Ranking Titles: {player1_info['num_ranking_titles']}")
-            player1_ranking = query_player_ranking(match.Player1ID)
+            player1_ranking = lookups.ranking(match.Player1ID)
             if player1_ranking:
                 description_parts.append(f"World Ranking: {player1_ranking['position']}")
 
@@ -111,7 +275,7 @@ def create_match_event(match, player_id):
         if is_future_match:
             if player2_info.get('num_ranking_titles') and player2_info['num_ranking_titles'] > 0:
                 description_parts.append(f"Ranking Titles: {player2_info['num_ranking_titles']}")
-            player2_ranking = query_player_ranking(match.Player2ID)
+            player2_ranking = lookups.ranking(match.Player2ID)
             if player2_ranking:
                 description_parts.append(f"World Ranking: {player2_ranking['position']}")
 
@@ -223,27 +387,98 @@ def generate_player_calendar(player_id, year, headers=None):
     Returns:
         str: ICS calendar content as string
     """
+    ics_content, _ = build_player_calendar(player_id, year, headers)
+    return ics_content
+
+
+def build_player_calendar(player_id, year, headers=None):
+    """
+    Generate a player's ICS calendar together with a summary of their match times
+
+    Args:
+        player_id (int): Player ID
+        year (int): Year to fetch matches for
+        headers (dict): Optional headers for API requests
+
+    Returns:
+        tuple: (ICS calendar bytes or None, schedule dict from summarize_match_schedule)
+    """
     # Initialize API client
     if headers is None:
         headers = {'X-Requested-By': api_config['x_requested_by']}
-    client = SnookerOrgApi(headers=headers)
+    client = create_snooker_client(headers)
 
     # Fetch matches
     print(f"Fetching matches for player {player_id} in year {year}...")
     matches = client.player_matches(player_id, year)
 
+    return render_player_calendar(player_id, year, matches)
+
+
+def render_player_calendar(player_id, year, matches, lookups=None):
+    """
+    Render already-fetched matches into a player's ICS calendar
+
+    Args:
+        player_id (int): Player ID
+        year (int): Year the matches belong to
+        matches (list): Match objects from the API
+        lookups: Optional prefetched lookups (see prefetch_calendar_lookups); without
+                 them the lookups go to the dimension store and the database
+
+    Returns:
+        tuple: (ICS calendar bytes or None, schedule dict from summarize_match_schedule)
+    """
+    schedule = summarize_match_schedule(matches)
     if not matches:
         print(f"No matches found for player {player_id} in {year}")
-        return None
+        return None, schedule
 
     print(f"Found {len(matches)} matches")
-    player_info = query_player_info(player_id)
+    if lookups is not None:
+        return b''.join(iter_calendar_chunks(player_id, year, matches, schedule, lookups=lookups)), schedule
+    # Lookups the dimension store misses share one session for the whole calendar
+    with lookup_session() as session:
+        # Return bytes to preserve CRLF line endings and proper RFC5545 folding
+        return b''.join(iter_calendar_chunks(player_id, year, matches, schedule, session)), schedule
+
+
+CALENDAR_FOOTER = b'END:VCALENDAR\r\n'
+
+
+def iter_calendar_chunks(player_id, year, matches, schedule, session=None, lookups=None):
+    """
+    Render a player's calendar one piece at a time
+
+    Yields the calendar header, then one VEVENT per match, then the footer, so
+    callers can stream or write the calendar without holding all of it in memory.
+    Joined together the chunks equal Calendar.to_ical() of the full calendar.
+
+    Args:
+        player_id (int): Player ID
+        year (int): Year the matches belong to
+        matches (list): Match objects from the API
+        schedule (dict): Output of summarize_match_schedule for these matches
+        session: Optional session reused for the lookups; streaming callers leave it
+                 unset so no connection is held while the client reads
+        lookups: Optional prefetched lookups (see prefetch_calendar_lookups); overrides session
+
+    Yields:
+        bytes: ICS content chunks
+    """
+    if lookups is None:
+        lookups = DatabaseLookups(session)
+    player_info = lookups.player(player_id)
     # Create calendar
     cal = Calendar()
     cal.add('prodid', '-//Snooker Calendar Generator//snooker-calendar//')
     cal.add('version', '2.0')
     cal.add('calscale', 'GREGORIAN')
     cal.add('method', 'PUBLISH')
+    # Tell clients how often this calendar can actually change
+    refresh_interval = refresh_interval_for(schedule)
+    cal.add('refresh-interval', vDuration(refresh_interval), parameters={'VALUE': 'DURATION'})
+    cal.add('x-published-ttl', vDuration(refresh_interval))
     if player_info:
         if player_info.get('surname_first', False):
             player_name = f"{player_info['lastname']}, {player_info['firstname']}"
@@ -253,18 +488,50 @@ def generate_player_calendar(player_id, year, headers=None):
         cal.add('x-wr-calname', f'Snooker Matches - {player_name} ({year})')
         cal.add('description', f'Snooker matches for {player_name}, Data source: snooker.org, last updated {datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S UTC")}')
 
+    # Header: the property-only calendar without its closing line
+    yield cal.to_ical()[:-len(CALENDAR_FOOTER)]
+
     # Add events
     for match in matches:
         try:
-            event = create_match_event(match, player_id)
-            cal.add_component(event)
+            event = create_match_event(match, player_id, lookups=lookups)
+            chunk = event.to_ical()
             print(f"Added match: EventID={match.EventID}, Round={match.Round}")
         except Exception as e:
             print(f"Error processing match {match.ID}: {e}")
             continue
+        yield chunk
 
-    # Return bytes to preserve CRLF line endings and proper RFC5545 folding
-    return cal.to_ical()
+    yield CALENDAR_FOOTER
+
+
+def stream_player_calendar(player_id, year, headers=None):
+    """
+    Fetch a player's matches and return a chunk generator for their calendar
+
+    Matches are fetched eagerly so a missing calendar is known before anything
+    is streamed; rendering happens lazily as the generator is consumed.
+
+    Args:
+        player_id (int): Player ID
+        year (int): Year to fetch matches for
+        headers (dict): Optional headers for API requests
+
+    Returns:
+        generator: ICS bytes chunks, or None if the player has no matches
+    """
+    if headers is None:
+        headers = {'X-Requested-By': api_config['x_requested_by']}
+    client = create_snooker_client(headers)
+
+    print(f"Fetching matches for player {player_id} in year {year}...")
+    matches = client.player_matches(player_id, year)
+    if not matches:
+        print(f"No matches found for player {player_id} in {year}")
+        return None
+
+    print(f"Found {len(matches)} matches")
+    return iter_calendar_chunks(player_id, year, matches, summarize_match_schedule(matches))
 
 
 def main():
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Bulk resolution of players that matches mention but the players table lacks
+
+Calendars used to call snooker.org for every match whose player was not
+stored yet, so an unknown qualifier cost one request per match in every
+calendar mentioning them. Now rendering never calls the API: a missing
+player is only noted in `unresolvedplayers` and the calendar shows
+"Player <id>" for now. Before each generation pass the scheduler runs one
+rate-limited resolution pass over every id the match feed (`matchstate`)
+mentions plus the noted ones:
+
+- ids sharing an event are fetched with one event_players request
+- the rest are fetched one by one
+- ids snooker.org does not know are kept as 'unknown' (negative cache) and
+  only asked about again after `recheck_after`
+
+Calendars already rendered with "Player <id>" are not touched by any match
+change, so the scheduler marks the calendars mentioning the stored ids
+(`calendars_mentioning`) as due right after the pass.
+
+Placeholder ids (0, negative ids, and any listed in `[api]
+placeholder_player_ids`, e.g. a "TBD" player) are never looked up at all.
+
+Usage:
+    python player_resolver.py resolve [--season N]
+"""
+import argparse
+import configparser
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+import sqlalchemy as sqla
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from match_changes import MatchState
+from query_data import Event, Player
+
+Base = declarative_base()
+
+STATUS_PENDING = 'pending'
+STATUS_UNKNOWN = 'unknown'
+
+# Rendering processes remember ids they already noted for this long
+NOTE_TTL_SECONDS = 600
+
+
+def _placeholder_ids(filename='config.txt'):
+    config = configparser.ConfigParser()
+    config.read(filename)
+    raw = config.get('api', 'placeholder_player_ids', fallback='')
+    return frozenset(int(value) for value in raw.split(',') if value.strip())
+
+
+PLACEHOLDER_PLAYER_IDS = _placeholder_ids()
+
+
+def is_placeholder(player_id):
+    """True for ids that stand for an undecided opponent rather than a player."""
+    return not player_id or player_id <= 0 or player_id in PLACEHOLDER_PLAYER_IDS
+
+
+class UnresolvedPlayer(Base):
+    __tablename__ = 'unresolvedplayers'
+    player_id = sqla.Column(sqla.Integer, primary_key=True)
+    status = sqla.Column(sqla.String(16), nullable=False, default=STATUS_PENDING)
+    first_seen = sqla.Column(sqla.DateTime)
+    last_checked = sqla.Column(sqla.DateTime)
+    attempts = sqla.Column(sqla.Integer, nullable=False, default=0)
+
+
+class PlayerResolver:
+    """
+    Args:
+        engine: SQLAlchemy engine holding players, events, matchstate and unresolvedplayers
+        recheck_after (timedelta): How long an id snooker.org did not know stays negatively cached
+    """
+
+    def __init__(self, engine, recheck_after=timedelta(days=7)):
+        self.engine = engine
+        self.Session = sessionmaker(bind=engine)
+        self.recheck_after = recheck_after
+
+    def init_db(self):
+        Base.metadata.create_all(self.engine)
+
+    def note_missing(self, player_ids, now=None):
+        """Record ids a calendar could not name, for the next resolution pass."""
+        now = now or datetime.utcnow()
+        player_ids = {pid for pid in player_ids if not is_placeholder(pid)}
+        if not player_ids:
+            return
+        session = self.Session()
+        try:
+            known = {row[0] for row in session.query(UnresolvedPlayer.player_id)
+                     .filter(UnresolvedPlayer.player_id.in_(player_ids))}
+            session.add_all(UnresolvedPlayer(player_id=pid, status=STATUS_PENDING, first_seen=now, attempts=0)
+                            for pid in player_ids - known)
+            session.commit()
+        except sqla.exc.IntegrityError:
+            # Another process noted the same id first
+            session.rollback()
+        finally:
+            session.close()
+
+    def missing(self, season=None, now=None):
+        """
+        Ids to look up: mentioned by matches (of `season`'s events) or noted, not stored,
+        not placeholders and not negatively cached
+
+        Returns:
+            dict: {player_id: set of event ids mentioning it (may be empty)}
+        """
+        now = now or datetime.utcnow()
+        session = self.Session()
+        try:
+            mentioned = defaultdict(set)
+            for column in (MatchState.player1_id, MatchState.player2_id):
+                query = session.query(column, MatchState.event_id).distinct()
+                if season is not None:
+                    query = query.join(Event, Event.id == MatchState.event_id).filter(Event.season == season)
+                for player_id, event_id in query:
+                    if not is_placeholder(player_id):
+                        mentioned[player_id].add(event_id)
+            blocked = set()
+            for player_id, status, last_checked in session.query(
+                    UnresolvedPlayer.player_id, UnresolvedPlayer.status, UnresolvedPlayer.last_checked):
+                if status == STATUS_UNKNOWN and last_checked and now - last_checked < self.recheck_after:
+                    blocked.add(player_id)
+                elif not is_placeholder(player_id):
+                    mentioned.setdefault(player_id, set())
+            candidates = mentioned.keys() - blocked
+            stored = set()
+            ids = sorted(candidates)
+            for i in range(0, len(ids), 500):
+                stored.update(row[0] for row in session.query(Player.id).filter(Player.id.in_(ids[i:i + 500])))
+            if stored:
+                # Stored meanwhile (e.g. by the rankings refresh): nothing left to resolve
+                session.query(UnresolvedPlayer).filter(UnresolvedPlayer.player_id.in_(list(stored))) \
+                    .delete(synchronize_session=False)
+                session.commit()
+            return {pid: mentioned[pid] for pid in candidates - stored}
+        finally:
+            session.close()
+
+    def resolve(self, client, season=None, wait_time=0, now=None):
+        """
+        Fetch and store every missing player in one pass
+
+        Returns:
+            dict: {'stored': n, 'unknown': n, 'requests': n, 'resolved': sorted ids stored}
+        """
+        from fetch_players import Player as StoredPlayer
+        from upstream import CircuitOpenError
+
+        now = now or datetime.utcnow()
+        missing = self.missing(season, now)
+        result = {'stored': 0, 'unknown': 0, 'requests': 0, 'resolved': []}
+        if not missing:
+            return result
+
+        # Events mentioning several missing players are fetched as one roster
+        by_event = defaultdict(set)
+        for player_id, event_ids in missing.items():
+            for event_id in event_ids:
+                by_event[event_id].add(player_id)
+        rosters = sorted(((event_id, ids) for event_id, ids in by_event.items() if len(ids) > 1),
+                         key=lambda item: -len(item[1]))
+
+        remaining = set(missing)
+        session = self.Session()
+
+        def store(player_data):
+            session.merge(StoredPlayer(player_data))
+            session.query(UnresolvedPlayer).filter(UnresolvedPlayer.player_id == player_data.ID) \
+                .delete(synchronize_session=False)
+            remaining.discard(player_data.ID)
+            result['stored'] += 1
+            result['resolved'].append(player_data.ID)
+
+        def request(call, *args):
+            if result['requests'] and wait_time:
+                time.sleep(wait_time)
+            result['requests'] += 1
+            return call(*args)
+
+        try:
+            for event_id, player_ids in rosters:
+                if len(player_ids & remaining) < 2:
+                    continue
+                for player_data in request(client.event_players, event_id) or []:
+                    if player_data.ID in remaining:
+                        store(player_data)
+                session.commit()
+            for player_id in sorted(remaining):
+                player_data = request(client.player, player_id)
+                if player_data is not None:
+                    store(player_data)
+                else:
+                    row = session.get(UnresolvedPlayer, player_id) or UnresolvedPlayer(
+                        player_id=player_id, first_seen=now, attempts=0)
+                    row.status = STATUS_UNKNOWN
+                    row.last_checked = now
+                    row.attempts += 1
+                    session.merge(row)
+                    result['unknown'] += 1
+                session.commit()
+        except CircuitOpenError as e:
+            # What is stored so far stays; the rest is retried by the next pass
+            session.rollback()
+            print(f"Stopping player resolution: {e}")
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        result['resolved'].sort()
+        return result
+
+    def calendars_mentioning(self, player_ids):
+        """The given players plus everyone with a stored match against one of them."""
+        player_ids = set(player_ids)
+        if not player_ids:
+            return set()
+        session = self.Session()
+        try:
+            mentioning = set(player_ids)
+            ids = list(player_ids)
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                for player1_id, player2_id in session.query(MatchState.player1_id, MatchState.player2_id).filter(
+                        sqla.or_(MatchState.player1_id.in_(chunk), MatchState.player2_id.in_(chunk))):
+                    mentioning.update((player1_id, player2_id))
+            return {pid for pid in mentioning if not is_placeholder(pid)}
+        finally:
+            session.close()
+
+
+_noted = {}
+_default_resolver = None
+
+
+def note_missing_player(player_id):
+    """
+    Called while rendering: remember a player that could not be named
+
+    Returns:
+        bool: False if the id was already noted by this process in the last NOTE_TTL_SECONDS
+    """
+    global _default_resolver
+    now = time.monotonic()
+    if now - _noted.get(player_id, -NOTE_TTL_SECONDS) < NOTE_TTL_SECONDS:
+        return False
+    _noted[player_id] = now
+    try:
+        if _default_resolver is None:
+            from query_data import engine
+            _default_resolver = PlayerResolver(engine)
+        _default_resolver.note_missing([player_id])
+    except Exception as e:
+        print(f"Error noting missing player {player_id}: {e}")
+    return True
+
+
+def main():
+    from query_data import engine, get_current_season, init_db
+    from upstream import create_snooker_client
+
+    parser = argparse.ArgumentParser(description="Resolve players that matches mention but are not stored")
+    parser.add_argument('command', choices=['resolve'])
+    parser.add_argument('--season', type=int, help="defaults to the current season")
+    args = parser.parse_args()
+
+    init_db()
+    season = args.season or get_current_season()
+    result = PlayerResolver(engine).resolve(create_snooker_client(), season=season)
+    print(f"Stored {result['stored']} players, {result['unknown']} unknown to snooker.org "
+          f"({result['requests']} requests)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Materialized per-player season statistics
+
+`playerseasonstats` holds one row per (player, season): matches played, wins,
+losses, frames won and lost, prize money and ranking points. It is derived from
+the finished matches in `matchstate` (see match_changes.py) and the `rounds`
+table, so the API reads a single row instead of aggregating matches per request.
+
+- Incremental: as the change feed records results, only the players involved
+  are recomputed (consumer cursor 'stats'), which also makes corrected results
+  safe to apply.
+- Full: the whole season is recomputed with the same set-based aggregates, e.g.
+  after a backfill or a change to the rules below.
+
+Prize money and ranking points come from the round a player finished an event
+in: the round of their deepest loss, or the winner's round (num_left = 1) for
+the player who won the final (num_left = 2). `rounds.actual_money` and
+`rounds.points` are used as published by snooker.org.
+
+Usage:
+    python player_stats.py recompute [--season N] [--sync]
+"""
+import argparse
+from collections import defaultdict
+from datetime import datetime
+import sqlalchemy as sqla
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from match_changes import MatchState, CHANGE_NEW, CHANGE_PLAYERS, CHANGE_RESULT, CHANGE_SCORE
+from query_data import Event, Round
+
+Base = declarative_base()
+
+STATS_CONSUMER = 'stats'
+# Changes that can alter a finished match (a match may already be finished when first seen)
+_STATS_CHANGES = {CHANGE_NEW, CHANGE_RESULT, CHANGE_SCORE, CHANGE_PLAYERS}
+
+
+class PlayerSeasonStats(Base):
+    __tablename__ = 'playerseasonstats'
+    player_id = sqla.Column(sqla.Integer, primary_key=True)
+    season = sqla.Column(sqla.Integer, primary_key=True)
+    matches_played = sqla.Column(sqla.Integer, nullable=False, default=0)
+    wins = sqla.Column(sqla.Integer, nullable=False, default=0)
+    losses = sqla.Column(sqla.Integer, nullable=False, default=0)
+    frames_won = sqla.Column(sqla.Integer, nullable=False, default=0)
+    frames_lost = sqla.Column(sqla.Integer, nullable=False, default=0)
+    prize_money = sqla.Column(sqla.Float, nullable=False, default=0.0)
+    ranking_points = sqla.Column(sqla.Integer, nullable=False, default=0)
+    updated_at = sqla.Column(sqla.DateTime)
+
+
+def stats_dict(row):
+    return {
+        'player_id': row.player_id,
+        'season': row.season,
+        'matches_played': row.matches_played,
+        'wins': row.wins,
+        'losses': row.losses,
+        'frames_won': row.frames_won,
+        'frames_lost': row.frames_lost,
+        'prize_money': row.prize_money,
+        'ranking_points': row.ranking_points,
+        'updated_at': row.updated_at.isoformat() if row.updated_at else None,
+    }
+
+
+def _player_sides():
+    """Finished matches seen from each player's side: one row per (match, player)."""
+    m = MatchState
+
+    def side(player, frames_for, frames_against):
+        return sqla.select(
+            player.label('player_id'),
+            m.event_id.label('event_id'),
+            m.round.label('round'),
+            sqla.case((m.winner_id == player, 1), else_=0).label('won'),
+            sqla.func.coalesce(frames_for, 0).label('frames_won'),
+            sqla.func.coalesce(frames_against, 0).label('frames_lost'),
+        ).where(m.winner_id > 0, player > 0)
+
+    return sqla.union_all(
+        side(m.player1_id, m.score1, m.score2),
+        side(m.player2_id, m.score2, m.score1),
+    ).subquery()
+
+
+def _credited_rounds(event_rows, rounds):
+    """
+    Round each player is paid for in each event
+
+    Args:
+        event_rows: (player_id, event_id, deepest lost round, deepest won round) rows
+        rounds (dict): {event_id: {round: (num_left, actual_money, points)}}
+
+    Returns:
+        dict: {player_id: [(event_id, round), ...]}
+    """
+    finals, winners = {}, {}
+    for event_id, event_rounds in rounds.items():
+        for number, (num_left, _, _) in event_rounds.items():
+            if num_left == 2:
+                finals[event_id] = number
+            elif num_left == 1:
+                winners[event_id] = number
+    credited = defaultdict(list)
+    for player_id, event_id, lost_round, won_round in event_rows:
+        if won_round is not None and won_round == finals.get(event_id) and event_id in winners:
+            credited[player_id].append((event_id, winners[event_id]))
+        elif lost_round is not None:
+            credited[player_id].append((event_id, lost_round))
+    return credited
+
+
+class PlayerStatsStore:
+    """
+    Reads and maintains playerseasonstats
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.Session = sessionmaker(bind=engine)
+
+    def init_db(self):
+        Base.metadata.create_all(self.engine)
+
+    def get(self, player_id, season):
+        session = self.Session()
+        try:
+            row = session.get(PlayerSeasonStats, (player_id, season))
+            return stats_dict(row) if row else None
+        finally:
+            session.close()
+
+    def recompute(self, season, player_ids=None, now=None):
+        """
+        Rebuild the stats rows of a season, for every player or only `player_ids`
+
+        Returns:
+            int: Number of stats rows written
+        """
+        now = now or datetime.utcnow()
+        if player_ids is not None:
+            player_ids = sorted(set(player_ids))
+            if not player_ids:
+                return 0
+        sides = _player_sides()
+        session = self.Session()
+        try:
+            base = (session.query()
+                    .select_from(sides)
+                    .join(Event, Event.id == sides.c.event_id)
+                    .filter(Event.season == season))
+            if player_ids is not None:
+                base = base.filter(sides.c.player_id.in_(player_ids))
+
+            totals = base.with_entities(
+                sides.c.player_id,
+                sqla.func.count(),
+                sqla.func.sum(sides.c.won),
+                sqla.func.sum(sides.c.frames_won),
+                sqla.func.sum(sides.c.frames_lost),
+            ).group_by(sides.c.player_id).all()
+
+            event_rows = base.with_entities(
+                sides.c.player_id,
+                sides.c.event_id,
+                sqla.func.max(sqla.case((sides.c.won == 0, sides.c.round))),
+                sqla.func.max(sqla.case((sides.c.won == 1, sides.c.round))),
+            ).group_by(sides.c.player_id, sides.c.event_id).all()
+
+            rounds = defaultdict(dict)
+            event_ids = {row[1] for row in event_rows}
+            if event_ids:
+                for r in session.query(Round.event_id, Round.round, Round.num_left, Round.actual_money, Round.points) \
+                        .filter(Round.event_id.in_(event_ids)):
+                    rounds[r.event_id][r.round] = (r.num_left, r.actual_money or 0.0, r.points or 0)
+            credited = _credited_rounds(event_rows, rounds)
+
+            delete = session.query(PlayerSeasonStats).filter(PlayerSeasonStats.season == season)
+            if player_ids is not None:
+                delete = delete.filter(PlayerSeasonStats.player_id.in_(player_ids))
+            delete.delete(synchronize_session=False)
+
+            for player_id, played, wins, frames_won, frames_lost in totals:
+                paid = [rounds[e][r] for e, r in credited.get(player_id, []) if r in rounds.get(e, {})]
+                session.add(PlayerSeasonStats(
+                    player_id=player_id, season=season,
+                    matches_played=played, wins=int(wins or 0), losses=played - int(wins or 0),
+                    frames_won=int(frames_won or 0), frames_lost=int(frames_lost or 0),
+                    prize_money=float(sum(money for _, money, _ in paid)),
+                    ranking_points=int(sum(points for _, _, points in paid)),
+                    updated_at=now,
+                ))
+            session.commit()
+            return len(totals)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def apply_changes(self, change_log, consumer=STATS_CONSUMER):
+        """
+        Recompute the players touched by match changes since the consumer's cursor
+
+        Returns:
+            int: Number of stats rows written
+        """
+        since = change_log.cursor(consumer)
+        changes = change_log.changes_since(since, limit=10000)
+        if not changes:
+            return 0
+        by_event = defaultdict(set)
+        for change in changes:
+            if change['kind'] in _STATS_CHANGES:
+                by_event[change['event_id']].update(change['player_ids'])
+        written = 0
+        if by_event:
+            session = self.Session()
+            try:
+                seasons = dict(session.query(Event.id, Event.season).filter(Event.id.in_(list(by_event))))
+            finally:
+                session.close()
+            by_season = defaultdict(set)
+            for event_id, players in by_event.items():
+                if seasons.get(event_id) is not None:
+                    by_season[seasons[event_id]].update(players)
+            for season, players in by_season.items():
+                written += self.recompute(season, players)
+        change_log.advance(changes[-1]['id'], consumer)
+        return written
+
+
+def main():
+    from query_data import engine, get_current_season, init_db
+    from match_changes import MatchChangeLog, sync_event_matches
+
+    parser = argparse.ArgumentParser(description="Materialized player season statistics")
+    parser.add_argument('command', choices=['recompute'])
+    parser.add_argument('--season', type=int, help="defaults to the current season")
+    parser.add_argument('--sync', action='store_true',
+                        help="first fetch every match of the season into the change feed (backfill)")
+    args = parser.parse_args()
+
+    init_db()
+    season = args.season or get_current_season()
+    if args.sync:
+        from query_data import query_season_events
+        from upstream import create_snooker_client
+        changes = sync_event_matches(create_snooker_client(), MatchChangeLog(engine), query_season_events(season))
+        print(f"Recorded {len(changes)} match changes for season {season}")
+    rows = PlayerStatsStore(engine).recompute(season)
+    print(f"Wrote stats for {rows} players in season {season}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,14 @@
 import configparser
 import datetime
-import requests
 import time
-from requests.adapters import HTTPAdapter
-from urllib3.util import Retry
+import threading
+from contextlib import contextmanager
 import sqlalchemy as sqla
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+from dimension_store import DimensionStore, EventRecord, PlayerRecord, RankingRecord, RoundRecord
+
 # Function to load configuration from config.txt
 def load_config(filename='config.txt'):
     config = configparser.ConfigParser()
@@ -140,211 +141,510 @@ class InfoLastUpdated(Base):
     info = sqla.Column(sqla.String(255), primary_key=True)
     lastupdated = sqla.Column(sqla.DateTime)
 
+class InfoValue(Base):
+    __tablename__ = 'infovalues'
+    name = sqla.Column(sqla.String(255), primary_key=True)
+    value = sqla.Column(sqla.String(255))
+    updated_at = sqla.Column(sqla.DateTime)
+
 # Create session factory
 DBSession = sessionmaker(bind=engine)
 
-def query_player_info(player_id):
+@contextmanager
+def lookup_session():
+    """
+    供批量调用方复用的会话：在 with 块内把它作为 session 参数传给各个查询函数，
+    避免每次查询新建和关闭会话
+    """
+    session = DBSession()
+    try:
+        yield session
+    finally:
+        session.close()
+
+@contextmanager
+def _reader(session=None):
+    """
+    调用方传入的会话或连接直接使用（由调用方关闭），否则新建一个会话，用完关闭
+
+    查询出错时回滚调用方的会话：查询函数会吞掉异常返回 None，若不回滚，
+    一次连接错误之后共用该会话的后续查询都会失败
+    """
+    if session is not None:
+        try:
+            yield session
+        except Exception:
+            try:
+                session.rollback()
+            except Exception as e:
+                print(f"Error rolling back lookup session: {e}")
+            raise
+        return
+    with lookup_session() as own:
+        yield own
+
+# 维度记录只投影需要的列，列顺序与 dimension_store 中记录的 __slots__ 一致
+_PLAYER_COLUMNS = (Player.type, Player.first_name, Player.last_name, Player.surname_first,
+                   Player.nationality, Player.born, Player.num_ranking_titles)
+_EVENT_COLUMNS = (Event.name, Event.start_date, Event.end_date, Event.season, Event.type, Event.venue,
+                  Event.city, Event.country, Event.sex, Event.age_group, Event.url, Event.stage,
+                  Event.ranking_type, Event.defending_champion)
+_ROUND_COLUMNS = (Round.round_name, Round.distance, Round.main_event, Round.note, Round.value_type,
+                  Round.rank, Round.money, Round.seed_gets_half, Round.actual_money, Round.currency)
+_RANKING_COLUMNS = (Ranking.position, Ranking.sum_value, Ranking.player_id)
+
+
+# 维度存储：球员、赛事、轮次和排名的只读内存快照，按同步版本加载一次，
+# API 进程和生成器共用（fork 出的子进程写时复制共享）。刷新时整体替换引用，
+# 查找只是一次字典访问，返回已有的记录对象。未命中时仍回退到数据库查询。
+_dimensions = None
+_dimensions_checked_at = 0.0
+_dimensions_lock = threading.Lock()
+_DIMENSIONS_CHECK_SECONDS = 60  # API 进程两次检查同步版本的最短间隔
+
+def _dimensions_version(session, season):
+    """同步版本：球员/排名和赛事/轮次最近一次同步的时间，以及加载的赛季"""
+    stamps = dict(session.query(InfoLastUpdated.info, InfoLastUpdated.lastupdated)
+                  .filter(InfoLastUpdated.info.in_(('players', 'events'))))
+    return (season, stamps.get('players'), stamps.get('events'))
+
+def _load_dimensions(session, season, version):
+    event_query = session.query(Event.id, *_EVENT_COLUMNS)
+    round_query = session.query(Round.event_id, Round.round, *_ROUND_COLUMNS)
+    if season is not None:
+        event_query = event_query.filter(Event.season == season)
+        round_query = round_query.filter(
+            Round.event_id.in_(session.query(Event.id).filter(Event.season == season)))
+    rounds = {}
+    for row in round_query:
+        rounds.setdefault(row[0], {})[row[1]] = RoundRecord(*row[2:])
+    return DimensionStore(
+        version, season,
+        players={row[0]: PlayerRecord(*row[1:]) for row in session.query(Player.id, *_PLAYER_COLUMNS)},
+        events={row[0]: EventRecord(*row[1:]) for row in event_query},
+        rounds=rounds,
+        ranked=[RankingRecord(*row) for row in session.query(*_RANKING_COLUMNS).order_by(Ranking.position)],
+    )
+
+def refresh_dimensions(season=None, max_age=0):
+    """
+    确保维度存储是最新同步版本，版本变化（或赛季不同）时重新加载并整体替换
+
+    Args:
+        season (int): 只加载该赛季的赛事和轮次，默认全部
+        max_age (float): 距上次检查不足该秒数时直接使用当前存储，不查询同步版本
+
+    Returns:
+        DimensionStore: 当前存储；从未加载成功时返回 None
+    """
+    global _dimensions, _dimensions_checked_at
+    store = _dimensions
+    if store is not None and store.season == season and time.time() - _dimensions_checked_at < max_age:
+        return store
+    with _dimensions_lock:
+        session = DBSession()
+        try:
+            version = _dimensions_version(session, season)
+            if _dimensions is None or _dimensions.version != version:
+                store = _load_dimensions(session, season, version)
+                _dimensions = store
+                print(f"Loaded dimension store: {store.summary()}")
+            _dimensions_checked_at = time.time()
+        except Exception as e:
+            # 保留已加载的存储；没有存储时查找逐条回退到数据库
+            print(f"Error loading dimension store: {e}")
+        finally:
+            session.close()
+        return _dimensions
+
+def current_dimensions(season=None):
+    """API 进程使用：最多每 _DIMENSIONS_CHECK_SECONDS 秒检查一次同步版本；默认沿用已加载的赛季"""
+    store = _dimensions
+    if season is None:
+        season = store.season if store is not None else get_current_season()
+    return refresh_dimensions(season, max_age=_DIMENSIONS_CHECK_SECONDS)
+
+def invalidate_dimensions():
+    """下次访问时重新检查同步版本（收到数据更新通知时调用）"""
+    global _dimensions_checked_at
+    _dimensions_checked_at = 0.0
+
+def preload_lookup_caches(season=None):
+    """加载（或按同步版本刷新）维度存储，供 query_player_info 等查找函数使用"""
+    refresh_dimensions(season)
+
+def clear_lookup_caches():
+    global _dimensions
+    _dimensions = None
+
+@contextmanager
+def lookup_snapshot(season=None):
+    """
+    在 with 块内使用维度存储：进入时按同步版本刷新一次，块内的查找都使用同一个快照。
+    同步版本不变时，下次批量生成直接复用，不再重新加载
+    """
+    store = refresh_dimensions(season)
+    yield store
+
+def query_player_info(player_id, session=None):
     """
     根据 player_id 查询运动员信息
 
     Args:
         player_id (int): 运动员ID
+        session: 可复用的会话或连接（见 lookup_session），默认每次新建
 
     Returns:
-        dict: 包含 type, firstname, lastname, surname_first, nationality, born, num_ranking_titles 的字典
+        PlayerRecord: 只读映射，键为 type, firstname, lastname, surname_first, nationality, born, num_ranking_titles
               如果查询失败或不存在，返回 None
     """
-    session = DBSession()
+    store = _dimensions
+    if store is not None:
+        record = store.players.get(player_id)
+        if record is not None:
+            return record
     try:
-        player = session.query(Player).filter(Player.id == player_id).first()
-        if player:
-            return {
-                'type': player.type,
-                'firstname': player.first_name,
-                'lastname': player.last_name,
-                'surname_first': player.surname_first,
-                'nationality': player.nationality,
-                'born': player.born,
-                'num_ranking_titles': player.num_ranking_titles
-            }
+        with _reader(session) as bind:
+            row = bind.execute(sqla.select(*_PLAYER_COLUMNS).where(Player.id == player_id)).first()
+        if row:
+            return PlayerRecord(*row)
         else:
             return None
     except Exception as e:
         print(f"Error querying player {player_id}: {e}")
         return None
-    finally:
-        session.close()
 
-def query_event_info(event_id):
+def query_event_info(event_id, session=None):
     """
     根据 event_id 查询赛事信息
 
     Args:
         event_id (int): 赛事ID
+        session: 可复用的会话或连接（见 lookup_session），默认每次新建
 
     Returns:
-        dict: 包含 name, start_date, end_date, season, type, venue, city, country, sex, age_group, url, stage, ranking_type, defending_champion 的字典
+        EventRecord: 只读映射，键为 name, start_date, end_date, season, type, venue, city, country, sex, age_group, url, stage, ranking_type, defending_champion
               如果查询失败或不存在，返回 None
     """
-    session = DBSession()
+    store = _dimensions
+    if store is not None:
+        record = store.events.get(event_id)
+        if record is not None:
+            return record
     try:
-        event = session.query(Event).filter(Event.id == event_id).first()
-        if event:
-            return {
-                'name': event.name,
-                'start_date': event.start_date,
-                'end_date': event.end_date,
-                'season': event.season,
-                'type': event.type,
-                'venue': event.venue,
-                'city': event.city,
-                'country': event.country,
-                'sex': event.sex,
-                'age_group': event.age_group,
-                'url': event.url,
-                'stage': event.stage,
-                'ranking_type': event.ranking_type,
-                'defending_champion': event.defending_champion
-            }
+        with _reader(session) as bind:
+            row = bind.execute(sqla.select(*_EVENT_COLUMNS).where(Event.id == event_id)).first()
+        if row:
+            return EventRecord(*row)
         else:
             return None
     except Exception as e:
         print(f"Error querying event {event_id}: {e}")
         return None
-    finally:
-        session.close()
 
-def query_round_info(event_id, round_num):
+def query_round_info(event_id, round_num, session=None):
     """
     根据 event_id 和 round 查询轮次信息
 
     Args:
         event_id (int): 赛事ID
         round_num (int): 轮次编号
+        session: 可复用的会话或连接（见 lookup_session），默认每次新建
 
     Returns:
-        dict: 包含 round_name, main_event, note, value_type, rank, money, seed_gets_half, actual_money, currency 的字典
+        RoundRecord: 只读映射，键为 round_name, distance, main_event, note, value_type, rank, money, seed_gets_half, actual_money, currency
               如果查询失败或不存在，返回 None
     """
-    session = DBSession()
+    store = _dimensions
+    if store is not None:
+        record = store.round(event_id, round_num)
+        if record is not None:
+            return record
     try:
-        round_info = session.query(Round).filter(
-            Round.event_id == event_id,
-            Round.round == round_num
-        ).first()
-        if round_info:
-            return {
-                'round_name': round_info.round_name,
-                'distance': round_info.distance,
-                'main_event': round_info.main_event,
-                'note': round_info.note,
-                'value_type': round_info.value_type,
-                'rank': round_info.rank,
-                'money': round_info.money,
-                'seed_gets_half': round_info.seed_gets_half,
-                'actual_money': round_info.actual_money,
-                'currency': round_info.currency
-            }
+        with _reader(session) as bind:
+            row = bind.execute(sqla.select(*_ROUND_COLUMNS).where(
+                Round.event_id == event_id,
+                Round.round == round_num
+            )).first()
+        if row:
+            return RoundRecord(*row)
         else:
             return None
     except Exception as e:
         print(f"Error querying round for event {event_id}, round {round_num}: {e}")
         return None
-    finally:
-        session.close()
 
-def query_player_ranking(player_id):
+def query_player_ranking(player_id, session=None):
     """
     根据 player_id 查询运动员排名信息
 
     Args:
         player_id (int): 运动员ID
+        session: 可复用的会话或连接（见 lookup_session），默认每次新建
 
     Returns:
-        dict: 包含 position, sum_value 的字典
+        RankingRecord: 只读映射，键为 position, sum_value, player_id
               如果查询失败或不存在，返回 None
     """
-    session = DBSession()
+    store = _dimensions
+    if store is not None:
+        record = store.rankings.get(player_id)
+        if record is not None:
+            return record
     try:
-        ranking = session.query(Ranking).filter(Ranking.player_id == player_id).first()
-        if ranking:
-            return {
-                'position': ranking.position,
-                'sum_value': ranking.sum_value
-            }
+        with _reader(session) as bind:
+            row = bind.execute(sqla.select(*_RANKING_COLUMNS).where(Ranking.player_id == player_id)
+                               .order_by(Ranking.position).limit(1)).first()
+        if row:
+            return RankingRecord(*row)
         else:
             return None
     except Exception as e:
         print(f"Error querying ranking for player {player_id}: {e}")
         return None
-    finally:
-        session.close()
-def query_all_ranking_players(page=1, limit=-1, search=None):
+
+def query_player_exists(player_id, session=None):
+    """
+    players 或 rankings 表中是否有该球员（只读主键/索引列）
+
+    Raises:
+        Exception: 查询失败时抛出，调用方可以区分“不存在”和“无法确认”
+    """
+    with _reader(session) as bind:
+        if bind.execute(sqla.select(Player.id).where(Player.id == player_id)).first() is not None:
+            return True
+        return bind.execute(sqla.select(Ranking.position).where(Ranking.player_id == player_id).limit(1)) \
+            .first() is not None
+
+def _ranking_player_dict(ranking, player, last_updated):
+    """排名列表中的一行：球员信息 + 排名 + 日历更新时间"""
+    return {
+        'type': player.type if player is not None else None,
+        'firstname': player.firstname if player is not None else None,
+        'lastname': player.lastname if player is not None else None,
+        'surname_first': player.surname_first if player is not None else None,
+        'nationality': player.nationality if player is not None else None,
+        'born': player.born if player is not None else None,
+        'num_ranking_titles': player.num_ranking_titles if player is not None else None,
+        'position': ranking.position,
+        'player_id': ranking.player_id,
+        'sum_value': ranking.sum_value,
+        'last_updated': last_updated,
+    }
+
+def _name_matches(player, needle):
+    if player is None:
+        return False
+    return any(needle in name.casefold() for name in (player.firstname, player.lastname) if name)
+
+def query_all_ranking_players(page=1, limit=-1, search=None, session=None):
     """
         查询所有有排名的球员
+
+        排名和球员信息来自维度存储（按同步版本刷新），只有日历更新时间需要查询数据库
     """
-    session = DBSession()
+    store = current_dimensions()
+    if store is None:
+        raise RuntimeError("dimension store is not available")
+    rankings = store.ranked
+    if search:
+        needle = search.casefold()
+        rankings = [r for r in rankings if _name_matches(store.players.get(r.player_id), needle)]
+    if limit > 0:
+        rankings = rankings[(page - 1) * limit:page * limit]
+    ics_query = sqla.select(IcsLastUpdated.playerid, IcsLastUpdated.lastupdated)
+    if limit > 0 or search:
+        ics_query = ics_query.where(IcsLastUpdated.playerid.in_([r.player_id for r in rankings]))
     try:
-        if search:
-            search_pattern = f"%{search}%"
-            if limit > 0:
-                results = session.query(Ranking, Player, IcsLastUpdated).outerjoin(
-                    Player, Player.id == Ranking.player_id
-                ).outerjoin(
-                    IcsLastUpdated, IcsLastUpdated.playerid == Ranking.player_id
-                ).filter(
-                    sqla.or_(
-                        Player.first_name.ilike(search_pattern),
-                        Player.last_name.ilike(search_pattern)
-                    )
-                ).limit(limit).offset((page - 1) * limit).all()
-            else:
-                results = session.query(Ranking, Player, IcsLastUpdated).outerjoin(
-                    Player, Player.id == Ranking.player_id
-                ).outerjoin(
-                    IcsLastUpdated, IcsLastUpdated.playerid == Ranking.player_id
-                ).filter(
-                    sqla.or_(
-                        Player.first_name.ilike(search_pattern),
-                        Player.last_name.ilike(search_pattern)
-                    )
-                ).all()
-        else:
-            if limit > 0:
-                results = session.query(Ranking, Player, IcsLastUpdated).outerjoin(
-                Player, Player.id == Ranking.player_id
-                ).outerjoin(
-                IcsLastUpdated, IcsLastUpdated.playerid == Ranking.player_id
-                ).limit(limit).offset((page - 1) * limit).all()
-            else:
-                results = session.query(Ranking, Player, IcsLastUpdated).outerjoin(
-                Player, Player.id == Ranking.player_id
-                ).outerjoin(
-                IcsLastUpdated, IcsLastUpdated.playerid == Ranking.player_id
-                ).all()
-        players = []
-        for ranking, player, ics in results:
-            # Build a merged dict with the fields the caller expects.
-            players.append({
-                'type': getattr(player, 'type', None) if player is not None else None,
-                'firstname': getattr(player, 'first_name', None) if player is not None else None,
-                'lastname': getattr(player, 'last_name', None) if player is not None else None,
-                'surname_first': getattr(player, 'surname_first', None) if player is not None else None,
-                'nationality': getattr(player, 'nationality', None) if player is not None else None,
-                'born': getattr(player, 'born', None) if player is not None else None,
-                'num_ranking_titles': getattr(player, 'num_ranking_titles', None) if player is not None else None,
-                'position': ranking.position,
-                'player_id': ranking.player_id,
-                'sum_value': ranking.sum_value,
-                'last_updated': ics.lastupdated if ics is not None else None
-            })
-
-        return players
+        with _reader(session) as bind:
+            last_updated = dict(bind.execute(ics_query).all())
     except Exception as e:
         print(f"Error querying ranking: {type(e).__name__}: {e}")
         raise
-    finally:
-        session.close()
+    return [_ranking_player_dict(r, store.players.get(r.player_id), last_updated.get(r.player_id))
+            for r in rankings]
+
+def _event_summaries(session, *criteria, ordered=False):
+    """赛事列表只投影 id, name, start_date, end_date 四列"""
+    query = sqla.select(Event.id, Event.name, Event.start_date, Event.end_date).where(*criteria)
+    if ordered:
+        query = query.order_by(Event.start_date)
+    with _reader(session) as bind:
+        rows = bind.execute(query).all()
+    return [
+        {'id': row.id, 'name': row.name, 'start_date': row.start_date, 'end_date': row.end_date}
+        for row in rows
+    ]
+
+def query_active_events(today=None, session=None):
+    """
+    查询今天正在进行的赛事（start_date <= today <= end_date）
+
+    Args:
+        today (datetime.date): 参考日期，默认为当前 UTC 日期
+        session: 可复用的会话或连接，默认新建
+
+    Returns:
+        list: 包含 id, name, start_date, end_date 的字典列表，查询失败时返回空列表
+    """
+    if today is None:
+        today = datetime.datetime.utcnow().date()
+    # 日期以 YYYY-MM-DD 字符串存储，可直接按字符串比较
+    today_str = today.isoformat()
+    try:
+        return _event_summaries(session, Event.start_date <= today_str, Event.end_date >= today_str)
+    except Exception as e:
+        print(f"Error querying active events: {e}")
+        return []
+
+def query_open_events(today=None, season=None, session=None):
+    """
+    查询当前赛季中尚未结束的赛事（end_date >= today），即需要同步比赛变化的赛事
+
+    Args:
+        today (datetime.date): 参考日期，默认为当前 UTC 日期
+        season (int): 赛季，默认为当前赛季
+        session: 可复用的会话或连接，默认新建
+
+    Returns:
+        list: 包含 id, name, start_date, end_date 的字典列表，查询失败时返回空列表
+    """
+    if today is None:
+        today = datetime.datetime.utcnow().date()
+    if season is None:
+        season = get_current_season()
+    try:
+        return _event_summaries(session, Event.season == season, Event.end_date >= today.isoformat(), ordered=True)
+    except Exception as e:
+        print(f"Error querying open events: {e}")
+        return []
+
+def query_season_events(season, session=None):
+    """
+    查询某个赛季的全部赛事
+
+    Returns:
+        list: 包含 id, name, start_date, end_date 的字典列表，查询失败时返回空列表
+    """
+    try:
+        return _event_summaries(session, Event.season == season, ordered=True)
+    except Exception as e:
+        print(f"Error querying season events: {e}")
+        return []
+
+def query_player_stats(player_id, season=None):
+    """
+    查询球员的赛季统计（胜负场、胜负局、奖金、排名积分），单行读取物化表
+
+    Args:
+        player_id (int): 球员ID
+        season (int): 赛季，默认为当前赛季
+
+    Returns:
+        dict: 统计数据，没有记录时返回 None
+    """
+    from player_stats import PlayerStatsStore
+    if season is None:
+        season = get_current_season()
+    return PlayerStatsStore(engine).get(player_id, season)
+
+def _side_dict(row, side):
+    player_id = getattr(row, f'player{side}_id')
+    if not player_id:
+        return None
+    return {
+        'player_id': player_id,
+        'firstname': getattr(row, f'p{side}_firstname'),
+        'lastname': getattr(row, f'p{side}_lastname'),
+        'surname_first': getattr(row, f'p{side}_surname_first'),
+        'nationality': getattr(row, f'p{side}_nationality'),
+        'position': getattr(row, f'p{side}_position'),
+    }
+
+def query_upcoming_matches(match_ids=None, session=None):
+    """
+    查询尚未结束且已排定时间的比赛，并预先关联球员、排名、赛事和轮次的展示数据
+
+    Args:
+        match_ids (list): 只查询这些比赛（用于增量更新），默认查询全部
+        session: 可复用的会话或连接，默认新建
+
+    Returns:
+        list: (比赛时间字符串, 比赛字典) 元组列表；比赛时间取 start_date，没有时取 scheduled_date
+    """
+    from match_changes import MatchState
+    m = MatchState
+    p1, p2 = sqla.orm.aliased(Player), sqla.orm.aliased(Player)
+    r1, r2 = sqla.orm.aliased(Ranking), sqla.orm.aliased(Ranking)
+    # 只投影展示需要的列，不加载球员和赛事的大文本字段
+    query = sqla.select(
+        m.match_id, m.start_date, m.scheduled_date, m.status, m.score1, m.score2,
+        m.event_id, m.round, m.player1_id, m.player2_id,
+        Event.name.label('event_name'), Event.venue, Event.city,
+        Round.round_name, Round.distance,
+        p1.first_name.label('p1_firstname'), p1.last_name.label('p1_lastname'),
+        p1.surname_first.label('p1_surname_first'), p1.nationality.label('p1_nationality'),
+        r1.position.label('p1_position'),
+        p2.first_name.label('p2_firstname'), p2.last_name.label('p2_lastname'),
+        p2.surname_first.label('p2_surname_first'), p2.nationality.label('p2_nationality'),
+        r2.position.label('p2_position'),
+    ).select_from(m).outerjoin(
+        Event, Event.id == m.event_id
+    ).outerjoin(
+        Round, sqla.and_(Round.event_id == m.event_id, Round.round == m.round)
+    ).outerjoin(p1, p1.id == m.player1_id).outerjoin(r1, r1.player_id == m.player1_id
+    ).outerjoin(p2, p2.id == m.player2_id).outerjoin(r2, r2.player_id == m.player2_id
+    ).where(
+        sqla.func.coalesce(m.winner_id, 0) == 0,
+        m.end_date.is_(None),
+        sqla.or_(m.start_date.isnot(None), m.scheduled_date.isnot(None)),
+    )
+    if match_ids is not None:
+        query = query.where(m.match_id.in_(list(match_ids)))
+    with _reader(session) as bind:
+        rows = bind.execute(query).all()
+    matches = []
+    for row in rows:
+        matches.append((row.start_date or row.scheduled_date, {
+            'match_id': row.match_id,
+            'start': row.start_date or row.scheduled_date,
+            'status': row.status,
+            'score1': row.score1,
+            'score2': row.score2,
+            'event': {
+                'event_id': row.event_id,
+                'name': row.event_name,
+                'venue': row.venue,
+                'city': row.city,
+            },
+            'round': {
+                'round': row.round,
+                'round_name': row.round_name,
+                'distance': row.distance,
+            },
+            'player1': _side_dict(row, 1),
+            'player2': _side_dict(row, 2),
+        }))
+    return matches
+
+def query_latest_match_change_id():
+    """最新一条比赛变更的 id，没有变更时返回 0"""
+    from match_changes import MatchChangeLog
+    return MatchChangeLog(engine).latest_id()
+
+def query_match_changes(since=0, limit=500):
+    """
+    查询比赛变更记录（按 id 递增）
+
+    Args:
+        since (int): 只返回 id 大于该值的变更
+        limit (int): 最多返回的条数
+
+    Returns:
+        list: 变更字典列表（见 match_changes.change_dict）
+    """
+    from match_changes import MatchChangeLog
+    return MatchChangeLog(engine).changes_since(since, limit)
 
 def query_info_last_updated():
     session = DBSession()
@@ -358,59 +658,142 @@ def query_info_last_updated():
         session.close()
 
 
+# 当前赛季持久化在 infovalues 表中，读取方直接使用持久化的值，
+# 由调度器的后台任务（或过期时本进程的一个后台线程）调用外部 API 刷新
+SEASON_KEY = 'current_season'
+_SEASON_CACHE_TTL = 600  # 进程内缓存 10 分钟，之后重新读取数据库中的值
+_SEASON_STALE_AFTER = datetime.timedelta(hours=24)
+
 _current_season_cache = {"value": None, "ts": 0}
-_SEASON_CACHE_TTL = 86400  # 24 hours
+_season_refresh_lock = threading.Lock()
+
+
+def init_db():
+    from match_changes import MatchChangeLog
+    from player_stats import PlayerStatsStore
+    from player_resolver import PlayerResolver
+    InfoValue.__table__.create(engine, checkfirst=True)
+    MatchChangeLog(engine).init_db()
+    PlayerStatsStore(engine).init_db()
+    PlayerResolver(engine).init_db()
+
+
+def _estimate_season(today=None):
+    """没有任何持久化值时的估计：斯诺克赛季在每年夏天开始"""
+    today = today or datetime.datetime.utcnow().date()
+    return today.year if today.month >= 6 else today.year - 1
+
+
+def _load_persisted_season():
+    """返回 (season, updated_at)，没有记录或查询失败时返回 (None, None)"""
+    session = DBSession()
+    try:
+        row = session.query(InfoValue).filter(InfoValue.name == SEASON_KEY).first()
+        if row is None or row.value is None:
+            return None, None
+        return int(row.value), row.updated_at
+    except Exception as e:
+        print(f"Error reading persisted season: {e}")
+        return None, None
+    finally:
+        session.close()
 
 
-def get_current_season(retries: int = 3, backoff_factor: float = 1.0, status_forcelist=(429, 500, 502, 503, 504)):
-    """缓存包装器：结果缓存 24 小时，避免每次请求都调用外部 API。"""
+def _store_season(season, now=None):
+    session = DBSession()
+    try:
+        session.merge(InfoValue(name=SEASON_KEY, value=str(season), updated_at=now or datetime.datetime.utcnow()))
+        session.commit()
+    finally:
+        session.close()
+
+
+def refresh_current_season():
+    """
+    从外部 API 获取当前赛季并持久化，供后台任务调用（可能因重试而阻塞）
+
+    Returns:
+        int: 新的赛季，获取失败时返回 None（保留原有的持久化值）
+    """
+    from upstream import CircuitOpenError
+    try:
+        season = _fetch_current_season()
+    except CircuitOpenError as e:
+        print(f"Skipping season refresh: {e}")
+        return None
+    if season is None:
+        return None
+    _store_season(season)
+    _current_season_cache["value"] = season
+    _current_season_cache["ts"] = time.time()
+    return season
+
+
+def _refresh_in_background():
+    """每个进程最多同时运行一个后台刷新线程"""
+    if not _season_refresh_lock.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            refresh_current_season()
+        except Exception as e:
+            print(f"Background season refresh failed: {e}")
+        finally:
+            _season_refresh_lock.release()
+
+    threading.Thread(target=run, name='season-refresh', daemon=True).start()
+
+
+def get_current_season():
+    """
+    返回当前赛季，从不在调用方线程中请求外部 API
+
+    依次使用进程内缓存、数据库中持久化的值；持久化的值过期或不存在时触发一次后台刷新，
+    不存在时先返回按日期估计的赛季。
+    """
     now = time.time()
     if _current_season_cache["value"] is not None and now - _current_season_cache["ts"] < _SEASON_CACHE_TTL:
         return _current_season_cache["value"]
 
-    result = _fetch_current_season(retries, backoff_factor, status_forcelist)
-    if result is not None:
-        _current_season_cache["value"] = result
+    season, updated_at = _load_persisted_season()
+    if season is None:
+        _refresh_in_background()
+        # 数据库不可用时继续使用进程内的旧值
+        season = _current_season_cache["value"] or _estimate_season()
+        _current_season_cache["value"] = season
         _current_season_cache["ts"] = now
-    return result
+        return season
 
+    if updated_at is None or datetime.datetime.utcnow() - updated_at > _SEASON_STALE_AFTER:
+        _refresh_in_background()
+    _current_season_cache["value"] = season
+    _current_season_cache["ts"] = now
+    return season
 
-def _fetch_current_season(retries: int = 3, backoff_factor: float = 1.0, status_forcelist=(429, 500, 502, 503, 504)):
+
+def _fetch_current_season():
     """
     从 https://api.snooker.org/?t=20 获取当前赛季（CurrentSeason）。
 
     使用 `api_config['x_requested_by']` 设置请求头 `X-Requested-By`。
-    返回 CurrentSeason 的整数值，如果请求失败或未找到返回 None。
+    请求经由进程共享的连接池发送（超时、重试与断路器均由其负责）。
+    返回 CurrentSeason 的整数值，如果请求失败或未找到返回 None；断路器打开时抛出 CircuitOpenError。
     """
+    from upstream import create_session, CircuitOpenError
     url = 'https://api.snooker.org/?t=20'
     headers = {}
+    # api_config 来自模块顶部的 load_config
+    x_req = api_config.get('x_requested_by') if isinstance(api_config, dict) else None
+    if x_req:
+        headers['X-Requested-By'] = x_req
+
     try:
-        # api_config 来自模块顶部的 load_config
-        x_req = api_config.get('x_requested_by') if isinstance(api_config, dict) else None
-        if x_req:
-            headers['X-Requested-By'] = x_req
-    except Exception:
-        # 忽略, headers 保持为空
-        pass
-
-    # Build a requests Session with retry policy
-    session = requests.Session()
-    try:
-        retry = Retry(
-            total=retries,
-            read=retries,
-            connect=retries,
-            backoff_factor=backoff_factor,
-            status_forcelist=status_forcelist,
-            allowed_methods=frozenset(["GET", "HEAD"])
-        )
-        adapter = HTTPAdapter(max_retries=retry)
-        session.mount("https://", adapter)
-        session.mount("http://", adapter)
-
-        resp = session.get(url, headers=headers, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
+        # 关闭会话本身；共享的连接池不会随之关闭
+        with create_session(headers) as session:
+            resp = session.get(url)
+            resp.raise_for_status()
+            data = resp.json()
         # 期望返回像 [{"CurrentSeason": 2024}]
         if isinstance(data, list) and len(data) > 0:
             return data[0].get('CurrentSeason')
@@ -418,39 +801,11 @@ def _fetch_current_season(retries: int = 3, backoff_factor: float = 1.0, status_
             return data.get('CurrentSeason')
         else:
             return None
+    except CircuitOpenError:
+        raise
     except Exception as e:
-        # If Retry-based adapter isn't available or raises, fallback to manual retry loop
-        try:
-            # print a debug/log message indicating fallback to manual retries
-            print(f"Primary request failed or retry adapter error, fallback manual retry: {e}")
-            for attempt in range(1, retries + 1):
-                try:
-                    resp = requests.get(url, headers=headers, timeout=10)
-                    resp.raise_for_status()
-                    data = resp.json()
-                    if isinstance(data, list) and len(data) > 0:
-                        return data[0].get('CurrentSeason')
-                    elif isinstance(data, dict):
-                        return data.get('CurrentSeason')
-                    else:
-                        return datetime.now().year 
-                except Exception as inner_e:
-                    # If it's the last attempt, raise
-                    if attempt == retries:
-                        print(f"Final attempt failed: {inner_e}")
-                        return datetime.now().year
-                    # Sleep with exponential backoff before next attempt
-                    sleep_time = backoff_factor * (2 ** (attempt - 1))
-                    print(f"Retry {attempt}/{retries} failed: {inner_e}. Sleeping {sleep_time}s before next attempt.")
-                    time.sleep(sleep_time)
-        except Exception as inner_fallback_e:
-            print(f"Fallback retry mechanism failed: {inner_fallback_e}")
-            return datetime.now().year
-    finally:
-        try:
-            session.close()
-        except Exception:
-            pass
+        print(f"Failed to fetch current season: {e}")
+        return None
 
 
 if __name__ == '__main__':
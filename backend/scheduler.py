@@ -4,14 +4,32 @@ from apscheduler.triggers.cron import CronTrigger
 import logging
 from fetch_events import fetch_and_store_events
 from fetch_players import fetch_and_store_players
-from batch_ics_generator import generate_all_players_calendars
+from batch_ics_generator import generate_all_players_calendars, query_ics_schedules, expire_ics_schedules
+from query_data import (
+    query_all_ranking_players, query_active_events, query_open_events, lookup_snapshot,
+    get_current_season, refresh_current_season, init_db as init_query_tables
+)
+from ics_work_queue import WorkQueue, create_queue_engine, run_worker
+from async_pipeline import (
+    async_fetch_and_store_events,
+    async_fetch_and_store_players,
+    async_generate_all_players_calendars
+)
+from match_changes import MatchChangeLog, sync_event_matches
+from player_stats import PlayerStatsStore
+from player_resolver import PlayerResolver
+from calendar_gc import run_calendar_gc
+from upstream import create_snooker_client, transport_stats
 import configparser
 import sqlalchemy as sqla
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from datetime import datetime, date, timezone
+from datetime import datetime, date, timezone, timedelta
 import time
+import asyncio
 import threading
+import functools
+from contextlib import contextmanager
 
 # Function to load configuration from config.txt
 def load_config(filename='config.txt'):
@@ -29,6 +47,9 @@ def load_config(filename='config.txt'):
 # Load configurations
 db_config, api_config = load_config()
 
+# Configured by the __main__ block; defined here so the jobs also log when imported
+logger = logging.getLogger(__name__)
+
 # Create SQLAlchemy engine
 engine = sqla.create_engine(
     f"mysql+pymysql://{db_config['user']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}",
@@ -49,6 +70,7 @@ class InfoLastUpdated(Base):
 
 def init_db():
     Base.metadata.create_all(engine)
+    init_query_tables()
 def update_last_updated(info_name, timestamp):
     Session = sessionmaker(bind=engine)
     session = Session()
@@ -73,63 +95,422 @@ def needs_update_today(info_name):
     # record.lastupdated is stored in UTC (see update_last_updated)
     return record.lastupdated.date() != datetime.utcnow().date()
 
-# Global re-entrant lock to ensure only one job runs at a time
-job_lock = threading.RLock()
+def _config_int(key, default):
+    try:
+        return int(db_config.get(key, default))
+    except Exception:
+        return default
+
+# Refresh tiers: how often a player's calendar is regenerated, by match proximity
+REFRESH_TIERS = {
+    'live': timedelta(minutes=_config_int('refresh_live_minutes', 5)),
+    'week': timedelta(minutes=_config_int('refresh_week_minutes', 60)),
+    'idle': timedelta(minutes=_config_int('refresh_idle_minutes', 1440)),
+}
+
+def refresh_tier(schedule, now):
+    """
+    Assign a refresh tier from the match times recorded at the last generation.
+
+    All datetimes are naive UTC. Tiers are re-evaluated every tick, so a player
+    moves up as their next match approaches.
+    """
+    if schedule.live:
+        return 'live'
+    next_match, last_match = schedule.next_match, schedule.last_match
+    if next_match and next_match - now <= timedelta(hours=1):
+        return 'live'
+    if last_match and now - last_match <= timedelta(hours=1):
+        return 'live'
+    if next_match and next_match - now <= timedelta(days=7):
+        return 'week'
+    if last_match and now - last_match <= timedelta(days=1):
+        return 'week'
+    return 'idle'
+
+def select_due_players(now=None, changed=None):
+    """
+    Return the player IDs whose calendars are due for regeneration.
+
+    Without `changed`, the refresh tier of each ranked player decides. With the
+    players touched by the match change feed, ranked players are regenerated only
+    when one of their matches changed, plus a safety-net pass once their calendar
+    is older than the idle tier. Only ranked players have calendars generated, so
+    changed players outside the rankings are not due.
+    """
+    if now is None:
+        now = datetime.utcnow()
+    players = query_all_ranking_players() or []
+    schedules = query_ics_schedules()
+
+    due = []
+    tier_counts = {'new': 0, 'changed': 0, **{tier: 0 for tier in REFRESH_TIERS}}
+    for player in players:
+        player_id = player.get('player_id')
+        schedule = schedules.get(player_id)
+        if schedule is None or schedule.checked_at is None:
+            due.append(player_id)
+            tier_counts['new'] += 1
+            continue
+        if changed is not None:
+            if player_id in changed:
+                due.append(player_id)
+                tier_counts['changed'] += 1
+            elif now - schedule.checked_at >= REFRESH_TIERS['idle']:
+                due.append(player_id)
+                tier_counts['idle'] += 1
+            continue
+        tier = refresh_tier(schedule, now)
+        if now - schedule.checked_at >= REFRESH_TIERS[tier]:
+            due.append(player_id)
+            tier_counts[tier] += 1
+    logger.info(f"{len(due)}/{len(players)} players due for refresh (by reason: {tier_counts})")
+    return due
+
+class ReadWriteLock:
+    """Any number of readers or a single writer; a waiting writer blocks new readers."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+# Data sets the jobs share. Syncs write them; calendar generation reads both.
+resource_locks = {
+    'players': ReadWriteLock(),  # rankings + players tables
+    'events': ReadWriteLock(),   # events + rounds tables
+}
+
+@contextmanager
+def use_resources(read=(), write=()):
+    """Hold read/write locks on the named resources, acquired in a fixed order."""
+    held = []
+    try:
+        for name in sorted(set(read) | set(write)):
+            lock = resource_locks[name]
+            if name in write:
+                lock.acquire_write()
+                held.append(lock.release_write)
+            else:
+                lock.acquire_read()
+                held.append(lock.release_read)
+        yield
+    finally:
+        for release in reversed(held):
+            release()
+
+# Serializes generation of the same player between the batch and live jobs
+_player_locks = {}
+_player_locks_guard = threading.Lock()
+
+@contextmanager
+def player_snapshot(player_id):
+    """Per-player unit of work: one generator per player, reading a consistent snapshot."""
+    with _player_locks_guard:
+        player_lock = _player_locks.setdefault(player_id, threading.Lock())
+    with player_lock, use_resources(read=('players', 'events')):
+        yield
+
+class CoalescingJob:
+    """
+    Runs at most one instance of a job at a time.
+
+    A tick that arrives while the job is running is folded into a single rerun
+    once the current run finishes, instead of queueing one run per tick.
+    """
+
+    def __init__(self, func):
+        self._func = func
+        self._state = threading.Lock()
+        self._running = False
+        self._pending = False
+        functools.update_wrapper(self, func)
+
+    def __call__(self):
+        with self._state:
+            if self._running:
+                self._pending = True
+                logger.info(f"{self._func.__name__} already running; coalescing this tick")
+                return
+            self._running = True
+        try:
+            while True:
+                self._func()
+                with self._state:
+                    if not self._pending:
+                        return
+                    self._pending = False
+        finally:
+            with self._state:
+                self._running = False
+
+# Set by main() so jobs can trigger each other through the scheduler's executor
+_scheduler = None
+
+def trigger_job(job_id, func):
+    """Run a job now in its own worker instead of inline in the caller's tick."""
+    if _scheduler is not None and _scheduler.get_job(job_id) is not None:
+        _scheduler.modify_job(job_id, next_run_time=datetime.now(timezone.utc))
+    else:
+        threading.Thread(target=func, name=job_id, daemon=True).start()
 
+@CoalescingJob
 def update_rankings_job():
-    with job_lock:
+    with use_resources(write=('players',)):
         logger.info("Starting rankings update...")
         try:
-            fetch_and_store_players()
+            if pipeline_mode == 'async':
+                asyncio.run(async_fetch_and_store_players())
+            else:
+                fetch_and_store_players()
             # store UTC timestamp
             update_last_updated("players", datetime.utcnow())
             logger.info("Rankings update completed successfully")
         except Exception as e:
             logger.error(f"Rankings update failed: {e}")
 
+# 'sync' runs the sequential fetch/generate code; 'async' uses async_pipeline
+pipeline_mode = db_config.get('pipeline', 'sync')
+
+# 'local' generates in this process; 'queue' shares the work with other
+# scheduler instances through the icsworkqueue lease table.
+generation_mode = db_config.get('generation_mode', 'local')
+_work_queue = None
+
+# 'changes' regenerates players whose matches changed (see match_changes.py);
+# 'tiers' regenerates on a timer by refresh tier.
+regeneration_mode = db_config.get('regeneration_mode', 'changes')
+change_log = MatchChangeLog(engine)
+stats_store = PlayerStatsStore(engine)
+player_resolver = PlayerResolver(engine)
+
+def _update_player_stats():
+    """Fold newly recorded results into playerseasonstats; a failure here must not stop calendars."""
+    try:
+        written = stats_store.apply_changes(change_log)
+        if written:
+            logger.info(f"Updated season stats for {written} players")
+    except Exception as e:
+        logger.error(f"Player stats update failed: {e}")
+
+def _resolve_missing_players():
+    """
+    Fetch players that matches mention but are not stored, in one rate-limited pass
+
+    Calendars that showed a newly stored player as "Player <id>" are marked due,
+    since no match change will ever point at them.
+    """
+    try:
+        result = player_resolver.resolve(create_snooker_client(), season=get_current_season(),
+                                         wait_time=_request_delay())
+        if result['requests']:
+            logger.info(f"Resolved missing players: {result['stored']} stored, {result['unknown']} unknown "
+                        f"to snooker.org ({result['requests']} requests)")
+        if result['resolved']:
+            expired = expire_ics_schedules(player_resolver.calendars_mentioning(result['resolved']))
+            logger.info(f"Marked {expired} calendars mentioning newly stored players as due")
+    except Exception as e:
+        logger.error(f"Missing player resolution failed: {e}")
+
+def get_work_queue():
+    global _work_queue
+    if _work_queue is None:
+        _work_queue = WorkQueue(
+            create_queue_engine(),
+            lease_seconds=_config_int('queue_lease_minutes', 10) * 60,
+        )
+        _work_queue.init_db()
+    return _work_queue
+
+def _generate_queued_player(player_id):
+    from ics_work_queue import generate_queued_player
+    with player_snapshot(player_id):
+        return generate_queued_player(player_id)
+
+@CoalescingJob
 def generate_ics_job():
-    with job_lock:
-        logger.info("Starting ICS generation...")
-        try:
-            generate_all_players_calendars()
-            logger.info("ICS generation completed successfully")
-        except Exception as e:
-            logger.error(f"ICS generation failed: {e}")
+    logger.info("Starting ICS generation...")
+    try:
+        # Name every opponent before rendering instead of fetching them per match
+        _resolve_missing_players()
+        if regeneration_mode == 'changes':
+            changed, up_to = change_log.pending_players()
+            due = select_due_players(changed=set(changed))
+        else:
+            changed, up_to = [], None
+            due = select_due_players()
+        # Players the pass could not regenerate; None when it could not run at all
+        unfinished = set()
+        if due and generation_mode == 'queue':
+            queue = get_work_queue()
+            enqueued_at = datetime.utcnow()
+            logger.info(f"Queued {queue.enqueue(due, now=enqueued_at)} players for generation")
+            # Every instance also works the queue; leases keep the batches disjoint.
+            # Lookups are loaded once here and shared by every forked generator.
+            with lookup_snapshot(get_current_season()):
+                done = run_worker(queue, batch_size=_config_int('queue_batch_size', 5),
+                                  process=_generate_queued_player, drain=True)
+            logger.info(f"Generated {done} queued calendars in this instance")
+            # Failed players and players another instance still holds are not regenerated yet
+            unfinished = queue.unfinished(due, enqueued_at)
+        elif due and pipeline_mode == 'async':
+            # The async pass interleaves players, so it reads one snapshot for the whole pass
+            with use_resources(read=('players', 'events')):
+                unfinished = asyncio.run(async_generate_all_players_calendars(player_ids=due, redo=changed))
+        elif due:
+            unfinished = generate_all_players_calendars(player_ids=due, player_guard=player_snapshot, redo=changed)
+        if up_to is not None and unfinished is not None:
+            # Changed players that were not regenerated stay pending instead of waiting for the idle tier
+            change_log.advance(up_to, processed=changed, failed=unfinished & set(changed))
+        logger.info("ICS generation completed successfully")
+    except Exception as e:
+        logger.error(f"ICS generation failed: {e}")
 
-        # After generating ICS, opportunistically run the daily updates if they haven't run yet
-        try:
-            # Use UTC/GMT for opportunistic window
-            now = datetime.utcnow()
-            # GMT 02:00-05:00 window preference (change if you need a specific TZ)
-            if 2 <= now.hour < 5:
-                if needs_update_today("events"):
-                    logger.info("Within preferred window — running event info update")
-                    update_event_info_job()
-                if needs_update_today("players"):
-                    logger.info("Within preferred window — running rankings update")
-                    update_rankings_job()
-        except Exception as e:
-            logger.error(f"Error while checking/triggering opportunistic updates: {e}")
+    # After generating ICS, opportunistically run the daily updates if they haven't run yet.
+    # They are triggered as separate jobs so they do not stretch this tick.
+    try:
+        # Use UTC/GMT for opportunistic window
+        now = datetime.utcnow()
+        # GMT 02:00-05:00 window preference (change if you need a specific TZ)
+        if 2 <= now.hour < 5:
+            if needs_update_today("events"):
+                logger.info("Within preferred window — triggering event info update")
+                trigger_job('daily_event_info_fallback', update_event_info_job)
+            if needs_update_today("players"):
+                logger.info("Within preferred window — triggering rankings update")
+                trigger_job('daily_rankings_fallback', update_rankings_job)
+    except Exception as e:
+        logger.error(f"Error while checking/triggering opportunistic updates: {e}")
+
+def _request_delay():
+    return int(api_config.get('request_delay_seconds', 1))
+
+@CoalescingJob
+def live_events_job():
+    """Fast path during tournaments: sync active events and regenerate players whose matches changed."""
+    events = query_active_events()
+    if not events:
+        return
+    try:
+        changes = sync_event_matches(create_snooker_client(), change_log, events, wait_time=_request_delay())
+        _update_player_stats()
+        _resolve_missing_players()
+        affected, up_to = change_log.pending_players()
+        logger.info(f"Live refresh: {len(events)} active events, {len(changes)} match changes, "
+                    f"{len(affected)} players affected (snooker.org connections: {transport_stats()})")
+        unfinished = set()
+        if affected:
+            unfinished = generate_all_players_calendars(player_ids=affected, player_guard=player_snapshot,
+                                                        run_kind='live', redo=affected)
+        if unfinished is not None:
+            change_log.advance(up_to, processed=affected, failed=unfinished & set(affected))
+    except Exception as e:
+        logger.error(f"Live refresh failed: {e}")
+
+@CoalescingJob
+def match_sync_job():
+    """Record match changes for every event of the season that has not finished yet."""
+    events = query_open_events()
+    if not events:
+        return
+    try:
+        changes = sync_event_matches(create_snooker_client(), change_log, events, wait_time=_request_delay())
+        logger.info(f"Match sync: {len(changes)} changes across {len(events)} open events")
+        _update_player_stats()
+    except Exception as e:
+        logger.error(f"Match sync failed: {e}")
 
+@CoalescingJob
 def update_event_info_job():
-    with job_lock:
+    with use_resources(write=('events',)):
         logger.info("Starting event info update...")
         try:
-            fetch_and_store_events()
+            if pipeline_mode == 'async':
+                asyncio.run(async_fetch_and_store_events())
+            else:
+                fetch_and_store_events()
             # store UTC timestamp
             update_last_updated("events", datetime.utcnow())
-            logger.info("Event info update completed successfully")
+            logger.info(f"Event info update completed successfully (snooker.org connections: {transport_stats()})")
         except Exception as e:
             logger.error(f"Event info update failed: {e}")
 
+@CoalescingJob
+def recompute_stats_job():
+    """Rebuild the whole season's stats from the stored matches (guards against drift)."""
+    try:
+        season = get_current_season()
+        rows = stats_store.recompute(season)
+        logger.info(f"Recomputed season {season} stats for {rows} players")
+    except Exception as e:
+        logger.error(f"Season stats recompute failed: {e}")
+
+@CoalescingJob
+def refresh_season_job():
+    """The one place that calls the season API; everyone else reads the persisted value."""
+    season = refresh_current_season()
+    if season is None:
+        logger.error("Current season refresh failed; keeping the persisted value")
+    else:
+        logger.info(f"Current season refreshed: {season}")
+
+@CoalescingJob
+def calendar_gc_job():
+    """Prune calendars outside the retention policy and report the space reclaimed."""
+    with use_resources(read=('players',)):
+        logger.info("Starting calendar garbage collection...")
+        try:
+            report = run_calendar_gc(retention_days=_config_int('calendar_retention_days', 30))
+            if report is not None:
+                logger.info(f"Calendar garbage collection reclaimed {report['reclaimed_bytes']} bytes: {report}")
+        except Exception as e:
+            logger.error(f"Calendar garbage collection failed: {e}")
+
 def main():
+    global _scheduler
     # Run scheduler in UTC/GMT
     scheduler = BlockingScheduler(timezone=timezone.utc)
-    # interval for continuous ICS generation (minutes). Make configurable via config.txt if desired.
-    try:
-        generate_interval = int(db_config.get('generate_interval_minutes', 15))
-    except Exception:
-        generate_interval = 15
+    _scheduler = scheduler
+    # Tick interval for ICS generation (minutes). Each tick only regenerates players
+    # whose refresh tier is due, so keep this at or below the 'live' tier.
+    generate_interval = _config_int('generate_interval_minutes', 5)
+
+    # Refresh the persisted current season at startup and then twice a day
+    scheduler.add_job(
+        refresh_season_job,
+        trigger='interval',
+        hours=12,
+        id='season_refresh',
+        name='Current Season Refresh',
+        max_instances=2,
+        next_run_time=datetime.now(timezone.utc)
+    )
 
     # Run generate_ics_job continuously on an interval
     scheduler.add_job(
@@ -138,26 +519,69 @@ def main():
         minutes=generate_interval,
         id='continuous_ics_generation',
         name='Continuous ICS Generation',
+        # let overlapping ticks reach CoalescingJob, which folds them into one rerun
+        max_instances=2,
         # schedule first run immediately using UTC
         next_run_time=datetime.now(timezone.utc)
     )
 
+    # Poll active events frequently so results reach calendars within a minute or two
+    scheduler.add_job(
+        live_events_job,
+        trigger='interval',
+        minutes=_config_int('live_interval_minutes', 1),
+        id='live_event_refresh',
+        name='Live Event Refresh',
+        max_instances=2,
+        coalesce=True
+    )
+
+    # Diff the matches of every unfinished event into the change feed
+    scheduler.add_job(
+        match_sync_job,
+        trigger='interval',
+        minutes=_config_int('match_sync_minutes', 30),
+        id='match_sync',
+        name='Match Change Sync',
+        max_instances=2,
+        next_run_time=datetime.now(timezone.utc)
+    )
+
     # Add fallback daily cron jobs (05:10) to guarantee each update runs at least once per day
     # They check "needs_update_today" internally so they'll be no-ops if already run.
     scheduler.add_job(
         update_event_info_job,
         trigger=CronTrigger(hour=5, minute=10, timezone=timezone.utc),
         id='daily_event_info_fallback',
-        name='Daily Event Info Fallback'
+        name='Daily Event Info Fallback',
+        max_instances=2
     )
 
     scheduler.add_job(
         update_rankings_job,
         trigger=CronTrigger(hour=5, minute=40, timezone=timezone.utc),
         id='daily_rankings_fallback',
-        name='Daily Rankings Fallback'
+        name='Daily Rankings Fallback',
+        max_instances=2
+    )
+
+    # Reconcile ics_calendars/ once a day, after the rankings have been refreshed
+    scheduler.add_job(
+        calendar_gc_job,
+        trigger=CronTrigger(hour=6, minute=10, timezone=timezone.utc),
+        id='daily_calendar_gc',
+        name='Daily Calendar Garbage Collection',
+        max_instances=2
     )
     
+    scheduler.add_job(
+        recompute_stats_job,
+        trigger=CronTrigger(hour=6, minute=30, timezone=timezone.utc),
+        id='daily_stats_recompute',
+        name='Daily Season Stats Recompute',
+        max_instances=2
+    )
+
     logger.info("Scheduler started. Press Ctrl+C to exit.")
     for j in scheduler.get_jobs():
         # Prefer the Job attribute if present, otherwise ask the trigger for next fire time.
@@ -0,0 +1,121 @@
+"""
+Unit tests for the stale-while-revalidate cache (api_cache.py)
+
+No MySQL needed:
+    cd backend && python -m pytest test_api_cache.py -v
+"""
+import threading
+import time
+
+import pytest
+
+from api_cache import NegativeCache, SWRCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture()
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture()
+def cache(clock):
+    return SWRCache("test", soft_ttl=10, hard_ttl=100, max_entries=2, clock=clock)
+
+
+def test_fresh_entry_is_not_reloaded(cache):
+    calls = []
+    assert cache.get("k", lambda: calls.append(1) or "a") == "a"
+    assert cache.get("k", lambda: calls.append(1) or "b") == "a"
+    assert len(calls) == 1
+
+
+def test_single_background_refresh_for_concurrent_stale_hits(cache, clock):
+    cache.get("k", lambda: "old")
+    clock.now += 50
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow_load():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "new"
+
+    assert cache.get("k", slow_load) == "old"
+    started.wait(5)
+    assert cache.get("k", slow_load) == "old"
+    release.set()
+    cache.wait_idle(timeout=5)
+    assert len(calls) == 1
+    assert cache.get("k", lambda: "unused") == "new"
+
+
+def test_hard_expiry_loads_synchronously(cache, clock):
+    cache.get("k", lambda: "old")
+    clock.now += 101
+    assert cache.get("k", lambda: "new") == "new"
+
+
+def test_failed_load_falls_back_to_stale_value(cache, clock):
+    cache.get("k", lambda: "old")
+    clock.now += 1000
+
+    def broken():
+        raise ConnectionError("db down")
+
+    assert cache.get("k", broken) == "old"
+    with pytest.raises(ConnectionError):
+        cache.get("missing", broken)
+
+
+def test_none_is_not_cached_and_lru_is_bounded(cache):
+    calls = []
+    cache.get("none", lambda: calls.append(1))
+    cache.get("none", lambda: calls.append(1))
+    assert len(calls) == 2
+    for key in ("a", "b", "c"):
+        cache.get(key, lambda: key)
+    assert list(cache._entries) == ["b", "c"]
+
+
+def test_concurrent_misses_share_one_load(cache):
+    calls = []
+
+    def load():
+        calls.append(1)
+        time.sleep(0.05)
+        return "v"
+
+    threads = [threading.Thread(target=cache.get, args=("k", load)) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+
+
+class TestNegativeCache:
+
+    def test_entries_expire(self):
+        now = [0.0]
+        cache = NegativeCache(ttl=10, clock=lambda: now[0])
+        cache.add(5)
+        assert 5 in cache and 6 not in cache
+        now[0] = 10.0
+        assert 5 not in cache
+        assert len(cache) == 0
+
+    def test_size_is_bounded(self):
+        cache = NegativeCache(ttl=10, max_entries=2)
+        for key in (1, 2, 3):
+            cache.add(key)
+        assert 1 not in cache and 2 in cache and 3 in cache
@@ -15,12 +15,17 @@ Supports two execution modes:
 Covers:
   - GET /api/players          (pagination, search, caching, error handling)
   - GET /api/calendar/{id}    (file download, generation, 404, errors)
+  - GET /api/calendar/{id}/meta and the calendar manifest (hash ETags, versions)
+  - Hot calendar store        (LRU hits, ETag, gzip, invalidation)
   - GET /api/info/lastupdated (normal, caching, error handling)
+  - Startup warm-up, /healthz and /readyz
   - CORS middleware
   - Edge cases
 """
+import json
 import os
 import sys
+from datetime import datetime
 from unittest.mock import patch, MagicMock
 from time import time as _time
 
@@ -63,12 +68,22 @@ def _clear_caches(request):
         return
     import app as _app
     _app._players_cache.clear()
-    _app._last_updated_cache["data"] = None
-    _app._last_updated_cache["ts"] = 0
+    _app._last_updated_cache.clear()
+    _app._hot_calendars.clear()
     yield
     _app._players_cache.clear()
-    _app._last_updated_cache["data"] = None
-    _app._last_updated_cache["ts"] = 0
+    _app._last_updated_cache.clear()
+    _app._hot_calendars.clear()
+
+
+@pytest.fixture()
+def manifest_dir(request, tmp_path):
+    """Publish calendars into a throwaway directory instead of ics_calendars/."""
+    _skip_in_live(request)
+    import app as _app
+    from calendar_manifest import ManifestReader
+    with patch.object(_app, "_manifest", ManifestReader(str(tmp_path), check_interval=0)):
+        yield tmp_path
 
 
 def _skip_in_live(request):
@@ -217,10 +232,42 @@ class TestGetPlayersMock:
             mock_query.return_value = _make_players(1)
             client.get("/api/players")
             assert mock_query.call_count == 1
-            mock_time.return_value = t0 + 301
+            mock_time.return_value = t0 + 3601
+            client.get("/api/players")
+            assert mock_query.call_count == 2
+
+    def test_stale_served_while_refreshing(self, request, client):
+        _skip_in_live(request)
+        import app as _app
+        with patch("app._time") as mock_time, \
+             patch("app.query_all_ranking_players") as mock_query:
+            t0 = 1000000.0
+            mock_time.return_value = t0
+            mock_query.return_value = _make_players(1)
             client.get("/api/players")
+            mock_time.return_value = t0 + 301
+            mock_query.return_value = _make_players(2)
+            resp = client.get("/api/players")
+            assert len(resp.json()) == 1
+            _app._players_cache.wait_idle(timeout=5)
+            assert mock_query.call_count == 2
+            assert len(client.get("/api/players").json()) == 2
             assert mock_query.call_count == 2
 
+    def test_stale_served_when_db_unreachable(self, request, client):
+        _skip_in_live(request)
+        with patch("app._time") as mock_time, \
+             patch("app.query_all_ranking_players") as mock_query:
+            t0 = 1000000.0
+            mock_time.return_value = t0
+            mock_query.return_value = _make_players(1)
+            client.get("/api/players")
+            mock_time.return_value = t0 + 7200
+            mock_query.side_effect = RuntimeError("DB connection lost")
+            resp = client.get("/api/players")
+            assert resp.status_code == 200
+            assert len(resp.json()) == 1
+
     def test_query_exception_returns_500(self, request, client):
         _skip_in_live(request)
         with patch("app.query_all_ranking_players", side_effect=RuntimeError("DB connection lost")):
@@ -288,25 +335,305 @@ class TestCalendarMock:
             if os.path.exists(dummy):
                 os.remove(dummy)
 
+    def test_cache_control_from_published_ttl(self, request, client):
+        _skip_in_live(request)
+        dummy = os.path.join("ics_calendars", "1.ics")
+        os.makedirs("ics_calendars", exist_ok=True)
+        try:
+            with open(dummy, "wb") as f:
+                f.write(b"BEGIN:VCALENDAR\r\nVERSION:2.0\r\n"
+                        b"REFRESH-INTERVAL;VALUE=DURATION:PT15M\r\n"
+                        b"X-PUBLISHED-TTL:PT15M\r\nEND:VCALENDAR\r\n")
+            resp = client.get("/api/calendar/1")
+            assert resp.headers["cache-control"] == "public, max-age=900"
+            resp = client.get("/static/1.ics")
+            assert resp.headers["cache-control"] == "public, max-age=900"
+        finally:
+            if os.path.exists(dummy):
+                os.remove(dummy)
+
+    def test_no_cache_control_without_ttl(self, request, client):
+        _skip_in_live(request)
+        dummy = os.path.join("ics_calendars", "1.ics")
+        os.makedirs("ics_calendars", exist_ok=True)
+        try:
+            with open(dummy, "wb") as f:
+                f.write(b"BEGIN:VCALENDAR\r\nVERSION:2.0\r\nEND:VCALENDAR\r\n")
+            resp = client.get("/api/calendar/1")
+            assert resp.status_code == 200
+            assert "cache-control" not in resp.headers
+        finally:
+            if os.path.exists(dummy):
+                os.remove(dummy)
+
     def test_no_matches_404(self, request, client):
         _skip_in_live(request)
         with patch("app.os.path.exists", return_value=False), \
              patch.dict("sys.modules", {"player_matches_to_ics": MagicMock()}), \
              patch("app.get_current_season", return_value=2025):
-            sys.modules["player_matches_to_ics"].generate_player_calendar = MagicMock(return_value=None)
+            sys.modules["player_matches_to_ics"].stream_player_calendar = MagicMock(return_value=None)
             resp = client.get("/api/calendar/9999")
             assert resp.status_code in (404, 500)
 
+    def test_generated_calendar_streamed_and_cached(self, client, manifest_dir):
+        import app as _app
+        chunks = [b"BEGIN:VCALENDAR\r\nX-PUBLISHED-TTL:PT1H\r\n",
+                  b"BEGIN:VEVENT\r\nUID:1\r\nEND:VEVENT\r\n",
+                  b"END:VCALENDAR\r\n"]
+        with patch.dict("sys.modules", {"player_matches_to_ics": MagicMock()}), \
+             patch("app._is_known_player", return_value=True), \
+             patch("app.current_dimensions"), \
+             patch("app.get_current_season", return_value=2025):
+            sys.modules["player_matches_to_ics"].stream_player_calendar = MagicMock(
+                return_value=iter(chunks))
+            resp = client.get("/api/calendar/4242")
+        assert resp.status_code == 200
+        assert resp.content == b"".join(chunks)
+        assert resp.headers["cache-control"] == "public, max-age=3600"
+        meta = _app._manifest.get(4242)
+        with open(_app._manifest.object_path(meta), "rb") as f:
+            assert f.read() == b"".join(chunks)
+        assert meta["size"] == len(b"".join(chunks))
+        assert meta["event_count"] == 1
+
+    def test_failed_stream_leaves_no_partial_file(self, client, manifest_dir):
+        import app as _app
+
+        def broken():
+            yield b"BEGIN:VCALENDAR\r\n"
+            raise RuntimeError("upstream went away")
+
+        with patch.dict("sys.modules", {"player_matches_to_ics": MagicMock()}), \
+             patch("app._is_known_player", return_value=True), \
+             patch("app.current_dimensions"), \
+             patch("app.get_current_season", return_value=2025):
+            sys.modules["player_matches_to_ics"].stream_player_calendar = MagicMock(return_value=broken())
+            with pytest.raises(RuntimeError):
+                client.get("/api/calendar/4243")
+        assert list((manifest_dir / "objects").rglob("*")) == []
+        assert _app._manifest.get(4243) is None
+
     def test_calendar_negative_id(self, request, client):
         _skip_in_live(request)
         with patch("app.os.path.exists", return_value=False), \
              patch.dict("sys.modules", {"player_matches_to_ics": MagicMock()}), \
              patch("app.get_current_season", return_value=2025):
-            sys.modules["player_matches_to_ics"].generate_player_calendar = MagicMock(return_value=None)
+            sys.modules["player_matches_to_ics"].stream_player_calendar = MagicMock(return_value=None)
             resp = client.get("/api/calendar/-1")
             assert resp.status_code in (404, 500)
 
 
+# ===========================================================================
+# Known-player guard for on-demand generation — mock-only
+# ===========================================================================
+
+class TestKnownPlayerGuard:
+
+    @pytest.fixture(autouse=True)
+    def _guard(self, request, manifest_dir):
+        import app as _app
+        from dimension_store import DimensionStore, PlayerRecord
+        _app._unknown_players.clear()
+        store = DimensionStore(None, 2025, {7: PlayerRecord(1, "Judd", "Trump", False, "England", None, 30)},
+                               {}, {}, [])
+        self.generate = MagicMock(return_value=None)
+        with patch.dict("sys.modules", {"player_matches_to_ics": MagicMock(stream_player_calendar=self.generate)}), \
+             patch("app.current_dimensions", return_value=store), \
+             patch("app.get_current_season", return_value=2025):
+            yield
+        _app._unknown_players.clear()
+
+    def test_unknown_id_is_rejected_and_remembered(self, client):
+        with patch("app.query_player_exists", return_value=False) as exists:
+            assert client.get("/api/calendar/424242").status_code == 404
+            assert client.get("/api/calendar/424242").status_code == 404
+        exists.assert_called_once_with(424242)
+        self.generate.assert_not_called()
+
+    def test_placeholder_id_skips_every_lookup(self, client):
+        with patch("app.query_player_exists") as exists:
+            assert client.get("/api/calendar/0").status_code == 404
+        exists.assert_not_called()
+
+    def test_known_player_is_generated(self, client):
+        with patch("app.query_player_exists") as exists:
+            # No matches: the 404 from generation is no longer turned into a 500
+            resp = client.get("/api/calendar/7")
+        assert resp.status_code == 404 and resp.json()["detail"] == "No matches found"
+        exists.assert_not_called()
+        self.generate.assert_called_once_with(7, 2025)
+
+    def test_player_stored_after_the_snapshot_is_generated(self, client):
+        with patch("app.query_player_exists", return_value=True):
+            client.get("/api/calendar/8")
+        self.generate.assert_called_once_with(8, 2025)
+
+    def test_database_errors_do_not_block_generation(self, client):
+        import app as _app
+        with patch("app.query_player_exists", side_effect=RuntimeError("DB down")):
+            client.get("/api/calendar/9")
+        self.generate.assert_called_once_with(9, 2025)
+        assert 9 not in _app._unknown_players
+
+    def test_guard_works_on_a_freshly_imported_app(self):
+        # Load a separate copy of the module so no state set by other tests is visible
+        import importlib.util
+        from dimension_store import DimensionStore
+        import app as _app
+        spec = importlib.util.spec_from_file_location("app_fresh", _app.__file__)
+        fresh = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(fresh)
+        store = DimensionStore((2025, "2025-06-01T05:40:00", None), 2025, {}, {}, {}, [])
+        with patch.object(fresh, "current_dimensions", return_value=store), \
+             patch.object(fresh, "query_player_exists", return_value=False):
+            assert fresh._is_known_player(424242) is False
+            assert 424242 in fresh._unknown_players
+
+    def test_new_sync_version_clears_the_negative_cache(self, client):
+        from dimension_store import DimensionStore
+        with patch("app.query_player_exists", return_value=False) as exists:
+            assert client.get("/api/calendar/11").status_code == 404
+            assert client.get("/api/calendar/11").status_code == 404
+            assert exists.call_count == 1
+            # No SSE client is subscribed: the new version alone forgets the remembered id
+            synced = DimensionStore((2025, "2025-06-01T05:40:00", None), 2025, {}, {}, {}, [])
+            with patch("app.current_dimensions", return_value=synced):
+                exists.return_value = True
+                client.get("/api/calendar/11")
+        assert exists.call_count == 2
+        self.generate.assert_called_once_with(11, 2025)
+
+
+# ===========================================================================
+# Calendar manifest — mock-only
+# ===========================================================================
+
+class TestCalendarManifest:
+
+    def test_published_calendar_served_by_hash(self, client, manifest_dir):
+        from calendar_manifest import publish_calendar
+        entry = publish_calendar(88, b"BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\nEND:VEVENT\r\nEND:VCALENDAR\r\n",
+                                 str(manifest_dir))
+        resp = client.get("/api/calendar/88")
+        assert resp.status_code == 200
+        assert resp.headers["etag"] == f'"{entry["hash"][:32]}"'
+        # The static mount resolves subscriptions through the manifest too
+        resp = client.get("/static/88.ics")
+        assert resp.status_code == 200
+        assert resp.headers["etag"] == f'"{entry["hash"][:32]}"'
+        assert not (manifest_dir / "88.ics").exists()
+
+    def test_revalidation_answered_from_manifest(self, client, manifest_dir):
+        from calendar_manifest import object_path, publish_calendar
+        entry = publish_calendar(88, b"BEGIN:VCALENDAR\r\nEND:VCALENDAR\r\n", str(manifest_dir))
+        os.remove(object_path(str(manifest_dir), entry["hash"]))
+        resp = client.get("/api/calendar/88", headers={"If-None-Match": f'"{entry["hash"][:32]}"'})
+        assert resp.status_code == 304
+
+    def test_republish_bumps_version_and_swaps_file(self, manifest_dir):
+        from calendar_manifest import load_manifest, object_path, publish_calendar
+        first = publish_calendar(88, b"BEGIN:VCALENDAR\r\nEND:VCALENDAR\r\n", str(manifest_dir))
+        second = publish_calendar(88, b"BEGIN:VCALENDAR\r\nVERSION:2.0\r\nEND:VCALENDAR\r\n", str(manifest_dir))
+        manifest = load_manifest(str(manifest_dir))
+        assert manifest["version"] == 2
+        assert manifest["calendars"]["88"]["hash"] == second["hash"] != first["hash"]
+        with open(object_path(str(manifest_dir), second["hash"]), "rb") as f:
+            assert b"VERSION:2.0" in f.read()
+
+    def test_meta_endpoint(self, client, manifest_dir):
+        from calendar_manifest import publish_calendar
+        entry = publish_calendar(88, b"BEGIN:VCALENDAR\r\nEND:VCALENDAR\r\n", str(manifest_dir))
+        resp = client.get("/api/calendar/88/meta")
+        assert resp.status_code == 200
+        assert resp.json()["hash"] == entry["hash"]
+        assert resp.json()["event_count"] == 0
+        assert client.get("/api/calendar/89/meta").status_code == 404
+
+
+# ===========================================================================
+# Hot calendar store — mock-only
+# ===========================================================================
+
+@pytest.fixture()
+def hot_calendar(request):
+    _skip_in_live(request)
+    path = os.path.join("ics_calendars", "77.ics")
+    os.makedirs("ics_calendars", exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"BEGIN:VCALENDAR\r\nX-PUBLISHED-TTL:PT5M\r\n" + b"X" * 2000 + b"\r\nEND:VCALENDAR\r\n")
+    yield path
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class TestHotCalendarStore:
+
+    def test_second_hit_served_from_memory(self, client, hot_calendar):
+        import app as _app
+        first = client.get("/api/calendar/77")
+        second = client.get("/api/calendar/77")
+        third = client.get("/api/calendar/77")
+        assert first.content == second.content == third.content
+        assert _app._hot_calendars.stats()["entries"] == 1
+        assert _app._hot_calendars.stats()["hits"] == 1
+        assert third.headers["cache-control"] == "public, max-age=300"
+        assert first.headers["etag"] == third.headers["etag"]
+
+    def test_etag_revalidation(self, client, hot_calendar):
+        client.get("/api/calendar/77")
+        etag = client.get("/api/calendar/77").headers["etag"]
+        resp = client.get("/api/calendar/77", headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+        assert resp.content == b""
+
+    def test_gzip_variant(self, client, hot_calendar):
+        client.get("/api/calendar/77")
+        resp = client.get("/api/calendar/77", headers={"Accept-Encoding": "gzip"})
+        assert resp.headers["content-encoding"] == "gzip"
+        assert resp.content.startswith(b"BEGIN:VCALENDAR")
+
+    def test_etag_list_and_weak_tags_revalidate(self, client, hot_calendar):
+        client.get("/api/calendar/77")
+        etag = client.get("/api/calendar/77").headers["etag"]
+        for header in (f'"other", {etag}', f"W/{etag}", "*"):
+            assert client.get("/api/calendar/77", headers={"If-None-Match": header}).status_code == 304
+        # A tag that merely contains the ETag is a different tag
+        resp = client.get("/api/calendar/77", headers={"If-None-Match": f'"x{etag[1:-1]}x", {etag[:-1]}-gzip"'})
+        assert resp.status_code == 200
+
+    def test_gzip_refused_with_zero_q(self, client, hot_calendar):
+        client.get("/api/calendar/77")
+        for header in ("gzip;q=0", "br, gzip; q=0.0", "*, gzip;q=0"):
+            resp = client.get("/api/calendar/77", headers={"Accept-Encoding": header})
+            assert "content-encoding" not in resp.headers
+        resp = client.get("/api/calendar/77", headers={"Accept-Encoding": "identity;q=0.5, *;q=0.1"})
+        assert resp.headers["content-encoding"] == "gzip"
+
+    def test_rewritten_file_invalidates_entry(self, client, hot_calendar):
+        client.get("/api/calendar/77")
+        client.get("/api/calendar/77")
+        with open(hot_calendar, "wb") as f:
+            f.write(b"BEGIN:VCALENDAR\r\nVERSION:2.0\r\nEND:VCALENDAR\r\n")
+        st = os.stat(hot_calendar)
+        os.utime(hot_calendar, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        resp = client.get("/api/calendar/77")
+        assert b"VERSION:2.0" in resp.content
+
+    def test_preload_skips_admission(self, client, hot_calendar):
+        import app as _app
+        assert _app._hot_calendars.preload(hot_calendar)
+        hits = _app._hot_calendars.stats()["hits"]
+        client.get("/api/calendar/77")
+        assert _app._hot_calendars.stats()["hits"] == hits + 1
+
+    def test_static_mount_uses_store(self, client, hot_calendar):
+        import app as _app
+        client.get("/static/77.ics")
+        resp = client.get("/static/77.ics")
+        assert resp.status_code == 200
+        assert _app._hot_calendars.stats()["entries"] == 1
+
+
 # ===========================================================================
 # GET /api/info/lastupdated — works in BOTH modes
 # ===========================================================================
@@ -357,6 +684,7 @@ class TestLastUpdatedMock:
 
     def test_cache_expiry(self, request, client):
         _skip_in_live(request)
+        import app as _app
         with patch("app._time") as mock_time, \
              patch("app.query_info_last_updated") as mock_query:
             t0 = 1000000.0
@@ -367,7 +695,11 @@ class TestLastUpdatedMock:
             mock_time.return_value = t0 + 61
             mock_query.return_value = [{"info": "new"}]
             resp = client.get("/api/info/lastupdated")
+            assert resp.json()[0]["info"] == "old"
+            _app._last_updated_cache.wait_idle(timeout=5)
             assert mock_query.call_count == 2
+            mock_time.return_value = t0 + 62
+            resp = client.get("/api/info/lastupdated")
             assert resp.json()[0]["info"] == "new"
 
     def test_none_not_cached(self, request, client):
@@ -385,6 +717,181 @@ class TestLastUpdatedMock:
             assert "timeout" in resp.json()["detail"]
 
 
+# ===========================================================================
+# GET /api/players/{id}/stats — mock mode
+# ===========================================================================
+
+class TestPlayerStatsMock:
+
+    def test_returns_stats_row(self, request, client):
+        _skip_in_live(request)
+        stats = {"player_id": 1, "season": 2025, "matches_played": 2, "wins": 2, "losses": 0,
+                 "frames_won": 10, "frames_lost": 3, "prize_money": 10000.0, "ranking_points": 10000,
+                 "updated_at": "2025-06-01T22:00:00"}
+        with patch("app.query_player_stats", return_value=stats) as mock_query:
+            resp = client.get("/api/players/1/stats?season=2025")
+            assert resp.status_code == 200
+            assert resp.json() == stats
+            mock_query.assert_called_once_with(1, 2025)
+
+    def test_missing_stats_returns_404(self, request, client):
+        _skip_in_live(request)
+        with patch("app.query_player_stats", return_value=None):
+            assert client.get("/api/players/999/stats").status_code == 404
+
+
+# ===========================================================================
+# GET /api/upcoming — mock mode
+# ===========================================================================
+
+class TestUpcomingMock:
+
+    def _entry(self, match_id, position1, position2):
+        side = lambda pid, pos: {"player_id": pid, "lastname": f"P{pid}", "position": pos}
+        return {"match_id": match_id, "player1": side(1, position1), "player2": side(2, position2)}
+
+    def test_ranked_matches_in_window(self, request, client):
+        _skip_in_live(request)
+        import app as _app
+        from upcoming_index import UpcomingIndex
+        soon = datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+        matches = [(soon, self._entry(1, 5, None)), (soon, self._entry(2, None, None))]
+        index = UpcomingIndex(lambda ids: matches, lambda since, limit: [], lambda: 0)
+        with patch.object(_app, "_upcoming", index):
+            data = client.get("/api/upcoming?hours=24").json()
+            assert [m["match_id"] for m in data["matches"]] == [1]
+            data = client.get("/api/upcoming?hours=24&ranked_only=false").json()
+            assert data["count"] == 2
+
+    def test_invalid_hours_returns_400(self, request, client):
+        _skip_in_live(request)
+        assert client.get("/api/upcoming?hours=0").status_code == 400
+
+
+# ===========================================================================
+# Startup warm-up, /healthz and /readyz — mock mode
+# ===========================================================================
+
+class TestReadinessMock:
+
+    @pytest.fixture()
+    def readiness(self, request):
+        _skip_in_live(request)
+        import app as _app
+        state = {"ready": False, "started_at": None, "finished_at": None, "steps": {}}
+        with patch.dict(_app._readiness, state):
+            yield _app._readiness
+
+    def _warm(self, store, **overrides):
+        import app as _app
+        from upcoming_index import UpcomingIndex
+        patches = {
+            "get_current_season": MagicMock(return_value=2025),
+            "current_dimensions": MagicMock(return_value=store),
+            "query_all_ranking_players": MagicMock(return_value=_make_players(3)),
+            "query_info_last_updated": MagicMock(return_value=[]),
+            "_upcoming": UpcomingIndex(lambda ids: [], lambda since, limit: [], lambda: 0),
+        }
+        patches.update(overrides)
+        with patch.multiple(_app, **patches):
+            _app._warm_up()
+
+    def _store(self):
+        from dimension_store import DimensionStore, RankingRecord
+        return DimensionStore(None, 2025, {}, {}, {}, [RankingRecord(1, 900.0, 88), RankingRecord(2, 800.0, 89)])
+
+    def test_healthz_is_always_ok(self, client, readiness):
+        assert client.get("/healthz").json() == {"status": "ok"}
+
+    def test_not_ready_until_warmed(self, client, readiness, manifest_dir):
+        import app as _app
+        from calendar_manifest import publish_calendar
+        publish_calendar(88, b"BEGIN:VCALENDAR\r\nEND:VCALENDAR\r\n", str(manifest_dir))
+        resp = client.get("/readyz")
+        assert resp.status_code == 503
+        assert resp.json()["upstream"]["name"] == "snooker.org"
+
+        self._warm(self._store())
+        resp = client.get("/readyz")
+        assert resp.status_code == 200
+        steps = resp.json()["warm_up"]["steps"]
+        assert all(step["ok"] for step in steps.values())
+        assert steps["season"]["result"] == 2025 and steps["calendars"]["result"] == 1
+        # The top-ranked player's calendar is served from memory on the first request
+        assert _app._players_cache.get((1, 50, None), lambda: None) == _make_players(3)
+        hits = _app._hot_calendars.stats()["hits"]
+        client.get("/api/calendar/88")
+        assert _app._hot_calendars.stats()["hits"] == hits + 1
+
+    def test_failed_steps_do_not_block_readiness(self, client, readiness, manifest_dir):
+        self._warm(None, query_all_ranking_players=MagicMock(side_effect=RuntimeError("DB down")))
+        resp = client.get("/readyz")
+        assert resp.status_code == 200
+        steps = resp.json()["warm_up"]["steps"]
+        assert steps["players"] == {"ok": False, "seconds": steps["players"]["seconds"], "error": "DB down"}
+        assert not steps["dimensions"]["ok"]
+
+
+# ===========================================================================
+# GET /api/changes — mock mode
+# ===========================================================================
+
+class TestMatchChangesMock:
+
+    def test_returns_changes_and_cursor(self, request, client):
+        _skip_in_live(request)
+        changes = [
+            {"id": 7, "match_id": 1, "event_id": 100, "kind": "result", "player_ids": [10, 20],
+             "old_value": "3-2", "new_value": "6-2 winner 10", "detected_at": "2025-06-01T22:00:00"},
+        ]
+        with patch("app.query_match_changes", return_value=changes) as mock_query:
+            resp = client.get("/api/changes?since=6&limit=10")
+            assert resp.status_code == 200
+            assert resp.json() == {"changes": changes, "next_since": 7}
+            mock_query.assert_called_once_with(since=6, limit=10)
+
+    def test_no_new_changes_keeps_cursor(self, request, client):
+        _skip_in_live(request)
+        with patch("app.query_match_changes", return_value=[]):
+            assert client.get("/api/changes?since=42").json() == {"changes": [], "next_since": 42}
+
+    def test_invalid_limit_returns_400(self, request, client):
+        _skip_in_live(request)
+        assert client.get("/api/changes?limit=0").status_code == 400
+
+
+# ===========================================================================
+# GET /api/updates — mock mode
+# ===========================================================================
+
+class TestUpdatesMock:
+
+    def test_streams_event_stream(self, request, client):
+        _skip_in_live(request)
+        import app as _app
+
+        async def finite_stream(last_event_id=None):
+            yield "retry: 5000\n\n"
+            yield f"id: 5\nevent: calendars\ndata: {{\"last\": {json.dumps(last_event_id)}}}\n\n"
+
+        with patch.object(_app._updates, "stream", side_effect=finite_stream):
+            resp = client.get("/api/updates", headers={"Last-Event-ID": "4"})
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("text/event-stream")
+        assert resp.headers["cache-control"] == "no-cache"
+        assert 'data: {"last": 4}' in resp.text
+
+    def test_ranking_update_drops_cached_players(self, request, client):
+        _skip_in_live(request)
+        with patch("app.query_all_ranking_players") as mock_query:
+            mock_query.return_value = _make_players(1)
+            client.get("/api/players")
+            import app as _app
+            _app._on_data_update("rankings", {"lastupdated": "2025-06-01T05:40:00"})
+            client.get("/api/players")
+            assert mock_query.call_count == 2
+
+
 # ===========================================================================
 # CORS — works in BOTH modes
 # ===========================================================================
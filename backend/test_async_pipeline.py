@@ -0,0 +1,274 @@
+"""
+Unit tests for the asyncio sync and generation pipeline (async_pipeline.py)
+
+snooker.org is replaced by a fake client and the checkpoint tables live in a
+throwaway SQLite database, so no MySQL or network access is needed:
+    cd backend && python -m pytest test_async_pipeline.py -v
+"""
+import asyncio
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+import sqlalchemy as sqla
+from sqlalchemy.orm import sessionmaker
+
+import async_pipeline
+import batch_ics_generator as big
+import player_matches_to_ics
+import query_data
+from dimension_store import EventRecord, PlayerRecord, RankingRecord, RoundRecord
+from upstream import CircuitOpenError, snooker_breaker
+
+
+def _match(match_id, p1, p2, event_id=100, round_no=7, scheduled="2099-06-01T13:00:00Z"):
+    return SimpleNamespace(
+        ID=match_id, EventID=event_id, Round=round_no, Number=match_id, Player1ID=p1, Player2ID=p2,
+        Score1=0, Score2=0, WinnerID=0, Status=0, Unfinished=False, Estimated=False,
+        DetailsUrl="", Note="", ExtendedNote="", Walkover1=False, Walkover2=False, LiveUrl="",
+        TableNo=0, ScheduledDate=scheduled, StartDate="", EndDate="",
+    )
+
+
+class TestAsyncRateLimiter:
+
+    def test_request_starts_are_spaced(self):
+        limiter = async_pipeline.AsyncRateLimiter(interval=0.05, max_concurrency=10)
+        starts = []
+
+        async def request():
+            async with limiter:
+                starts.append(time.monotonic())
+
+        async def main():
+            await asyncio.gather(*(request() for _ in range(4)))
+
+        asyncio.run(main())
+        gaps = [b - a for a, b in zip(starts, starts[1:])]
+        assert len(starts) == 4
+        assert all(gap >= 0.04 for gap in gaps)
+
+    def test_in_flight_requests_are_capped(self):
+        limiter = async_pipeline.AsyncRateLimiter(interval=0, max_concurrency=2)
+        in_flight = peak = 0
+
+        async def request():
+            nonlocal in_flight, peak
+            async with limiter:
+                in_flight += 1
+                peak = max(peak, in_flight)
+                await asyncio.sleep(0.02)
+                in_flight -= 1
+
+        async def main():
+            await asyncio.gather(*(request() for _ in range(6)))
+
+        asyncio.run(main())
+        assert peak == 2
+
+    def test_slot_released_on_error(self):
+        limiter = async_pipeline.AsyncRateLimiter(interval=0, max_concurrency=1)
+
+        async def main():
+            with pytest.raises(RuntimeError):
+                async with limiter:
+                    raise RuntimeError("request failed")
+            async with limiter:
+                return True
+
+        assert asyncio.run(asyncio.wait_for(main(), 1))
+
+
+class TestCallApi:
+
+    def test_calls_run_in_worker_threads_with_one_client_each(self, monkeypatch):
+        created = []
+
+        def create_client():
+            client = SimpleNamespace(player=lambda pid: (pid, threading.current_thread().name))
+            created.append(client)
+            return client
+
+        monkeypatch.setattr(async_pipeline, "create_snooker_client", create_client)
+        monkeypatch.setattr(async_pipeline, "_thread_clients", threading.local())
+        limiter = async_pipeline.AsyncRateLimiter(interval=0, max_concurrency=2)
+
+        async def main():
+            return await asyncio.gather(*(async_pipeline.call_api(limiter, 'player', pid) for pid in range(5)))
+
+        results = asyncio.run(main())
+        assert [pid for pid, _ in results] == list(range(5))
+        assert threading.current_thread().name not in {name for _, name in results}
+        # One client per worker thread, not one per call
+        assert 1 <= len(created) <= len({name for _, name in results})
+
+
+class TestPersistStage:
+
+    def test_items_written_in_batches(self):
+        batches = []
+
+        async def main():
+            queue = asyncio.Queue()
+            for item in range(5):
+                queue.put_nowait(item)
+            queue.put_nowait(None)
+            return await async_pipeline._persist_stage(queue, lambda batch: batches.append(list(batch)), batch_size=2)
+
+        assert asyncio.run(main()) == 5
+        assert batches == [[0, 1], [2, 3], [4]]
+
+    def test_failed_batch_is_dropped_and_the_stage_goes_on(self):
+        def persist(batch):
+            if 0 in batch:
+                raise RuntimeError("database unavailable")
+
+        async def main():
+            queue = asyncio.Queue()
+            for item in range(4):
+                queue.put_nowait(item)
+            queue.put_nowait(None)
+            return await async_pipeline._persist_stage(queue, persist, batch_size=2)
+
+        assert asyncio.run(main()) == 2
+
+    def test_failing_producer_does_not_stop_the_others(self):
+        persisted = []
+
+        def producer(item):
+            async def produce(queue):
+                if item == 2:
+                    raise RuntimeError("fetch failed")
+                await queue.put(item)
+            return produce
+
+        stored = asyncio.run(async_pipeline._run_pipeline([producer(i) for i in range(4)], persisted.extend))
+        assert stored == 3
+        assert sorted(persisted) == [0, 1, 3]
+
+
+@pytest.fixture()
+def lookups_db(monkeypatch):
+    """The query_data lookups answered from fixed records; calls are counted."""
+    calls = []
+    players = {
+        1: PlayerRecord(None, "Ronnie", "O'Sullivan", False, "England", None, 41),
+        2: PlayerRecord(None, "Ding", "Junhui", True, "China", None, 15),
+    }
+    rankings = {1: RankingRecord(1, 1000.0, 1)}
+
+    def lookup(name, table):
+        def query(*key, session=None):
+            calls.append(name)
+            return table.get(key if len(key) > 1 else key[0])
+        return query
+
+    monkeypatch.setattr(player_matches_to_ics, "query_player_info", lookup("player", players))
+    monkeypatch.setattr(player_matches_to_ics, "query_player_ranking", lookup("ranking", rankings))
+    monkeypatch.setattr(player_matches_to_ics, "query_event_info", lookup("event", {
+        100: EventRecord("UK Championship", None, None, 2025, None, "York Barbican", "York", "England",
+                         None, None, None, None, None, None)}))
+    monkeypatch.setattr(player_matches_to_ics, "query_round_info", lookup("round", {
+        (100, 7): RoundRecord("Final", 19, None, None, None, None, None, None, None, None)}))
+    monkeypatch.setattr(player_matches_to_ics, "note_missing_player", lambda pid: calls.append(("noted", pid)))
+    return calls
+
+
+class TestPrefetchedRender:
+
+    def test_render_uses_only_the_prefetched_lookups(self, lookups_db, monkeypatch):
+        matches = [_match(1, 1, 2), _match(2, 1, 77)]
+        lookups = player_matches_to_ics.prefetch_calendar_lookups(1, matches)
+        assert ("noted", 77) in lookups_db
+        # Sent to a render worker process, so it must survive pickling
+        lookups = pickle.loads(pickle.dumps(lookups))
+
+        def no_io(*args, **kwargs):
+            raise AssertionError("render step did I/O")
+
+        for name in ("query_player_info", "query_player_ranking", "query_event_info", "query_round_info",
+                     "note_missing_player", "lookup_session"):
+            monkeypatch.setattr(player_matches_to_ics, name, no_io)
+        ics, schedule = player_matches_to_ics.render_player_calendar(1, 2025, matches, lookups)
+        text = ics.decode()
+        assert text.count("BEGIN:VEVENT") == 2
+        assert "O'Sullivan vs Junhui" in text.replace("\r\n ", "")
+        assert "Player 77" in text
+        assert "World Ranking: 1" in text.replace("\r\n ", "")
+
+    def test_prefetch_looks_each_key_up_once(self, lookups_db):
+        player_matches_to_ics.prefetch_calendar_lookups(1, [_match(1, 1, 2), _match(2, 2, 1)])
+        assert lookups_db.count("event") == 1 and lookups_db.count("round") == 1
+        assert lookups_db.count("player") == 2
+
+
+@pytest.fixture()
+def pipeline(tmp_path, monkeypatch, lookups_db):
+    """async_generate_all_players_calendars against SQLite, a fake client and a thread render pool."""
+    engine = sqla.create_engine(f"sqlite:///{tmp_path / 'runs.db'}")
+    big.Base.metadata.create_all(engine)
+    monkeypatch.setattr(big, "engine", engine)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(big, "query_all_ranking_players", lambda: [
+        {'player_id': 1, 'firstname': 'Ronnie', 'lastname': "O'Sullivan"},
+        {'player_id': 2, 'firstname': 'Ding', 'lastname': 'Junhui', 'surname_first': True},
+    ])
+    monkeypatch.setattr(query_data, "preload_lookup_caches", lambda season: None)
+    monkeypatch.setattr(async_pipeline, "ProcessPoolExecutor",
+                        lambda max_workers, initializer=None: ThreadPoolExecutor(max_workers))
+    fetched = []
+
+    async def fake_call_api(limiter, method, *args):
+        fetched.append((method, args))
+        return [_match(10 + args[0], args[0], 3 - args[0])]
+
+    monkeypatch.setattr(async_pipeline, "call_api", fake_call_api)
+    snooker_breaker.reset()
+    yield SimpleNamespace(engine=engine, fetched=fetched)
+    snooker_breaker.reset()
+
+
+class TestGenerateCalendars:
+
+    def test_calendars_published_and_run_closed(self, pipeline):
+        limiter = async_pipeline.AsyncRateLimiter(0, 2)
+        unfinished = asyncio.run(async_pipeline.async_generate_all_players_calendars(2025, limiter=limiter))
+        assert unfinished == set()
+        assert sorted(args for _, args in pipeline.fetched) == [(1, 2025), (2, 2025)]
+        session = sessionmaker(bind=pipeline.engine)()
+        try:
+            assert {row.playerid for row in session.query(big.IcsSchedule)} == {1, 2}
+            assert [run.status for run in session.query(big.IcsBatchRun)] == [big.RUN_COMPLETED]
+        finally:
+            session.close()
+        from calendar_manifest import load_manifest
+        assert set(load_manifest("ics_calendars")["calendars"]) == {"1", "2"}
+
+    def test_open_breaker_leaves_players_unfinished(self, pipeline, monkeypatch):
+        async def broken(limiter, method, *args):
+            raise CircuitOpenError("snooker.org circuit is open")
+
+        monkeypatch.setattr(async_pipeline, "call_api", broken)
+        unfinished = asyncio.run(async_pipeline.async_generate_all_players_calendars(
+            2025, limiter=async_pipeline.AsyncRateLimiter(0, 2)))
+        assert unfinished == {1, 2}
+
+    def test_nameless_player_does_not_keep_the_run_open(self, pipeline, monkeypatch):
+        monkeypatch.setattr(big, "query_all_ranking_players", lambda: [
+            {'player_id': 1, 'firstname': 'Ronnie', 'lastname': "O'Sullivan"},
+            {'player_id': 2},
+        ])
+        unfinished = asyncio.run(async_pipeline.async_generate_all_players_calendars(
+            2025, limiter=async_pipeline.AsyncRateLimiter(0, 2)))
+        assert unfinished == set()
+        assert [args for _, args in pipeline.fetched] == [(1, 2025)]
+        session = sessionmaker(bind=pipeline.engine)()
+        try:
+            assert [run.status for run in session.query(big.IcsBatchRun)] == [big.RUN_COMPLETED]
+            skipped = session.query(big.IcsBatchRunPlayer).filter_by(playerid=2).one()
+            assert (skipped.status, skipped.error) == (big.PLAYER_DONE, "missing name info")
+        finally:
+            session.close()
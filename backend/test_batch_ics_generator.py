@@ -0,0 +1,247 @@
+"""
+Unit tests for the checkpointed batch generator (batch_ics_generator.py)
+
+Runs against a throwaway SQLite database; calendar rendering is faked, so no
+MySQL or snooker.org access is needed:
+    cd backend && python -m pytest test_batch_ics_generator.py -v
+"""
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+
+import pytest
+import sqlalchemy as sqla
+from sqlalchemy.orm import sessionmaker
+
+import batch_ics_generator as big
+from upstream import CircuitOpenError, snooker_breaker
+
+T0 = datetime(2025, 6, 1, 12, 0, 0)
+
+
+@pytest.fixture()
+def engine(tmp_path, monkeypatch):
+    engine = sqla.create_engine(f"sqlite:///{tmp_path / 'runs.db'}")
+    big.Base.metadata.create_all(engine)
+    monkeypatch.setattr(big, "engine", engine)
+    snooker_breaker.reset()
+    yield engine
+    snooker_breaker.reset()
+
+
+def _runs(engine):
+    session = sessionmaker(bind=engine)()
+    try:
+        return {run.run_id: run.status for run in session.query(big.IcsBatchRun)}
+    finally:
+        session.close()
+
+
+def _finish(run_id, player_id, now):
+    assert big.claim_run_player(run_id, player_id, now - timedelta(minutes=10), now=now)
+    big.finish_run_player(run_id, player_id, big.PLAYER_DONE, now=now)
+
+
+class TestRunCheckpoint:
+
+    def test_resume_appends_new_players(self, engine):
+        run_id, resumed = big.start_or_resume_run(2025, [1, 2], now=T0)
+        assert not resumed
+        _finish(run_id, 1, T0)
+        again, resumed = big.start_or_resume_run(2025, [1, 3], now=T0 + timedelta(hours=1))
+        assert (again, resumed) == (run_id, True)
+        assert big.unfinished_run_players(run_id) == [2, 3]
+
+    def test_resume_does_not_keep_a_run_alive(self, engine):
+        run_id, _ = big.start_or_resume_run(2025, [1, 2], now=T0)
+        _finish(run_id, 1, T0)
+        for hours in (3, 6):
+            assert big.start_or_resume_run(2025, [1], now=T0 + timedelta(hours=hours)) == (run_id, True)
+        # No player finished since T0: the run is abandoned, not resumed forever
+        new_run, resumed = big.start_or_resume_run(2025, [1], now=T0 + timedelta(hours=9))
+        assert new_run != run_id and not resumed
+        assert _runs(engine)[run_id] == big.RUN_ABANDONED
+        assert big.claim_run_player(new_run, 1, T0, now=T0 + timedelta(hours=9))
+
+    def test_finishing_a_player_is_progress(self, engine):
+        run_id, _ = big.start_or_resume_run(2025, [1, 2, 3], now=T0)
+        _finish(run_id, 1, T0 + timedelta(hours=5))
+        assert big.start_or_resume_run(2025, [], now=T0 + timedelta(hours=10)) == (run_id, True)
+
+    def test_claim_skips_done_and_live_players(self, engine):
+        run_id, _ = big.start_or_resume_run(2025, [1, 2], now=T0)
+        _finish(run_id, 1, T0)
+        assert not big.claim_run_player(run_id, 1, T0, now=T0)
+        assert big.claim_run_player(run_id, 2, T0 - timedelta(minutes=10), now=T0)
+        assert not big.claim_run_player(run_id, 2, T0 - timedelta(minutes=10), now=T0)
+        # A worker that has held the player since before stale_before crashed
+        assert big.claim_run_player(run_id, 2, T0 + timedelta(minutes=1), now=T0 + timedelta(minutes=20))
+
+    def test_run_closes_when_nothing_is_left(self, engine):
+        run_id, _ = big.start_or_resume_run(2025, [1], now=T0)
+        assert not big.close_run_if_finished(run_id)
+        _finish(run_id, 1, T0)
+        assert big.close_run_if_finished(run_id)
+        assert _runs(engine)[run_id] == big.RUN_COMPLETED
+
+
+class TestIcsSchedule:
+
+    def test_schedule_is_stored_as_naive_utc(self, engine):
+        from datetime import timezone
+        tz = timezone(timedelta(hours=2))
+        schedule = {'next_match': datetime(2025, 6, 2, 14, 0, tzinfo=tz), 'last_match': None, 'live': True}
+        big.update_ics_schedule(7, schedule, T0)
+        big.update_ics_schedule(7, {**schedule, 'live': False}, T0 + timedelta(hours=1))
+        record = big.query_ics_schedules()[7]
+        assert record.next_match == datetime(2025, 6, 2, 12, 0)
+        assert record.last_match is None and record.live is False
+        assert record.checked_at == T0 + timedelta(hours=1)
+
+    def test_expired_schedules_read_as_never_checked(self, engine):
+        schedule = {'next_match': None, 'last_match': None, 'live': False}
+        for player_id in (1, 2):
+            big.update_ics_schedule(player_id, schedule, T0)
+        assert big.expire_ics_schedules([2, 3]) == 1
+        schedules = big.query_ics_schedules()
+        assert schedules[1].checked_at == T0 and schedules[2].checked_at is None
+
+
+class FakePool:
+    """Synchronous stand-in for multiprocessing.Pool(1, initializer=...)."""
+
+    def __init__(self, processes, initializer=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def apply_async(self, func, args):
+        result = func(*args)
+        return type("Result", (), {"get": lambda self, timeout=None: result})()
+
+
+class TestGenerateAndStore:
+
+    @pytest.fixture()
+    def render(self, engine, monkeypatch):
+        rendered = {}
+        monkeypatch.setattr(big.multiprocessing, "Pool", FakePool)
+        monkeypatch.setattr(big, "generate_player_calendar_with_timeout",
+                            lambda player_id, year, timeout: rendered[player_id])
+        return rendered
+
+    def test_player_without_matches_is_still_checked(self, render, tmp_path):
+        render[1] = (None, {'next_match': None, 'last_match': None, 'live': False})
+        assert big.generate_and_store_calendar(1, "Ann One", 2025, str(tmp_path)) is False
+        # The checked_at stamp keeps the player off the due list until their tier interval passes
+        assert big.query_ics_schedules()[1].checked_at is not None
+
+    def test_calendar_is_published_with_its_schedule(self, render, tmp_path, monkeypatch):
+        published = []
+        monkeypatch.setattr(big, "publish_calendar", lambda player_id, content, output_dir: published.append(
+            player_id) or {'event_count': 1, 'hash': 'a' * 64})
+        render[2] = (b"BEGIN:VCALENDAR", {'next_match': None, 'last_match': None, 'live': True})
+        assert big.generate_and_store_calendar(2, "Bob Two", 2025, str(tmp_path)) is True
+        assert published == [2]
+        assert big.query_ics_schedules()[2].live is True
+
+
+RANKED = [
+    {'player_id': 1, 'firstname': 'Ann', 'lastname': 'One'},
+    {'player_id': 2, 'firstname': 'Bob', 'lastname': 'Two'},
+    {'player_id': 3, 'firstname': 'Cid', 'lastname': 'Three'},
+]
+
+
+@pytest.fixture()
+def generator(engine, monkeypatch, tmp_path):
+    """generate_all_players_calendars with rendering replaced by a recorder."""
+    monkeypatch.chdir(tmp_path)
+    ranked = list(RANKED)
+    generated = []
+    failing = {}
+
+    def fake_generate(player_id, player_name, year, output_dir, timeout, publisher=None):
+        if player_id in failing:
+            raise failing[player_id]
+        generated.append(player_id)
+        publisher.add(player_id, big.store_calendar(f"BEGIN:VCALENDAR\r\nX-ID:{player_id}\r\n".encode(), output_dir))
+        return True
+
+    monkeypatch.setattr(big, "query_all_ranking_players", lambda: ranked)
+    monkeypatch.setattr(big, "lookup_snapshot", lambda year: nullcontext())
+    monkeypatch.setattr(big, "generate_and_store_calendar", fake_generate)
+    monkeypatch.setattr(big.time, "sleep", lambda seconds: None)
+    return ranked, generated, failing
+
+
+class TestGenerateAll:
+
+    def test_completed_run_is_not_resumed(self, generator, engine):
+        ranked, generated, failing = generator
+        assert big.generate_all_players_calendars(2025, [1, 2]) == set()
+        assert big.generate_all_players_calendars(2025, [1]) == set()
+        assert generated == [1, 2, 1]
+        assert set(_runs(engine).values()) == {big.RUN_COMPLETED}
+
+    def test_run_publishes_the_manifest_once(self, generator, engine):
+        from calendar_manifest import load_manifest
+        assert big.generate_all_players_calendars(2025, [1, 2, 3]) == set()
+        manifest = load_manifest("ics_calendars")
+        assert manifest["version"] == 1
+        assert set(manifest["calendars"]) == {"1", "2", "3"}
+
+    def test_players_are_done_only_once_published(self, generator, engine, monkeypatch):
+        def publish_fails(output_dir, updates, keep_newer=False):
+            raise OSError("disk full")
+
+        monkeypatch.setattr("calendar_manifest.publish_entries", publish_fails)
+        with pytest.raises(OSError):
+            big.generate_all_players_calendars(2025, [1, 2])
+        (run_id, status), = _runs(engine).items()
+        assert status == big.RUN_RUNNING
+        assert big.unfinished_run_players(run_id) == [1, 2]
+
+    def test_breaker_abort_leaves_the_rest_for_the_resume(self, generator, engine):
+        ranked, generated, failing = generator
+        failing[2] = CircuitOpenError("snooker.org circuit is open")
+        assert big.generate_all_players_calendars(2025, [1, 2, 3]) == {2, 3}
+        assert generated == [1]
+        (run_id, status), = _runs(engine).items()
+        assert status == big.RUN_RUNNING
+
+        # The next tick only asks for player 3, yet the leftover player 2 is processed and the run closes
+        del failing[2]
+        assert big.generate_all_players_calendars(2025, [3]) == set()
+        assert generated == [1, 2, 3]
+        assert _runs(engine) == {run_id: big.RUN_COMPLETED}
+
+    def test_redo_regenerates_players_done_in_a_resumed_run(self, generator, engine):
+        ranked, generated, failing = generator
+        failing[2] = CircuitOpenError("snooker.org circuit is open")
+        big.generate_all_players_calendars(2025, [1, 2], run_kind='live')
+        del failing[2]
+        # Player 1 has new match changes, so the resumed run must not skip it
+        assert big.generate_all_players_calendars(2025, [1], run_kind='live', redo=[1]) == set()
+        assert generated == [1, 1, 2]
+
+    def test_failed_players_are_reported(self, generator, engine):
+        ranked, generated, failing = generator
+        failing[1] = RuntimeError("render failed")
+        assert big.generate_all_players_calendars(2025, [1, 2]) == {1}
+        assert generated == [2]
+        # Failed players do not keep the run open
+        assert set(_runs(engine).values()) == {big.RUN_COMPLETED}
+
+    def test_leftover_no_longer_ranked_is_closed(self, generator, engine):
+        ranked, generated, failing = generator
+        failing[1] = CircuitOpenError("snooker.org circuit is open")
+        big.generate_all_players_calendars(2025, [1, 2])
+        ranked.pop(0)
+        del failing[1]
+        assert big.generate_all_players_calendars(2025, []) == set()
+        assert generated == [2]
+        assert set(_runs(engine).values()) == {big.RUN_COMPLETED}
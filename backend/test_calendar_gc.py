@@ -0,0 +1,186 @@
+"""
+Unit tests for ics_calendars/ garbage collection (calendar_gc.py)
+
+Runs against a temporary directory; no MySQL or snooker.org access needed:
+    cd backend && python -m pytest test_calendar_gc.py -v
+"""
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from calendar_gc import reconcile_calendars
+from calendar_manifest import AccessLog, ManifestBatch, load_manifest, object_path, publish_calendar, store_calendar
+
+
+NOW = datetime(2025, 6, 1, 12, 0, 0)
+OLD = NOW - timedelta(days=90)
+
+
+def _age(path, seconds):
+    t = time.time() - seconds
+    os.utime(path, (t, t))
+
+
+@pytest.fixture()
+def out(tmp_path):
+    return str(tmp_path)
+
+
+class TestRetention:
+
+    def test_ranked_players_are_kept(self, out):
+        publish_calendar(1, b"BEGIN:VCALENDAR\r\nEND:VCALENDAR\r\n", out, generated_at=OLD)
+        report = reconcile_calendars([1], out, now=NOW)
+        assert report["kept_players"] == 1 and report["pruned_players"] == 0
+        assert "1" in load_manifest(out)["calendars"]
+
+    def test_unranked_idle_calendar_is_pruned(self, out):
+        entry = publish_calendar(2, b"BEGIN:VCALENDAR\r\nX-ID:2\r\nEND:VCALENDAR\r\n", out, generated_at=OLD)
+        _age(object_path(out, entry["hash"]), 7200)
+        report = reconcile_calendars([1], out, now=NOW)
+        assert report["pruned_players"] == 1
+        assert report["removed_objects"] == 1
+        assert report["reclaimed_bytes"] == entry["size"]
+        assert "2" not in load_manifest(out)["calendars"]
+        assert not os.path.exists(object_path(out, entry["hash"]))
+
+    def test_recent_request_keeps_unranked_calendar(self, out):
+        publish_calendar(3, b"BEGIN:VCALENDAR\r\nEND:VCALENDAR\r\n", out, generated_at=OLD)
+        log = AccessLog(out, flush_interval=0)
+        log.record(3, today=(NOW - timedelta(days=2)).date())
+        report = reconcile_calendars([], out, now=NOW)
+        assert report["pruned_players"] == 0
+
+    def test_dry_run_removes_nothing(self, out):
+        entry = publish_calendar(2, b"BEGIN:VCALENDAR\r\nEND:VCALENDAR\r\n", out, generated_at=OLD)
+        _age(object_path(out, entry["hash"]), 7200)
+        report = reconcile_calendars([], out, now=NOW, dry_run=True)
+        assert report["pruned_players"] == 1 and report["removed_objects"] == 1
+        assert "2" in load_manifest(out)["calendars"]
+        assert os.path.exists(object_path(out, entry["hash"]))
+
+
+class TestSweep:
+
+    def test_fresh_unreferenced_object_survives_grace_period(self, out):
+        first = publish_calendar(1, b"BEGIN:VCALENDAR\r\nX:1\r\nEND:VCALENDAR\r\n", out)
+        publish_calendar(1, b"BEGIN:VCALENDAR\r\nX:2\r\nEND:VCALENDAR\r\n", out)
+        assert reconcile_calendars([1], out)["removed_objects"] == 0
+        _age(object_path(out, first["hash"]), 7200)
+        assert reconcile_calendars([1], out)["removed_objects"] == 1
+
+    def test_superseded_legacy_file_is_removed(self, out):
+        with open(os.path.join(out, "1.ics"), "wb") as f:
+            f.write(b"BEGIN:VCALENDAR\r\nEND:VCALENDAR\r\n")
+        publish_calendar(1, b"BEGIN:VCALENDAR\r\nX:1\r\nEND:VCALENDAR\r\n", out)
+        report = reconcile_calendars([1], out)
+        assert report["removed_legacy"] == 1
+        assert not os.path.exists(os.path.join(out, "1.ics"))
+
+    def test_old_unranked_legacy_file_is_removed(self, out):
+        path = os.path.join(out, "5.ics")
+        with open(path, "wb") as f:
+            f.write(b"BEGIN:VCALENDAR\r\nEND:VCALENDAR\r\n")
+        assert reconcile_calendars([], out)["removed_legacy"] == 0
+        _age(path, 90 * 86400)
+        assert reconcile_calendars([], out)["removed_legacy"] == 1
+
+    def test_publish_survives_shard_removed_mid_store(self, out, monkeypatch):
+        content = b"BEGIN:VCALENDAR\r\nX:3\r\nEND:VCALENDAR\r\n"
+        replace = os.replace
+        removed = []
+
+        def gc_between_makedirs_and_replace(src, dst):
+            # The collector empties and removes the shard right after the writer created it
+            if dst.endswith(".ics") and not removed:
+                removed.append(dst)
+                os.rmdir(os.path.dirname(dst))
+            return replace(src, dst)
+
+        monkeypatch.setattr(os, "replace", gc_between_makedirs_and_replace)
+        entry = publish_calendar(1, content, out)
+        assert removed == [object_path(out, entry["hash"])]
+        with open(object_path(out, entry["hash"]), "rb") as f:
+            assert f.read() == content
+
+
+    def test_reuse_during_the_sweep_does_not_publish_a_deleted_object(self, out, monkeypatch):
+        import threading
+        import calendar_gc
+        old = b"BEGIN:VCALENDAR\r\nX:old\r\nEND:VCALENDAR\r\n"
+        first = publish_calendar(1, old, out)
+        publish_calendar(1, b"BEGIN:VCALENDAR\r\nX:new\r\nEND:VCALENDAR\r\n", out)
+        _age(object_path(out, first["hash"]), 7200)
+        remove = calendar_gc._remove
+        writers = []
+
+        def republish_while_sweeping(path, dry_run):
+            # A writer republishes the old content after the sweep checked the object's mtime
+            writer = threading.Thread(target=publish_calendar, args=(2, old, out))
+            writer.start()
+            writers.append(writer)
+            time.sleep(0.1)
+            return remove(path, dry_run)
+
+        monkeypatch.setattr(calendar_gc, "_remove", republish_while_sweeping)
+        reconcile_calendars([1, 2], out)
+        for writer in writers:
+            writer.join(5)
+        assert load_manifest(out)["calendars"]["2"]["hash"] == first["hash"]
+        assert os.path.exists(object_path(out, first["hash"]))
+
+
+def test_access_log_merges_days(out):
+    log = AccessLog(out, flush_interval=3600)
+    log.record(7, today=datetime(2025, 6, 1).date())
+    log.record(8, today=datetime(2025, 6, 2).date())
+    log.flush()
+    with open(os.path.join(out, "access.json")) as f:
+        assert json.load(f) == {"7": "2025-06-01", "8": "2025-06-02"}
+
+
+def test_access_log_flushes_without_further_requests(out):
+    log = AccessLog(out, flush_interval=0.05)
+    log.start()
+    try:
+        log.record(7, today=datetime(2025, 6, 1).date())
+        deadline = time.monotonic() + 2
+        while not os.path.exists(os.path.join(out, "access.json")) and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        log.stop()
+    with open(os.path.join(out, "access.json")) as f:
+        assert json.load(f) == {"7": "2025-06-01"}
+
+
+def test_access_log_stop_writes_the_buffer(out):
+    log = AccessLog(out, flush_interval=3600)
+    log.start()
+    log.record(9, today=datetime(2025, 6, 3).date())
+    assert not os.path.exists(os.path.join(out, "access.json"))
+    log.stop()
+    with open(os.path.join(out, "access.json")) as f:
+        assert json.load(f) == {"9": "2025-06-03"}
+
+
+def test_manifest_batch_publishes_one_version_per_batch(out):
+    published = []
+    with ManifestBatch(out, max_entries=2, on_publish=published.append) as batch:
+        for player_id in (1, 2, 3):
+            batch.add(player_id, store_calendar(f"BEGIN:VCALENDAR\r\nX-ID:{player_id}\r\n".encode(), out))
+        assert load_manifest(out)["version"] == 1
+    manifest = load_manifest(out)
+    assert manifest["version"] == 2
+    assert set(manifest["calendars"]) == {"1", "2", "3"}
+    assert published == [[1, 2], [3]]
+
+
+def test_manifest_batch_keeps_a_calendar_generated_later(out):
+    with ManifestBatch(out) as batch:
+        batch.add(1, store_calendar(b"BEGIN:VCALENDAR\r\nX-OLD\r\n", out, generated_at=OLD))
+        # Another writer publishes a newer calendar while this batch is still waiting
+        newer = publish_calendar(1, b"BEGIN:VCALENDAR\r\nX-NEW\r\n", out, generated_at=NOW)
+    assert load_manifest(out)["calendars"]["1"]["hash"] == newer["hash"]
@@ -0,0 +1,52 @@
+"""
+Unit tests for the in-memory dimension store (dimension_store.py)
+
+    cd backend && python -m pytest test_dimension_store.py -v
+"""
+import pickle
+
+import pytest
+
+from dimension_store import DimensionStore, PlayerRecord, RankingRecord, RoundRecord
+
+
+def _player(lastname="Junhui"):
+    return PlayerRecord(1, "Ding", lastname, True, "China", "1987-04-01", 14)
+
+
+class TestRecord:
+
+    def test_reads_like_the_lookup_dicts(self):
+        player = _player()
+        assert player["lastname"] == "Junhui"
+        assert player.get("surname_first") is True
+        assert player.get("missing", "default") == "default"
+        assert dict(player) == {
+            "type": 1, "firstname": "Ding", "lastname": "Junhui", "surname_first": True,
+            "nationality": "China", "born": "1987-04-01", "num_ranking_titles": 14,
+        }
+        with pytest.raises(KeyError):
+            player["first_name"]
+
+    def test_compact_and_read_only(self):
+        player = _player()
+        assert not hasattr(player, "__dict__")
+        with pytest.raises(AttributeError):
+            player.lastname = "Other"
+
+    def test_pickles_for_worker_processes(self):
+        assert pickle.loads(pickle.dumps(_player())) == _player()
+
+
+def test_store_lookups():
+    final = RoundRecord("Final", 10, 1, None, None, None, None, None, None, None)
+    store = DimensionStore(
+        version=(2025, None, None), season=2025,
+        players={1: _player()}, events={}, rounds={10: {7: final}},
+        ranked=[RankingRecord(3, 500.0, 1), RankingRecord(9, 100.0, 1)],
+    )
+    assert store.player(1)["firstname"] == "Ding"
+    assert store.round(10, 7) is final
+    assert store.round(10, 8) is None and store.round(11, 7) is None
+    # The best position is kept when a player is listed twice
+    assert store.ranking(1)["position"] == 3
@@ -0,0 +1,152 @@
+"""
+Unit tests for the calendar generation work queue (ics_work_queue.py)
+
+Runs against a throwaway SQLite database; no MySQL or snooker.org access needed:
+    cd backend && python -m pytest test_ics_work_queue.py -v
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from ics_work_queue import (
+    WorkQueue, create_queue_engine, run_worker,
+    STATUS_DONE, STATUS_FAILED, STATUS_LEASED, STATUS_PENDING,
+)
+
+
+@pytest.fixture()
+def queue(tmp_path):
+    q = WorkQueue(create_queue_engine(f"sqlite:///{tmp_path / 'queue.db'}"), lease_seconds=60, max_attempts=2)
+    q.init_db()
+    return q
+
+
+T0 = datetime(2025, 6, 1, 12, 0, 0)
+
+
+class TestClaim:
+
+    def test_workers_claim_disjoint_batches(self, queue):
+        queue.enqueue([1, 2, 3, 4, 5], now=T0)
+        a = queue.claim("a", 2, now=T0)
+        b = queue.claim("b", 2, now=T0)
+        c = queue.claim("c", 2, now=T0)
+        assert len(a) == 2 and len(b) == 2 and len(c) == 1
+        assert not set(a) & set(b) and not set(b) & set(c)
+        assert queue.claim("d", 2, now=T0) == []
+
+    def test_expired_lease_is_reclaimed(self, queue):
+        queue.enqueue([1], now=T0)
+        assert queue.claim("a", 1, now=T0) == [1]
+        assert queue.claim("b", 1, now=T0 + timedelta(seconds=30)) == []
+        assert queue.claim("b", 1, now=T0 + timedelta(seconds=61)) == [1]
+        # The original owner lost the lease and cannot report
+        assert queue.complete("a", 1, ok=True) is False
+        assert queue.complete("b", 1, ok=True) is True
+
+    def test_heartbeat_extends_lease(self, queue):
+        queue.enqueue([1], now=T0)
+        queue.claim("a", 1, now=T0)
+        assert queue.heartbeat("a", [1], now=T0 + timedelta(seconds=50)) == 1
+        assert queue.claim("b", 1, now=T0 + timedelta(seconds=90)) == []
+        assert queue.heartbeat("b", [1], now=T0) == 0
+
+    def test_enqueue_skips_live_leases(self, queue):
+        queue.enqueue([1, 2], now=T0)
+        queue.claim("a", 1, now=T0)
+        assert queue.enqueue([1, 2], now=T0) == 1
+
+    def test_concurrent_enqueue_of_a_new_player(self, queue):
+        other = WorkQueue(queue.engine, lease_seconds=60)
+        queue.enqueue([3], now=T0)
+        queue.claim("a", 1, now=T0)
+        Session = queue.Session
+
+        def racing_session():
+            # The other instance inserts player 2 between this enqueue's read and its commit
+            session = Session()
+            commit = session.commit
+
+            def commit_after_other():
+                session.commit = commit
+                other.enqueue([2], now=T0)
+                commit()
+
+            session.commit = commit_after_other
+            return session
+
+        queue.Session = racing_session
+        assert queue.enqueue([1, 2, 3], now=T0) == 2
+        assert queue.stats() == {STATUS_PENDING: 2, STATUS_LEASED: 1}
+
+
+class TestComplete:
+
+    def test_success_marks_done(self, queue):
+        queue.enqueue([1], now=T0)
+        queue.claim("a", 1, now=T0)
+        queue.complete("a", 1, ok=True)
+        assert queue.stats() == {STATUS_DONE: 1}
+
+    def test_failure_retries_until_max_attempts(self, queue):
+        queue.enqueue([1], now=T0)
+        queue.claim("a", 1, now=T0)
+        queue.complete("a", 1, ok=False, error="boom")
+        assert queue.stats() == {STATUS_PENDING: 1}
+        queue.claim("a", 1, now=T0)
+        queue.complete("a", 1, ok=False, error="boom")
+        assert queue.stats() == {STATUS_FAILED: 1}
+
+    def test_unfinished_counts_only_players_done_since_queued(self, queue):
+        queue.enqueue([1, 2, 3], now=T0)
+        queue.claim("a", 3, now=T0)
+        queue.complete("a", 1, ok=True)
+        queue.complete("a", 2, ok=False, error="boom")
+        # Player 3 is still leased, player 4 was never queued
+        assert queue.unfinished([1, 2, 3, 4], T0) == {2, 3, 4}
+        # Generated by a lease that started before the player was queued again
+        queue.enqueue([5], now=T0)
+        queue.claim("b", 5, now=T0)
+        assert queue.enqueue([5], now=T0 + timedelta(seconds=10)) == 0
+        queue.complete("b", 5, ok=True)
+        assert queue.unfinished([5], T0 + timedelta(seconds=10)) == {5}
+
+    def test_repeatedly_expiring_lease_gives_up(self, queue):
+        queue.enqueue([1], now=T0)
+        queue.claim("a", 1, now=T0)
+        queue.claim("b", 1, now=T0 + timedelta(seconds=61))
+        assert queue.claim("c", 1, now=T0 + timedelta(seconds=200)) == []
+        assert queue.stats() == {STATUS_FAILED: 1}
+
+
+class TestRunWorker:
+
+    def test_drains_queue(self, queue):
+        queue.enqueue([1, 2, 3])
+        processed = []
+        count = run_worker(queue, worker_id="w", batch_size=2,
+                           process=lambda pid: processed.append(pid) or pid != 2, drain=True)
+        assert sorted(processed) == [1, 2, 2, 3]
+        assert count == 2
+        assert queue.stats() == {STATUS_DONE: 2, STATUS_FAILED: 1}
+
+    def test_process_exception_is_reported(self, queue):
+        queue.enqueue([1])
+
+        def explode(pid):
+            raise RuntimeError("upstream down")
+
+        assert run_worker(queue, worker_id="w", process=explode, drain=True) == 0
+        assert STATUS_LEASED not in queue.stats()
+
+    def test_open_circuit_releases_batch(self, queue):
+        from upstream import CircuitOpenError
+        queue.enqueue([1, 2, 3])
+
+        def outage(pid):
+            raise CircuitOpenError("snooker.org circuit is open")
+
+        assert run_worker(queue, worker_id="w", batch_size=3, process=outage, drain=True) == 0
+        assert queue.stats() == {STATUS_PENDING: 3}
+        # The released attempt is not counted against the player
+        assert sorted(queue.claim("w", 3)) == [1, 2, 3]
@@ -0,0 +1,108 @@
+"""
+Unit tests for the match change feed (match_changes.py)
+
+Runs against a throwaway SQLite database; no MySQL or snooker.org access needed:
+    cd backend && python -m pytest test_match_changes.py -v
+"""
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+import sqlalchemy as sqla
+
+from match_changes import (
+    MatchChangeLog, sync_event_matches,
+    CHANGE_NEW, CHANGE_PLAYERS, CHANGE_RESCHEDULED, CHANGE_RESULT, CHANGE_SCORE,
+)
+
+
+def _match(match_id=1, p1=10, p2=20, score1=0, score2=0, winner=0, status=0,
+           scheduled="2025-06-01T13:00:00Z", start="", end=""):
+    return SimpleNamespace(
+        ID=match_id, EventID=100, Round=7, Number=1, Player1ID=p1, Player2ID=p2,
+        Score1=score1, Score2=score2, WinnerID=winner, Status=status, Unfinished=False,
+        ScheduledDate=scheduled, StartDate=start, EndDate=end,
+    )
+
+
+T0 = datetime(2025, 6, 1, 12, 0, 0)
+
+
+@pytest.fixture()
+def log(tmp_path):
+    change_log = MatchChangeLog(sqla.create_engine(f"sqlite:///{tmp_path / 'changes.db'}"))
+    change_log.init_db()
+    return change_log
+
+
+def _kinds(changes):
+    return [change["kind"] for change in changes]
+
+
+class TestDiff:
+
+    def test_first_sync_records_new_matches(self, log):
+        changes = log.sync([_match(1), _match(2, p1=30, p2=40)], now=T0)
+        assert _kinds(changes) == [CHANGE_NEW, CHANGE_NEW]
+        assert changes[1]["player_ids"] == [30, 40]
+
+    def test_unchanged_matches_record_nothing(self, log):
+        log.sync([_match()], now=T0)
+        assert log.sync([_match()], now=T0) == []
+
+    def test_reschedule_score_and_result(self, log):
+        log.sync([_match()], now=T0)
+        assert _kinds(log.sync([_match(scheduled="2025-06-01T19:00:00Z")])) == [CHANGE_RESCHEDULED]
+        assert _kinds(log.sync([_match(scheduled="2025-06-01T19:00:00Z", score1=3, status=1)])) == [CHANGE_SCORE]
+        result = log.sync([_match(scheduled="2025-06-01T19:00:00Z", score1=6, score2=2, winner=10,
+                                  status=3, end="2025-06-01T22:00:00Z")])
+        assert _kinds(result) == [CHANGE_RESULT]
+        assert "winner 10" in result[0]["new_value"]
+
+    def test_lineup_change_touches_old_and_new_players(self, log):
+        log.sync([_match(p2=0)], now=T0)
+        changes = log.sync([_match(p2=20)], now=T0)
+        assert _kinds(changes) == [CHANGE_PLAYERS]
+        log.sync([_match(p2=25)], now=T0)
+        assert log.changes_since(2)[0]["player_ids"] == [10, 20, 25]
+
+
+class TestConsumers:
+
+    def test_pending_players_and_cursor(self, log):
+        log.sync([_match(1), _match(2, p1=30, p2=40)], now=T0)
+        players, up_to = log.pending_players()
+        assert players == [10, 20, 30, 40]
+        log.advance(up_to)
+        assert log.pending_players() == ([], up_to)
+        log.sync([_match(1, score1=1, status=1)], now=T0)
+        assert log.pending_players()[0] == [10, 20]
+
+    def test_failed_players_stay_pending(self, log):
+        log.sync([_match(1), _match(2, p1=30, p2=40)], now=T0)
+        players, up_to = log.pending_players()
+        log.advance(up_to, processed=players, failed=[30])
+        assert log.pending_players() == ([30], up_to)
+        log.sync([_match(1, score1=1, status=1)], now=T0)
+        players, up_to = log.pending_players()
+        assert players == [10, 20, 30]
+        log.advance(up_to, processed=players)
+        assert log.pending_players() == ([], up_to)
+
+    def test_cursor_never_moves_back(self, log):
+        log.sync([_match(1), _match(2)], now=T0)
+        log.advance(2)
+        log.advance(1)
+        assert log.cursor() == 2
+
+    def test_changes_since_pages_by_id(self, log):
+        log.sync([_match(i) for i in range(1, 6)], now=T0)
+        first = log.changes_since(0, limit=2)
+        assert [c["id"] for c in first] == [1, 2]
+        assert [c["id"] for c in log.changes_since(first[-1]["id"])] == [3, 4, 5]
+
+
+def test_sync_event_matches_fetches_each_event(log):
+    client = SimpleNamespace(event_matches=lambda event_id: [_match(event_id)])
+    changes = sync_event_matches(client, log, [{"id": 1}, {"id": 2}])
+    assert sorted(c["match_id"] for c in changes) == [1, 2]
@@ -0,0 +1,148 @@
+"""
+Unit tests for the bulk missing-player resolution (player_resolver.py)
+
+Runs against a throwaway SQLite database with a fake snooker.org client:
+    cd backend && python -m pytest test_player_resolver.py -v
+"""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+import sqlalchemy as sqla
+from sqlalchemy.orm import sessionmaker
+
+import query_data
+from match_changes import MatchChangeLog
+from player_resolver import STATUS_UNKNOWN, PlayerResolver, UnresolvedPlayer, is_placeholder
+from query_data import Event, Player
+
+NOW = datetime(2025, 11, 1, 12, 0)
+
+
+def _api_player(player_id, lastname):
+    fields = dict.fromkeys([
+        "Type", "MiddleName", "TeamName", "TeamNumber", "TeamSeason", "ShortName", "Nationality", "Sex",
+        "BioPage", "Born", "Twitter", "SurnameFirst", "License", "Club", "URL", "Photo", "PhotoSource",
+        "FirstSeasonAsPro", "LastSeasonAsPro", "Info", "NumRankingTitles", "NumMaximums", "Died",
+    ])
+    return SimpleNamespace(ID=player_id, FirstName="Q", LastName=lastname, **fields)
+
+
+def _match(match_id, p1, p2):
+    return SimpleNamespace(
+        ID=match_id, EventID=100, Round=1, Number=match_id, Player1ID=p1, Player2ID=p2, Score1=0, Score2=0,
+        WinnerID=0, Status=0, Unfinished=False, ScheduledDate="", StartDate="", EndDate="",
+    )
+
+
+class FakeClient:
+
+    def __init__(self, roster=(), players=()):
+        self.roster = {p.ID: p for p in roster}
+        self.players = {p.ID: p for p in players}
+        self.calls = []
+
+    def event_players(self, event_id):
+        self.calls.append(("event_players", event_id))
+        return list(self.roster.values())
+
+    def player(self, player_id):
+        self.calls.append(("player", player_id))
+        return self.players.get(player_id)
+
+
+@pytest.fixture()
+def engine(tmp_path):
+    engine = sqla.create_engine(f"sqlite:///{tmp_path / 'players.db'}")
+    query_data.Base.metadata.create_all(engine, tables=[Event.__table__, Player.__table__])
+    session = sessionmaker(bind=engine)()
+    session.add_all([Event(id=100, name="Qualifiers", season=2025), Player(id=1, last_name="Known")])
+    session.commit()
+    session.close()
+    log = MatchChangeLog(engine)
+    log.init_db()
+    # 0 is an undecided opponent; 7, 8 and 9 are not stored yet
+    log.sync([_match(1, 1, 7), _match(2, 8, 0), _match(3, 9, 1)])
+    return engine
+
+
+@pytest.fixture()
+def resolver(engine):
+    r = PlayerResolver(engine)
+    r.init_db()
+    return r
+
+
+def test_placeholders():
+    assert is_placeholder(0) and is_placeholder(None) and is_placeholder(-1)
+    assert not is_placeholder(7)
+
+
+class TestResolve:
+
+    def test_one_roster_request_then_single_lookups(self, resolver):
+        client = FakeClient(roster=[_api_player(7, "Seven"), _api_player(8, "Eight")])
+        result = resolver.resolve(client, season=2025, now=NOW)
+        assert result == {"stored": 2, "unknown": 1, "requests": 2, "resolved": [7, 8]}
+        assert client.calls == [("event_players", 100), ("player", 9)]
+        assert resolver.missing(2025, now=NOW) == {}
+
+    def test_unknown_ids_are_negatively_cached(self, resolver, engine):
+        client = FakeClient(roster=[_api_player(7, "Seven"), _api_player(8, "Eight")])
+        resolver.resolve(client, season=2025, now=NOW)
+        client.calls.clear()
+        assert resolver.resolve(client, season=2025, now=NOW + timedelta(days=1))["requests"] == 0
+        # Asked again once the negative entry is due
+        client.players[9] = _api_player(9, "Nine")
+        assert resolver.resolve(client, season=2025, now=NOW + timedelta(days=8))["stored"] == 1
+        session = sessionmaker(bind=engine)()
+        assert session.get(Player, 9).last_name == "Nine"
+        assert session.query(UnresolvedPlayer).count() == 0
+        session.close()
+
+    def test_calendars_mentioning_resolved_players(self, resolver):
+        # Match 1 is 1 v 7, match 3 is 9 v 1; match 2's opponent 0 is a placeholder
+        assert resolver.calendars_mentioning([7]) == {1, 7}
+        assert resolver.calendars_mentioning([8]) == {8}
+        assert resolver.calendars_mentioning([1]) == {1, 7, 9}
+        assert resolver.calendars_mentioning([]) == set()
+
+    def test_noted_ids_are_resolved_too(self, resolver, engine):
+        resolver.note_missing([42, 0], now=NOW)
+        resolver.note_missing([42], now=NOW)
+        assert set(resolver.missing(2025, now=NOW)) == {7, 8, 9, 42}
+        client = FakeClient(roster=[_api_player(7, "Seven"), _api_player(8, "Eight")])
+        resolver.resolve(client, season=2025, now=NOW)
+        session = sessionmaker(bind=engine)()
+        assert {r.player_id: r.status for r in session.query(UnresolvedPlayer)} == \
+            {9: STATUS_UNKNOWN, 42: STATUS_UNKNOWN}
+        session.close()
+
+    def test_calendar_names_a_noted_player_once_resolved(self, resolver, engine, monkeypatch):
+        import player_matches_to_ics
+        import player_resolver
+        monkeypatch.setattr(player_resolver, "_noted", {})
+        monkeypatch.setattr(player_resolver, "_default_resolver", resolver)
+        monkeypatch.setattr(query_data, "_dimensions", None)
+        match = SimpleNamespace(
+            ID=1, EventID=100, Round=1, Number=1, Player1ID=1, Player2ID=7, Score1=0, Score2=0, WinnerID=0,
+            Status=0, Unfinished=False, Estimated=False, DetailsUrl="", Note="", ExtendedNote="",
+            Walkover1=False, Walkover2=False, LiveUrl="", TableNo=0, ScheduledDate="2099-06-01T13:00:00Z",
+            StartDate="", EndDate="",
+        )
+
+        def render():
+            session = sessionmaker(bind=engine)()
+            try:
+                lookups = player_matches_to_ics.prefetch_calendar_lookups(1, [match], session=session)
+            finally:
+                session.close()
+            ics, _ = player_matches_to_ics.render_player_calendar(1, 2025, [match], lookups)
+            return ics.decode().replace("\r\n ", "")
+
+        assert "Player 7" in render()
+        assert 7 in resolver.missing(2025, now=NOW)
+        resolver.resolve(FakeClient(players=[_api_player(7, "Seven")]), season=2025, now=NOW)
+        # Still within the note TTL of this process, yet the stored name is used
+        text = render()
+        assert "Seven" in text and "Player 7" not in text
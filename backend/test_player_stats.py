@@ -0,0 +1,95 @@
+"""
+Unit tests for the materialized player season statistics (player_stats.py)
+
+Runs against a throwaway SQLite database; no MySQL or snooker.org access needed:
+    cd backend && python -m pytest test_player_stats.py -v
+"""
+from types import SimpleNamespace
+
+import pytest
+import sqlalchemy as sqla
+from sqlalchemy.orm import sessionmaker
+
+import query_data
+from match_changes import MatchChangeLog
+from player_stats import PlayerStatsStore
+from query_data import Event, Round
+
+
+def _match(match_id, round_no, p1, p2, score1, score2, winner):
+    return SimpleNamespace(
+        ID=match_id, EventID=100, Round=round_no, Number=match_id, Player1ID=p1, Player2ID=p2,
+        Score1=score1, Score2=score2, WinnerID=winner, Status=3 if winner else 0, Unfinished=False,
+        ScheduledDate="2025-06-01T13:00:00Z", StartDate="", EndDate="",
+    )
+
+
+@pytest.fixture()
+def engine(tmp_path):
+    engine = sqla.create_engine(f"sqlite:///{tmp_path / 'stats.db'}")
+    query_data.Base.metadata.create_all(engine, tables=[Event.__table__, Round.__table__])
+    session = sessionmaker(bind=engine)()
+    session.add_all([
+        Event(id=100, name="UK Championship", season=2025),
+        Round(event_id=100, round=1, num_left=8, actual_money=1000.0, points=1000),
+        Round(event_id=100, round=3, num_left=2, actual_money=5000.0, points=5000),
+        Round(event_id=100, round=4, num_left=1, actual_money=10000.0, points=10000),
+    ])
+    session.commit()
+    session.close()
+    return engine
+
+
+@pytest.fixture()
+def change_log(engine):
+    log = MatchChangeLog(engine)
+    log.init_db()
+    log.sync([
+        _match(1, 1, 1, 2, 4, 1, winner=1),
+        _match(2, 1, 3, 4, 4, 3, winner=3),
+        _match(3, 3, 1, 3, 6, 2, winner=1),
+        _match(4, 1, 5, 6, 0, 0, winner=0),
+    ])
+    return log
+
+
+@pytest.fixture()
+def store(engine):
+    s = PlayerStatsStore(engine)
+    s.init_db()
+    return s
+
+
+class TestRecompute:
+
+    def test_season_totals(self, store, change_log):
+        assert store.recompute(2025) == 4
+        champion = store.get(1, 2025)
+        assert (champion["matches_played"], champion["wins"], champion["losses"]) == (2, 2, 0)
+        assert (champion["frames_won"], champion["frames_lost"]) == (10, 3)
+        assert champion["prize_money"] == 10000.0 and champion["ranking_points"] == 10000
+
+    def test_runner_up_and_first_round_loser(self, store, change_log):
+        store.recompute(2025)
+        runner_up = store.get(3, 2025)
+        assert (runner_up["wins"], runner_up["losses"]) == (1, 1)
+        assert (runner_up["frames_won"], runner_up["frames_lost"]) == (6, 9)
+        assert runner_up["prize_money"] == 5000.0
+        assert store.get(2, 2025)["ranking_points"] == 1000
+
+    def test_unfinished_matches_and_other_seasons_are_ignored(self, store, change_log):
+        store.recompute(2025)
+        assert store.get(5, 2025) is None
+        assert store.recompute(2024) == 0
+
+
+class TestIncremental:
+
+    def test_changes_recompute_only_affected_players(self, store, change_log):
+        assert store.apply_changes(change_log) == 4
+        # The first-round result is corrected: player 2 actually won
+        change_log.sync([_match(1, 1, 1, 2, 3, 4, winner=2)])
+        assert store.apply_changes(change_log) == 2
+        assert store.get(2, 2025)["wins"] == 1
+        assert store.get(1, 2025)["losses"] == 1
+        assert store.apply_changes(change_log) == 0
@@ -0,0 +1,216 @@
+"""
+Unit tests for the lookup helpers in query_data.py
+
+Runs against an in-memory SQLite database instead of MySQL:
+    cd backend && python -m pytest test_query_data.py -v
+"""
+import datetime
+from unittest.mock import patch
+
+import pytest
+import sqlalchemy as sqla
+from sqlalchemy.orm import sessionmaker
+
+import match_changes
+import query_data
+from query_data import Base, Event, Player, Ranking, Round
+
+
+@pytest.fixture()
+def db():
+    engine = sqla.create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    match_changes.Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    session.add_all([
+        Player(id=1, first_name="Ronnie", last_name="O'Sullivan", surname_first=False, nationality="England"),
+        Player(id=2, first_name="Ding", last_name="Junhui", surname_first=True, nationality="China"),
+        Event(id=10, name="UK Championship", season=2025),
+        Event(id=20, name="Old Open", season=2020),
+        Round(event_id=10, round=7, round_name="Final", distance=10),
+        Ranking(position=1, player_id=1, sum_value=1000.0),
+    ])
+    session.commit()
+    session.close()
+    with patch.object(query_data, "DBSession", Session), \
+         patch.dict(query_data._current_season_cache, {"value": None, "ts": 0}):
+        yield engine
+    query_data.clear_lookup_caches()
+
+
+class TestLookupSnapshot:
+
+    def test_lookups_served_from_snapshot(self, db):
+        with query_data.lookup_snapshot(2025):
+            with patch.object(query_data, "DBSession", side_effect=AssertionError("queried the database")):
+                assert query_data.query_player_info(2)["lastname"] == "Junhui"
+                assert query_data.query_event_info(10)["name"] == "UK Championship"
+                assert query_data.query_round_info(10, 7)["distance"] == 10
+                assert query_data.query_player_ranking(1)["position"] == 1
+
+    def test_season_filter_and_fallback(self, db):
+        with query_data.lookup_snapshot(2025) as store:
+            assert 20 not in store.events
+            # Misses still fall back to the database
+            assert query_data.query_event_info(20)["name"] == "Old Open"
+            assert query_data.query_player_info(99) is None
+
+    def test_store_reused_until_sync_version_changes(self, db):
+        with query_data.lookup_snapshot(2025) as first:
+            pass
+        with query_data.lookup_snapshot(2025) as second:
+            assert second is first
+        session = sessionmaker(bind=db)()
+        session.add(query_data.InfoLastUpdated(info="players", lastupdated=datetime.datetime(2025, 6, 1)))
+        session.commit()
+        session.close()
+        with query_data.lookup_snapshot(2025) as third:
+            assert third is not first
+            assert query_data.query_player_info(1) is third.players[1]
+
+    def test_ranking_players_served_from_store(self, db):
+        session = sessionmaker(bind=db)()
+        session.add(query_data.IcsLastUpdated(playerid=1, lastupdated=datetime.datetime(2025, 6, 2)))
+        session.commit()
+        session.close()
+        with patch.object(query_data, "get_current_season", return_value=2025):
+            rows = query_data.query_all_ranking_players(search="sulli")
+        assert [(r["player_id"], r["lastname"], r["position"]) for r in rows] == [(1, "O'Sullivan", 1)]
+        assert rows[0]["last_updated"] == datetime.datetime(2025, 6, 2)
+        assert query_data.query_all_ranking_players(search="ding") == []
+
+
+class TestProjectedLookups:
+
+    def test_lookups_reuse_a_passed_session(self, db):
+        with query_data.lookup_session() as session:
+            with patch.object(query_data, "DBSession", side_effect=AssertionError("opened a session")):
+                assert query_data.query_player_info(2, session=session)["surname_first"] is True
+                assert query_data.query_event_info(10, session=session)["season"] == 2025
+                assert query_data.query_round_info(10, 7, session=session)["round_name"] == "Final"
+                assert query_data.query_player_ranking(1, session=session)["sum_value"] == 1000.0
+                assert query_data.query_player_info(99, session=session) is None
+                assert [e["id"] for e in query_data.query_season_events(2020, session=session)] == [20]
+
+    def test_failed_lookup_does_not_poison_a_shared_session(self, db):
+        with query_data.lookup_session() as session:
+            session.add(Player(id=1, last_name="Duplicate"))
+            with pytest.raises(sqla.exc.IntegrityError):
+                session.flush()
+            # The session refuses every statement until it is rolled back; the failing lookup does that
+            assert query_data.query_player_info(2, session=session) is None
+            assert query_data.query_player_info(2, session=session)["lastname"] == "Junhui"
+            assert query_data.query_event_info(10, session=session)["name"] == "UK Championship"
+
+    def test_core_connection_works_too(self, db):
+        with db.connect() as conn:
+            assert query_data.query_player_info(1, session=conn)["lastname"] == "O'Sullivan"
+
+
+class TestEventWindows:
+
+    @pytest.fixture()
+    def events(self, db):
+        session = sessionmaker(bind=db)()
+        session.add_all([
+            Event(id=30, name="Masters", season=2025, start_date="2026-01-11", end_date="2026-01-18"),
+            Event(id=31, name="German Masters", season=2025, start_date="2026-01-28", end_date="2026-02-01"),
+            Event(id=32, name="Shanghai Masters", season=2025, start_date="2025-07-21", end_date="2025-07-27"),
+        ])
+        session.commit()
+        session.close()
+        return db
+
+    @pytest.mark.parametrize("today, active", [
+        (datetime.date(2026, 1, 10), []),
+        (datetime.date(2026, 1, 11), [30]),
+        (datetime.date(2026, 1, 15), [30]),
+        (datetime.date(2026, 1, 18), [30]),
+        (datetime.date(2026, 1, 19), []),
+        (datetime.date(2026, 2, 1), [31]),
+    ])
+    def test_active_events_include_both_ends(self, events, today, active):
+        assert [e["id"] for e in query_data.query_active_events(today)] == active
+
+    def test_events_without_dates_are_never_active(self, events):
+        # Events 10 and 20 have no dates at all
+        assert [e["id"] for e in query_data.query_active_events(datetime.date(2026, 1, 15))] == [30]
+
+    def test_open_events_have_not_ended(self, events):
+        open_events = query_data.query_open_events(datetime.date(2026, 1, 15), season=2025)
+        assert [e["id"] for e in open_events] == [30, 31]
+
+    def test_errors_read_as_no_events(self, db):
+        with patch.object(query_data, "_event_summaries", side_effect=sqla.exc.OperationalError("q", {}, None)):
+            assert query_data.query_active_events(datetime.date(2026, 1, 15)) == []
+
+
+class TestCurrentSeason:
+
+    def test_persisted_value_used_without_api_call(self, db):
+        query_data._store_season(2025)
+        with patch.object(query_data, "_refresh_in_background") as refresh, \
+             patch.object(query_data, "_fetch_current_season", side_effect=AssertionError("called the API")):
+            assert query_data.get_current_season() == 2025
+        refresh.assert_not_called()
+
+    def test_stale_value_served_and_refreshed_in_background(self, db):
+        query_data._store_season(2024, now=datetime.datetime.utcnow() - datetime.timedelta(days=3))
+        with patch.object(query_data, "_refresh_in_background") as refresh:
+            assert query_data.get_current_season() == 2024
+        refresh.assert_called_once()
+
+    def test_cold_start_estimates_and_refreshes(self, db):
+        with patch.object(query_data, "_refresh_in_background") as refresh:
+            assert query_data.get_current_season() == query_data._estimate_season()
+        refresh.assert_called_once()
+
+    def test_refresh_persists_api_value(self, db):
+        with patch.object(query_data, "_fetch_current_season", return_value=2026):
+            assert query_data.refresh_current_season() == 2026
+        query_data._current_season_cache["value"] = None
+        assert query_data._load_persisted_season()[0] == 2026
+
+    def test_fetch_closes_its_session(self):
+        import requests
+        import upstream
+        sessions = []
+
+        def create_session(headers=None):
+            session = requests.Session()
+            response = requests.Response()
+            response.status_code = 200
+            response._content = b'[{"CurrentSeason": 2026}]'
+            session.get = lambda url: response
+            session.close = lambda: sessions.append("closed")
+            return session
+
+        with patch.object(upstream, "create_session", create_session):
+            assert query_data._fetch_current_season() == 2026
+        assert sessions == ["closed"]
+
+    def test_estimate_season_rolls_over_in_summer(self):
+        assert query_data._estimate_season(datetime.date(2025, 3, 1)) == 2024
+        assert query_data._estimate_season(datetime.date(2025, 7, 1)) == 2025
+
+
+class TestUpcomingMatches:
+
+    def test_prejoined_display_data(self, db):
+        session = sessionmaker(bind=db)()
+        session.add_all([
+            match_changes.MatchState(match_id=5, event_id=10, round=7, player1_id=1, player2_id=2,
+                                     winner_id=0, scheduled_date="2025-12-14T19:00:00Z"),
+            match_changes.MatchState(match_id=6, event_id=10, round=7, player1_id=1, player2_id=2,
+                                     winner_id=1, scheduled_date="2025-12-13T19:00:00Z"),
+        ])
+        session.commit()
+        session.close()
+        [(when, match)] = query_data.query_upcoming_matches()
+        assert when == "2025-12-14T19:00:00Z"
+        assert match["event"]["name"] == "UK Championship"
+        assert match["round"]["round_name"] == "Final"
+        assert match["player1"]["lastname"] == "O'Sullivan" and match["player1"]["position"] == 1
+        assert match["player2"]["position"] is None
+        assert query_data.query_upcoming_matches(match_ids=[6]) == []
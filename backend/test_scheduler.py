@@ -0,0 +1,373 @@
+"""
+Unit tests for the scheduler's job logic (scheduler.py)
+
+The jobs' collaborators (rankings, schedules, generation) are replaced with
+fakes and the match change feed runs on a throwaway SQLite database, so no
+MySQL or snooker.org access is needed:
+    cd backend && python -m pytest test_scheduler.py -v
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+import sqlalchemy as sqla
+
+import scheduler
+from match_changes import MatchChangeLog
+
+NOW = datetime(2025, 6, 1, 12, 0, 0)
+
+
+def _schedule(checked_at=NOW, next_match=None, last_match=None, live=False):
+    return SimpleNamespace(checked_at=checked_at, next_match=next_match, last_match=last_match, live=live)
+
+
+def _match(match_id, p1, p2, score1=0):
+    return SimpleNamespace(
+        ID=match_id, EventID=100, Round=7, Number=match_id, Player1ID=p1, Player2ID=p2,
+        Score1=score1, Score2=0, WinnerID=0, Status=0, Unfinished=False,
+        ScheduledDate="2025-06-01T13:00:00Z", StartDate="", EndDate="",
+    )
+
+
+@pytest.fixture()
+def ranked(monkeypatch):
+    """Ranked players and their IcsSchedule rows, both editable by the test."""
+    players = [{'player_id': pid} for pid in (1, 2, 3)]
+    schedules = {}
+    monkeypatch.setattr(scheduler, "query_all_ranking_players", lambda: players)
+    monkeypatch.setattr(scheduler, "query_ics_schedules", lambda: schedules)
+    return players, schedules
+
+
+class TestRefreshTier:
+
+    @pytest.mark.parametrize("next_in, last_ago, tier", [
+        (timedelta(minutes=59), None, 'live'),
+        (timedelta(hours=1), None, 'live'),
+        (timedelta(hours=1, seconds=1), None, 'week'),
+        (timedelta(days=7), None, 'week'),
+        (timedelta(days=7, seconds=1), None, 'idle'),
+        (None, timedelta(hours=1), 'live'),
+        (None, timedelta(hours=1, seconds=1), 'week'),
+        (None, timedelta(days=1), 'week'),
+        (None, timedelta(days=1, seconds=1), 'idle'),
+        (None, None, 'idle'),
+    ])
+    def test_tier_boundaries(self, next_in, last_ago, tier):
+        schedule = _schedule(next_match=NOW + next_in if next_in else None,
+                             last_match=NOW - last_ago if last_ago else None)
+        assert scheduler.refresh_tier(schedule, NOW) == tier
+
+    def test_live_flag_wins(self):
+        assert scheduler.refresh_tier(_schedule(live=True), NOW) == 'live'
+
+    def test_nearest_reason_wins(self):
+        schedule = _schedule(next_match=NOW + timedelta(days=3), last_match=NOW - timedelta(minutes=30))
+        assert scheduler.refresh_tier(schedule, NOW) == 'live'
+
+
+class TestSelectDuePlayers:
+
+    def test_never_generated_players_are_due(self, ranked):
+        players, schedules = ranked
+        schedules[1] = _schedule()
+        schedules[2] = _schedule(checked_at=None)
+        assert scheduler.select_due_players(NOW) == [2, 3]
+
+    @pytest.mark.parametrize("schedule_kwargs, interval", [
+        ({'next_match': NOW + timedelta(minutes=30)}, scheduler.REFRESH_TIERS['live']),
+        ({'next_match': NOW + timedelta(days=2)}, scheduler.REFRESH_TIERS['week']),
+        ({}, scheduler.REFRESH_TIERS['idle']),
+    ])
+    def test_due_once_the_tier_interval_has_passed(self, ranked, schedule_kwargs, interval):
+        players, schedules = ranked
+        del players[1:]
+        schedules[1] = _schedule(checked_at=NOW - interval + timedelta(seconds=1), **schedule_kwargs)
+        assert scheduler.select_due_players(NOW) == []
+        schedules[1] = _schedule(checked_at=NOW - interval, **schedule_kwargs)
+        assert scheduler.select_due_players(NOW) == [1]
+
+    def test_changes_mode_uses_changes_and_the_idle_safety_net(self, ranked):
+        players, schedules = ranked
+        # Player 1's match is close, but without a change it is not regenerated on the live tier
+        schedules[1] = _schedule(checked_at=NOW - timedelta(hours=2), next_match=NOW + timedelta(minutes=30))
+        schedules[2] = _schedule(checked_at=NOW - timedelta(minutes=1))
+        schedules[3] = _schedule(checked_at=NOW - scheduler.REFRESH_TIERS['idle'])
+        assert scheduler.select_due_players(NOW, changed=set()) == [3]
+        assert scheduler.select_due_players(NOW, changed={2}) == [2, 3]
+
+    def test_changed_players_outside_the_rankings_are_not_due(self, ranked):
+        players, schedules = ranked
+        schedules.update({pid: _schedule() for pid in (1, 2, 3, 99)})
+        assert scheduler.select_due_players(NOW, changed={2, 99}) == [2]
+
+
+class TestResolveMissingPlayers:
+
+    def test_calendars_naming_resolved_players_become_due(self, monkeypatch):
+        expired = []
+        resolver = SimpleNamespace(
+            resolve=lambda client, season, wait_time: {'stored': 1, 'unknown': 0, 'requests': 1, 'resolved': [7]},
+            calendars_mentioning=lambda ids: {1, 7} if list(ids) == [7] else set(),
+        )
+        monkeypatch.setattr(scheduler, "player_resolver", resolver)
+        monkeypatch.setattr(scheduler, "create_snooker_client", lambda: None)
+        monkeypatch.setattr(scheduler, "get_current_season", lambda: 2025)
+        monkeypatch.setattr(scheduler, "expire_ics_schedules", lambda ids: expired.append(set(ids)) or len(ids))
+        scheduler._resolve_missing_players()
+        assert expired == [{1, 7}]
+
+    def test_nothing_expired_when_nothing_was_stored(self, monkeypatch):
+        resolver = SimpleNamespace(
+            resolve=lambda client, season, wait_time: {'stored': 0, 'unknown': 1, 'requests': 1, 'resolved': []},
+            calendars_mentioning=lambda ids: pytest.fail("looked up calendars"),
+        )
+        monkeypatch.setattr(scheduler, "player_resolver", resolver)
+        monkeypatch.setattr(scheduler, "create_snooker_client", lambda: None)
+        monkeypatch.setattr(scheduler, "get_current_season", lambda: 2025)
+        monkeypatch.setattr(scheduler, "expire_ics_schedules", lambda ids: pytest.fail("expired calendars"))
+        scheduler._resolve_missing_players()
+
+
+@pytest.fixture()
+def change_log(tmp_path, monkeypatch):
+    log = MatchChangeLog(sqla.create_engine(f"sqlite:///{tmp_path / 'changes.db'}"))
+    log.init_db()
+    monkeypatch.setattr(scheduler, "change_log", log)
+    return log
+
+
+@pytest.fixture()
+def live_job(change_log, monkeypatch):
+    """live_events_job with one active event and generation replaced by a recorder."""
+    calls = []
+    outcome = {'unfinished': set()}
+
+    def fake_generate(player_ids=None, player_guard=None, run_kind='batch', redo=None):
+        calls.append((sorted(player_ids), run_kind, sorted(redo)))
+        return outcome['unfinished']
+
+    monkeypatch.setattr(scheduler, "query_active_events", lambda: [{'id': 100}])
+    monkeypatch.setattr(scheduler, "sync_event_matches", lambda client, log, events, wait_time=0: [])
+    monkeypatch.setattr(scheduler, "create_snooker_client", lambda: None)
+    monkeypatch.setattr(scheduler, "_update_player_stats", lambda: None)
+    monkeypatch.setattr(scheduler, "_resolve_missing_players", lambda: set())
+    monkeypatch.setattr(scheduler, "generate_all_players_calendars", fake_generate)
+    return calls, outcome
+
+
+class TestLiveEventsJob:
+
+    def test_regenerates_changed_players_and_advances(self, change_log, live_job):
+        calls, outcome = live_job
+        change_log.sync([_match(1, 10, 20)], now=NOW)
+        scheduler.live_events_job()
+        assert calls == [([10, 20], 'live', [10, 20])]
+        assert change_log.pending_players() == ([], change_log.latest_id())
+
+    def test_players_left_unfinished_stay_pending(self, change_log, live_job):
+        calls, outcome = live_job
+        change_log.sync([_match(1, 10, 20)], now=NOW)
+        outcome['unfinished'] = {20}
+        scheduler.live_events_job()
+        assert change_log.pending_players()[0] == [20]
+
+        outcome['unfinished'] = set()
+        scheduler.live_events_job()
+        assert calls[-1] == ([20], 'live', [20])
+        assert change_log.pending_players()[0] == []
+
+    def test_nothing_synced_without_active_events(self, change_log, live_job, monkeypatch):
+        calls, outcome = live_job
+        monkeypatch.setattr(scheduler, "query_active_events", lambda: [])
+        monkeypatch.setattr(scheduler, "sync_event_matches", lambda *args, **kwargs: pytest.fail("synced"))
+        scheduler.live_events_job()
+        assert calls == []
+
+    def test_cursor_stays_when_generation_could_not_run(self, change_log, live_job):
+        calls, outcome = live_job
+        change_log.sync([_match(1, 10, 20)], now=NOW)
+        outcome['unfinished'] = None
+        scheduler.live_events_job()
+        assert change_log.cursor() == 0
+
+
+class TestGenerateIcsJobQueueMode:
+
+    @pytest.fixture()
+    def queue_job(self, change_log, tmp_path, monkeypatch):
+        from contextlib import nullcontext
+        from ics_work_queue import WorkQueue, create_queue_engine
+        queue = WorkQueue(create_queue_engine(f"sqlite:///{tmp_path / 'queue.db'}"))
+        queue.init_db()
+        failing = set()
+
+        def fake_worker(queue, batch_size, process, drain):
+            done = 0
+            for player_id in queue.claim("test", 100):
+                ok = player_id not in failing
+                queue.complete("test", player_id, ok=ok, error=None if ok else "boom")
+                done += ok
+            return done
+
+        monkeypatch.setattr(scheduler, "generation_mode", "queue")
+        monkeypatch.setattr(scheduler, "regeneration_mode", "changes")
+        monkeypatch.setattr(scheduler, "get_work_queue", lambda: queue)
+        monkeypatch.setattr(scheduler, "run_worker", fake_worker)
+        monkeypatch.setattr(scheduler, "lookup_snapshot", lambda season: nullcontext())
+        monkeypatch.setattr(scheduler, "get_current_season", lambda: 2025)
+        monkeypatch.setattr(scheduler, "_resolve_missing_players", lambda: None)
+        monkeypatch.setattr(scheduler, "select_due_players", lambda changed=None: sorted(changed))
+        return failing
+
+    def test_failed_queue_jobs_stay_pending(self, change_log, queue_job):
+        change_log.sync([_match(1, 10, 20)], now=NOW)
+        queue_job.add(20)
+        scheduler.generate_ics_job()
+        assert change_log.pending_players() == ([20], change_log.latest_id())
+        assert change_log.retry_players() == {20}
+
+        queue_job.clear()
+        scheduler.generate_ics_job()
+        assert change_log.pending_players()[0] == []
+
+
+def _start(target):
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+class TestReadWriteLock:
+
+    def test_readers_share_the_lock(self):
+        lock = scheduler.ReadWriteLock()
+        lock.acquire_read()
+        entered = threading.Event()
+        _start(lambda: (lock.acquire_read(), entered.set()))
+        assert entered.wait(1)
+
+    def test_writer_waits_for_readers_and_excludes_them(self):
+        lock = scheduler.ReadWriteLock()
+        lock.acquire_read()
+        writing = threading.Event()
+        _start(lambda: (lock.acquire_write(), writing.set()))
+        assert not writing.wait(0.1)
+        lock.release_read()
+        assert writing.wait(1)
+
+        reading = threading.Event()
+        _start(lambda: (lock.acquire_read(), reading.set()))
+        assert not reading.wait(0.1)
+        lock.release_write()
+        assert reading.wait(1)
+
+    def test_waiting_writer_blocks_new_readers(self):
+        lock = scheduler.ReadWriteLock()
+        lock.acquire_read()
+        writing, reading = threading.Event(), threading.Event()
+        _start(lambda: (lock.acquire_write(), writing.set()))
+        time.sleep(0.05)
+        _start(lambda: (lock.acquire_read(), reading.set()))
+        assert not reading.wait(0.1)
+        lock.release_read()
+        assert writing.wait(1)
+        assert not reading.is_set()
+        lock.release_write()
+        assert reading.wait(1)
+
+
+class TestUseResources:
+
+    @pytest.fixture(autouse=True)
+    def fresh_locks(self, monkeypatch):
+        monkeypatch.setattr(scheduler, "resource_locks",
+                            {'players': scheduler.ReadWriteLock(), 'events': scheduler.ReadWriteLock()})
+
+    def test_writer_excludes_readers_of_the_same_resource_only(self):
+        reading_players, reading_events = threading.Event(), threading.Event()
+
+        def read(name, flag):
+            with scheduler.use_resources(read=(name,)):
+                flag.set()
+
+        with scheduler.use_resources(write=('players',)):
+            _start(lambda: read('players', reading_players))
+            _start(lambda: read('events', reading_events))
+            assert reading_events.wait(1)
+            assert not reading_players.wait(0.1)
+        assert reading_players.wait(1)
+
+    def test_locks_released_on_error(self):
+        with pytest.raises(RuntimeError):
+            with scheduler.use_resources(read=('events',), write=('players',)):
+                raise RuntimeError("sync failed")
+        done = threading.Event()
+
+        def write_both():
+            with scheduler.use_resources(write=('players', 'events')):
+                done.set()
+
+        _start(write_both)
+        assert done.wait(1)
+
+
+class TestCoalescingJob:
+
+    def test_ticks_during_a_run_fold_into_one_rerun(self):
+        started, release = threading.Event(), threading.Event()
+        runs = []
+
+        def work():
+            runs.append(len(runs))
+            started.set()
+            release.wait(1)
+
+        job = scheduler.CoalescingJob(work)
+        runner = _start(job)
+        assert started.wait(1)
+        for _ in range(3):
+            job()  # returns immediately while the first run is in progress
+        release.set()
+        runner.join(2)
+        assert runs == [0, 1]
+        job()
+        assert runs == [0, 1, 2]
+
+    def test_error_does_not_leave_the_job_running(self):
+        calls = []
+
+        def work():
+            calls.append(1)
+            raise RuntimeError("boom")
+
+        job = scheduler.CoalescingJob(work)
+        with pytest.raises(RuntimeError):
+            job()
+        with pytest.raises(RuntimeError):
+            job()
+        assert len(calls) == 2
+
+
+class TestTriggerJob:
+
+    def test_scheduled_job_is_brought_forward(self, monkeypatch):
+        fake = SimpleNamespace(get_job=lambda job_id: object(), modify_job=MagicMock())
+        monkeypatch.setattr(scheduler, "_scheduler", fake)
+        scheduler.trigger_job('daily_rankings_fallback', lambda: pytest.fail("ran inline"))
+        job_id, = fake.modify_job.call_args.args
+        assert job_id == 'daily_rankings_fallback'
+        assert fake.modify_job.call_args.kwargs['next_run_time'].tzinfo is not None
+
+    def test_without_a_scheduler_runs_in_its_own_thread(self, monkeypatch):
+        monkeypatch.setattr(scheduler, "_scheduler", None)
+        ran = threading.Event()
+        thread_names = []
+        scheduler.trigger_job('daily_event_info_fallback',
+                              lambda: (thread_names.append(threading.current_thread().name), ran.set()))
+        assert ran.wait(1)
+        assert thread_names == ['daily_event_info_fallback']
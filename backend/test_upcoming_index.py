@@ -0,0 +1,113 @@
+"""
+Unit tests for the upcoming-matches time index (upcoming_index.py)
+
+The loaders are plain functions over a dict; no MySQL needed:
+    cd backend && python -m pytest test_upcoming_index.py -v
+"""
+from datetime import datetime, timezone
+
+import pytest
+
+from upcoming_index import UpcomingIndex, parse_match_time
+
+NOW = datetime(2025, 6, 1, 12, 0, tzinfo=timezone.utc).timestamp()
+
+
+class FakeSource:
+    def __init__(self):
+        self.matches = {}
+        self.changes = []
+        self.full_loads = 0
+
+    def set(self, match_id, when):
+        if when is None:
+            self.matches.pop(match_id, None)
+        else:
+            self.matches[match_id] = when
+        self.changes.append({"id": len(self.changes) + 1, "match_id": match_id})
+
+    def load_matches(self, match_ids):
+        if match_ids is None:
+            self.full_loads += 1
+        ids = self.matches if match_ids is None else [m for m in match_ids if m in self.matches]
+        return [(self.matches[m], {"match_id": m}) for m in ids]
+
+    def load_changes(self, since, limit):
+        return [c for c in self.changes if c["id"] > since][:limit]
+
+    def latest(self):
+        return len(self.changes)
+
+
+class Clock:
+    def __init__(self):
+        self.now = NOW
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture()
+def source():
+    s = FakeSource()
+    s.set(1, "2025-06-01T13:00:00Z")
+    s.set(2, "2025-06-02T10:00:00Z")
+    s.set(3, "2025-06-05T10:00:00Z")
+    s.set(4, "2025-06-01T10:30:00Z")  # started 90 minutes ago, still on
+    return s
+
+
+@pytest.fixture()
+def clock():
+    return Clock()
+
+
+@pytest.fixture()
+def index(source, clock):
+    return UpcomingIndex(source.load_matches, source.load_changes, source.latest,
+                         check_interval=10, patch_limit=2, clock=clock)
+
+
+def _ids(entries):
+    return [e["match_id"] for e in entries]
+
+
+def test_window_is_sorted_and_bounded(index):
+    assert _ids(index.upcoming(24)) == [4, 1, 2]
+    assert _ids(index.upcoming(1)) == [4, 1]
+
+
+def test_changes_are_patched_in(index, source, clock):
+    index.upcoming(24)
+    source.set(3, "2025-06-01T15:00:00Z")   # rescheduled into the window
+    source.set(1, None)                     # finished
+    clock.now += 11
+    assert _ids(index.upcoming(24)) == [4, 3, 2]
+    assert source.full_loads == 1
+
+
+def test_many_changes_trigger_rebuild(index, source, clock):
+    index.upcoming(24)
+    for match_id in (5, 6, 7):
+        source.set(match_id, "2025-06-01T20:00:00Z")
+    clock.now += 11
+    assert _ids(index.upcoming(24)) == [4, 1, 5, 6, 7, 2]
+    assert source.full_loads == 2
+
+
+def test_checks_are_rate_limited(index, source, clock):
+    index.upcoming(24)
+    source.set(3, "2025-06-01T15:00:00Z")
+    assert _ids(index.upcoming(24)) == [4, 1, 2]
+
+
+def test_failed_refresh_serves_previous_index(index, source, clock):
+    index.upcoming(24)
+    index._load_changes = lambda since, limit: (_ for _ in ()).throw(ConnectionError("db down"))
+    clock.now += 11
+    assert _ids(index.upcoming(24)) == [4, 1, 2]
+
+
+def test_parse_match_time():
+    assert parse_match_time("2025-06-01T12:00:00Z") == NOW
+    assert parse_match_time("") is None and parse_match_time("garbage") is None
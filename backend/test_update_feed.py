@@ -0,0 +1,124 @@
+"""
+Unit tests for the data-update notifications (update_feed.py)
+
+No MySQL needed; the watched state is a plain dict:
+    cd backend && python -m pytest test_update_feed.py -v
+"""
+import asyncio
+import copy
+import json
+
+from update_feed import RESYNC, UpdateFeed, diff_state, format_sse
+
+
+def _state(version=1, hashes=None, info=None):
+    return {
+        "calendars": {"version": version, "published_at": None, "hashes": hashes or {}},
+        "info": {"rankings": "2025-06-01T05:40:00"} if info is None else info,
+    }
+
+
+def _parse(chunk):
+    fields = dict(line.split(": ", 1) for line in chunk.strip().split("\n"))
+    return fields["event"], json.loads(fields["data"]), int(fields["id"])
+
+
+class TestDiff:
+
+    def test_calendar_changes_list_affected_players(self):
+        old = _state(1, {"1": "a", "2": "b"})
+        new = _state(2, {"1": "a", "2": "c", "3": "d"})
+        assert diff_state(old, new) == [("calendars", {"version": 2, "player_ids": [2, 3], "published_at": None})]
+
+    def test_info_timestamps(self):
+        old = _state(info={"rankings": "t1", "events": "t1"})
+        new = _state(info={"rankings": "t2", "events": "t1"})
+        assert diff_state(old, new) == [("rankings", {"lastupdated": "t2"})]
+
+    def test_unchanged_state_is_silent(self):
+        assert diff_state(_state(), _state()) == []
+
+
+class TestFeed:
+
+    def _feed(self, state, **kwargs):
+        holder = {"state": state}
+        feed = UpdateFeed(lambda: copy.deepcopy(holder["state"]), interval=0.01, **kwargs)
+        return feed, holder
+
+    def test_poll_publishes_and_notifies(self):
+        seen = []
+        feed, holder = self._feed(_state(), on_update=lambda event, data: seen.append(event))
+        feed.poll_once()
+        assert seen == []
+        holder["state"] = _state(info={"rankings": "later"})
+        feed.poll_once()
+        assert seen == ["rankings"]
+
+    def test_unreadable_info_does_not_report_changes(self):
+        feed, holder = self._feed(_state())
+        feed.poll_once()
+        holder["state"] = _state()
+        holder["state"]["info"] = None
+        feed.poll_once()
+        holder["state"] = _state()
+        feed.poll_once()
+        assert len(feed._backlog) == 0
+
+    def test_subscriber_receives_published_message(self):
+        feed, holder = self._feed(_state())
+
+        async def run():
+            stream = feed.stream()
+            assert (await stream.__anext__()).startswith("retry:")
+            # Let the watcher take its baseline snapshot first
+            while feed._state is None:
+                await asyncio.sleep(0.01)
+            holder["state"] = _state(2, {"9": "x"})
+            chunk = await asyncio.wait_for(stream.__anext__(), 5)
+            await stream.aclose()
+            return chunk
+
+        event, data, _ = _parse(asyncio.run(run()))
+        assert event == "calendars" and data["player_ids"] == [9]
+        assert not feed._subscribers
+
+    def test_reconnect_replays_missed_messages(self):
+        feed, _ = self._feed(_state())
+        first = feed.publish("rankings", {"lastupdated": "t1"})
+        feed.publish("events", {"lastupdated": "t2"})
+
+        async def run(last_id):
+            stream = feed.stream(last_id)
+            await stream.__anext__()
+            chunk = await stream.__anext__()
+            await stream.aclose()
+            return _parse(chunk)
+
+        assert asyncio.run(run(first["id"]))[0] == "events"
+        assert asyncio.run(run(first["id"] - 100))[0] == RESYNC
+
+    def test_slow_subscriber_is_told_to_resync(self):
+        feed, _ = self._feed(_state(), queue_size=2)
+
+        async def run():
+            stream = feed.stream()
+            await stream.__anext__()
+            # Waiting for the next message registers the subscriber's queue
+            pending = asyncio.ensure_future(stream.__anext__())
+            await asyncio.sleep(0)
+            for i in range(5):
+                feed.publish("rankings", {"lastupdated": str(i)})
+            await asyncio.sleep(0.05)
+            chunk = await pending
+            await stream.aclose()
+            return _parse(chunk)
+
+        event, _, message_id = asyncio.run(run())
+        assert event == RESYNC
+        assert message_id == feed._next_id - 1
+
+
+def test_format_sse():
+    assert format_sse({"id": 3, "event": "rankings", "data": {"a": 1}}) == \
+        'id: 3\nevent: rankings\ndata: {"a": 1}\n\n'
@@ -0,0 +1,164 @@
+"""
+Unit tests for the snooker.org circuit breaker and deadlines (upstream.py)
+
+No network access needed; HTTP responses are faked at the adapter level:
+    cd backend && python -m pytest test_upstream.py -v
+"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import pytest
+import requests
+
+from upstream import (
+    CircuitBreaker, CircuitOpenError, GuardedAdapter, UpstreamUnavailable,
+    create_session, create_snooker_client,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture()
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture()
+def breaker(clock):
+    return CircuitBreaker("test", failure_threshold=2, recovery_timeout=60, half_open_max_calls=1, clock=clock)
+
+
+def _fail(breaker, exc=None):
+    with pytest.raises(Exception):
+        with breaker.call():
+            raise exc or requests.ConnectionError("down")
+
+
+class TestCircuitBreaker:
+
+    def test_opens_after_threshold(self, breaker):
+        _fail(breaker)
+        assert breaker.state == CircuitBreaker.CLOSED
+        _fail(breaker)
+        assert breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.acquire()
+
+    def test_success_resets_failure_count(self, breaker):
+        _fail(breaker)
+        with breaker.call():
+            pass
+        _fail(breaker)
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_non_upstream_errors_do_not_count(self, breaker):
+        _fail(breaker, ValueError("bug"))
+        _fail(breaker, ValueError("bug"))
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_half_open_admits_limited_probes(self, breaker, clock):
+        _fail(breaker)
+        _fail(breaker)
+        clock.now = 61
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        breaker.acquire()
+        with pytest.raises(CircuitOpenError):
+            breaker.acquire()
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_failed_probe_reopens(self, breaker, clock):
+        _fail(breaker)
+        _fail(breaker)
+        clock.now = 61
+        _fail(breaker)
+        assert breaker.state == CircuitBreaker.OPEN
+        clock.now = 100
+        assert breaker.state == CircuitBreaker.OPEN
+
+
+class TestGuardedAdapter:
+
+    def _session(self, breaker, status_code=200):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = b"[]"
+        session = requests.Session()
+        adapter = GuardedAdapter(breaker, timeout=(1, 2))
+        session.mount("http://", adapter)
+        return session, response
+
+    def test_applies_default_deadline(self, breaker):
+        session, response = self._session(breaker)
+        with patch("requests.adapters.HTTPAdapter.send", return_value=response) as send:
+            session.get("http://api.snooker.org/")
+        assert send.call_args.kwargs["timeout"] == (1, 2)
+
+    def test_server_errors_trip_the_breaker(self, breaker):
+        session, response = self._session(breaker, status_code=503)
+        with patch("requests.adapters.HTTPAdapter.send", return_value=response):
+            for _ in range(2):
+                with pytest.raises(UpstreamUnavailable):
+                    session.get("http://api.snooker.org/")
+            with pytest.raises(CircuitOpenError):
+                session.get("http://api.snooker.org/")
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"[]"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+class TestSharedTransport:
+
+    def test_clients_reuse_pooled_connections(self, breaker, server):
+        transport = GuardedAdapter(breaker, timeout=(1, 2), shared=True)
+        first = create_snooker_client({"X-Requested-By": "test"}, transport=transport)
+        second = create_snooker_client({"X-Requested-By": "test"}, transport=transport)
+        for client in (first, second, first):
+            assert client.session.get(server).json() == []
+        stats = transport.connection_stats()
+        assert stats["requests"] == 3
+        assert stats["new_connections"] == 1
+        assert stats["reuse_ratio"] == pytest.approx(0.667)
+
+    def test_closing_one_session_keeps_the_pool(self, breaker, server):
+        transport = GuardedAdapter(breaker, timeout=(1, 2), shared=True)
+        session = create_session(transport=transport)
+        session.get(server)
+        session.close()
+        create_session(transport=transport).get(server)
+        assert transport.connection_stats()["new_connections"] == 1
+
+    def test_reset_pool_starts_fresh(self, breaker, server):
+        transport = GuardedAdapter(breaker, timeout=(1, 2), shared=True)
+        create_session(transport=transport).get(server)
+        transport.reset_pool()
+        assert transport.connection_stats()["requests"] == 0
@@ -0,0 +1,129 @@
+"""
+In-memory, time-sorted index of scheduled matches for /api/upcoming
+
+Entries are kept in a list sorted by (start timestamp, match id), so a time
+window is two bisects and a slice. The index follows the match change feed:
+at most every `check_interval` seconds it reads the changes recorded since it
+was built and re-loads just those matches (patching them in or out with
+bisect), or rebuilds from scratch when there are many, and every
+`rebuild_interval` seconds to drop matches that never got a result.
+
+Entries are pre-joined with player, ranking, event and round display data by
+the loader, so a request does no database work on a warm index.
+"""
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timezone
+
+# Unfinished matches that started up to this long ago are still reported (they are probably on)
+RUNNING_GRACE_SECONDS = 3 * 3600
+
+
+def parse_match_time(value):
+    """snooker.org date string -> POSIX timestamp, or None."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class UpcomingIndex:
+    """
+    Args:
+        load_matches (callable): match_ids or None -> [(time string, entry dict)]
+        load_changes (callable): (since, limit) -> change dicts with 'id' and 'match_id'
+        latest_change_id (callable): () -> id of the newest change
+        check_interval (float): Seconds between change-feed checks
+        rebuild_interval (float): Seconds after which the index is rebuilt anyway
+        patch_limit (int): More changes than this trigger a rebuild instead of a patch
+    """
+
+    def __init__(self, load_matches, load_changes, latest_change_id, check_interval=30.0,
+                 rebuild_interval=3600.0, patch_limit=200, clock=time.time):
+        self._load_matches = load_matches
+        self._load_changes = load_changes
+        self._latest_change_id = latest_change_id
+        self.check_interval = check_interval
+        self.rebuild_interval = rebuild_interval
+        self.patch_limit = patch_limit
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._keys = []      # sorted (timestamp, match_id)
+        self._entries = {}   # match_id -> (timestamp, entry)
+        self._cursor = None
+        self._built_at = 0.0
+        self._checked_at = 0.0
+
+    def between(self, start, end):
+        """Entries whose start time is in [start, end] (POSIX timestamps), earliest first."""
+        self._refresh_if_due()
+        with self._lock:
+            lo = bisect_left(self._keys, (start,))
+            hi = bisect_right(self._keys, (end, float('inf')))
+            return [self._entries[match_id][1] for _, match_id in self._keys[lo:hi]]
+
+    def upcoming(self, hours, now=None):
+        now = self._clock() if now is None else now
+        return self.between(now - RUNNING_GRACE_SECONDS, now + hours * 3600)
+
+    def invalidate(self):
+        """Rebuild on the next lookup."""
+        self._built_at = 0.0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _refresh_if_due(self):
+        now = self._clock()
+        if now - self._checked_at < self.check_interval and now - self._built_at < self.rebuild_interval:
+            return
+        with self._lock:
+            try:
+                if now - self._built_at >= self.rebuild_interval or self._cursor is None:
+                    self._rebuild(now)
+                elif now - self._checked_at >= self.check_interval:
+                    changes = self._load_changes(self._cursor, self.patch_limit + 1)
+                    if len(changes) > self.patch_limit:
+                        self._rebuild(now)
+                    elif changes:
+                        self._patch({change['match_id'] for change in changes})
+                        self._cursor = changes[-1]['id']
+            except Exception as e:
+                if self._cursor is None:
+                    raise
+                # Keep answering from the index we have; try again after check_interval
+                print(f"Upcoming index refresh failed, serving the previous index: {e}")
+            self._checked_at = now
+
+    def _rebuild(self, now):
+        # Read the cursor first: changes landing during the load are patched in again later
+        cursor = self._latest_change_id()
+        keys, entries = [], {}
+        for when, entry in self._load_matches(None):
+            ts = parse_match_time(when)
+            if ts is not None:
+                keys.append((ts, entry['match_id']))
+                entries[entry['match_id']] = (ts, entry)
+        keys.sort()
+        self._keys, self._entries = keys, entries
+        self._cursor = cursor
+        self._built_at = now
+
+    def _patch(self, match_ids):
+        for match_id in match_ids:
+            old = self._entries.pop(match_id, None)
+            if old is not None:
+                i = bisect_left(self._keys, (old[0], match_id))
+                if i < len(self._keys) and self._keys[i] == (old[0], match_id):
+                    del self._keys[i]
+        for when, entry in self._load_matches(list(match_ids)):
+            ts = parse_match_time(when)
+            if ts is not None:
+                insort(self._keys, (ts, entry['match_id']))
+                self._entries[entry['match_id']] = (ts, entry)
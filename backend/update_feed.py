@@ -0,0 +1,169 @@
+"""
+Data-update notifications for API clients (server-sent events)
+
+The scheduler publishes from another process, so the API notices new data by
+watching what it already reads: the calendar manifest (its version and the
+hash of every calendar) and the `infolastupdated` rows, which the scheduler
+stamps as `players` (rankings refresh) and `events` (event info update).
+While at least one client is subscribed, a watcher thread polls both and turns
+every difference into a message:
+
+    event: calendars
+    data: {"version": 42, "player_ids": [5, 12], "published_at": "..."}
+
+    event: players
+    data: {"lastupdated": "2025-06-01T05:40:12"}
+
+Message ids increase across restarts (they start at the process start time in
+milliseconds). A client reconnecting with Last-Event-ID gets the messages it
+missed from a short backlog, or a `resync` message if they are gone; a client
+too slow to keep up also gets `resync` in place of the messages it dropped.
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+
+RESYNC = 'resync'
+
+
+def format_sse(message):
+    """Encode one message in the text/event-stream format."""
+    return f"id: {message['id']}\nevent: {message['event']}\ndata: {json.dumps(message['data'])}\n\n"
+
+
+def diff_state(old, new):
+    """
+    Messages describing how `new` differs from `old`
+
+    Both states are {'calendars': {'version', 'published_at', 'hashes': {pid: hash}},
+    'info': {name: iso timestamp} or None when it could not be read}.
+
+    Returns:
+        list: (event, data) tuples
+    """
+    messages = []
+    old_cal, new_cal = old['calendars'], new['calendars']
+    if old_cal['version'] != new_cal['version']:
+        old_hashes, new_hashes = old_cal['hashes'], new_cal['hashes']
+        changed = [pid for pid in old_hashes.keys() | new_hashes.keys() if old_hashes.get(pid) != new_hashes.get(pid)]
+        messages.append(('calendars', {
+            'version': new_cal['version'],
+            'player_ids': sorted(int(pid) for pid in changed),
+            'published_at': new_cal['published_at'],
+        }))
+    if old['info'] is not None and new['info'] is not None:
+        for name in sorted(new['info']):
+            if old['info'].get(name) != new['info'][name]:
+                messages.append((name, {'lastupdated': new['info'][name]}))
+    return messages
+
+
+def _offer(queue, message):
+    """Runs on the subscriber's event loop."""
+    if queue.full():
+        # Drop the backlog of a slow client and tell it to refetch instead
+        while not queue.empty():
+            queue.get_nowait()
+        message = {'id': message['id'], 'event': RESYNC, 'data': {}}
+    queue.put_nowait(message)
+
+
+class UpdateFeed:
+    """
+    Polls a state snapshot and fans the differences out to SSE subscribers
+
+    Args:
+        snapshot (callable): Returns the current state (see diff_state)
+        interval (float): Seconds between polls while anyone is subscribed
+        backlog (int): Recent messages kept for clients reconnecting with Last-Event-ID
+        queue_size (int): Messages buffered per subscriber before it is told to resync
+        on_update (callable): Called with (event, data) for every message, e.g. to drop caches
+    """
+
+    def __init__(self, snapshot, interval=5.0, backlog=256, queue_size=64, on_update=None):
+        self._snapshot = snapshot
+        self.interval = interval
+        self.queue_size = queue_size
+        self.on_update = on_update
+        self._lock = threading.Lock()
+        self._backlog = deque(maxlen=backlog)
+        self._next_id = int(time.time() * 1000)
+        self._subscribers = set()
+        self._state = None
+        self._thread = None
+
+    def publish(self, event, data):
+        with self._lock:
+            message = {'id': self._next_id, 'event': event, 'data': data}
+            self._next_id += 1
+            self._backlog.append(message)
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, message)
+            except RuntimeError:
+                # The subscriber's loop has shut down
+                pass
+        return message
+
+    def poll_once(self):
+        """Take a snapshot and publish what changed since the previous one."""
+        state = self._snapshot()
+        if self._state is not None:
+            if state['info'] is None:
+                state['info'] = self._state['info']
+            for event, data in diff_state(self._state, state):
+                self.publish(event, data)
+                if self.on_update is not None:
+                    self.on_update(event, data)
+        self._state = state
+
+    def _watch(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            try:
+                self.poll_once()
+            except Exception as e:
+                print(f"Update feed poll failed: {e}")
+            time.sleep(self.interval)
+
+    def _missed(self, last_event_id):
+        """Backlog messages after last_event_id; [resync] if some are no longer available."""
+        if last_event_id is None:
+            return []
+        missed = [m for m in self._backlog if m['id'] > last_event_id]
+        oldest = self._backlog[0]['id'] if self._backlog else self._next_id
+        if last_event_id < oldest - 1:
+            return [{'id': self._next_id - 1, 'event': RESYNC, 'data': {}}]
+        return missed
+
+    async def stream(self, last_event_id=None, heartbeat=15.0):
+        """Async generator of SSE-encoded messages for one client."""
+        queue = asyncio.Queue(self.queue_size)
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            missed = self._missed(last_event_id)
+            self._subscribers.add(subscriber)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._watch, name='update-feed', daemon=True)
+                self._thread.start()
+        try:
+            # Tell EventSource how long to wait before reconnecting
+            yield "retry: 5000\n\n"
+            for message in missed:
+                yield format_sse(message)
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(message)
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
@@ -0,0 +1,274 @@
+"""
+Deadlines and a circuit breaker for snooker.org calls
+
+`requests` waits forever by default, and SnookerOrgApi never passes a timeout.
+create_snooker_client() returns a SnookerOrgApi whose session has an adapter
+that applies connect/read deadlines to every request and routes every request
+through a process-wide circuit breaker:
+
+- closed: requests go through; consecutive upstream failures (connection
+  errors, timeouts, HTTP 429/5xx) are counted
+- open: after `breaker_failure_threshold` failures, requests fail immediately
+  with CircuitOpenError for `breaker_recovery_seconds`
+- half-open: then up to `breaker_half_open_calls` probe requests go through;
+  a success closes the breaker, a failure opens it again
+
+HTTP 429/5xx responses raise UpstreamUnavailable instead of being handed to
+SnookerOrgApi, which would otherwise read the error page as "no data".
+
+All clients in a process share one such adapter, `snooker_transport`, so its
+keep-alive connection pool is reused across clients instead of every new
+SnookerOrgApi opening (and handshaking) fresh connections. Idempotent requests
+are retried with backoff inside the transport on connection errors and 5xx, so
+the breaker sees one failure per logical request. transport_stats() reports how
+many requests reused a pooled connection.
+"""
+import configparser
+import multiprocessing
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from snooker.api import SnookerOrgApi
+from urllib3.util import Retry
+
+
+def load_config(filename='config.txt'):
+    config = configparser.ConfigParser()
+    config.read(filename)
+
+    # Only the API configuration is needed here
+    if not config.has_section('api'):
+        return {}
+    return {key: value for key, value in config['api'].items()}
+
+api_config = load_config()
+
+
+class UpstreamUnavailable(Exception):
+    """snooker.org answered with an error status or could not be reached."""
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    """The breaker is open; the request was not sent."""
+
+
+def is_upstream_failure(exc):
+    """True for errors that say snooker.org is unhealthy, as opposed to bugs in our code."""
+    return isinstance(exc, (requests.RequestException, UpstreamUnavailable,
+                            TimeoutError, multiprocessing.TimeoutError))
+
+
+class CircuitBreaker:
+    """
+    Thread-safe three-state circuit breaker
+
+    Args:
+        failure_threshold (int): Consecutive failures that open the breaker
+        recovery_timeout (float): Seconds to stay open before probing
+        half_open_max_calls (int): Probes allowed in flight while half-open
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, recovery_timeout=120.0, half_open_max_calls=1,
+                 clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def acquire(self):
+        """Admit one call or raise CircuitOpenError. Every admitted call must be reported."""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return
+            retry_in = max(0.0, self.recovery_timeout - (self._clock() - self._opened_at))
+        raise CircuitOpenError(f"{self.name} circuit is open (retry in {retry_in:.0f}s)")
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                print(f"{self.name} circuit closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probes = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    print(f"{self.name} circuit opened after {self._failures} failures")
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+                self._probes = 0
+
+    def release(self):
+        """Report an admitted call that neither proved nor disproved upstream health."""
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    @contextmanager
+    def call(self):
+        """Guard a block that talks to the upstream; only upstream failures count against it."""
+        self.acquire()
+        try:
+            yield
+        except Exception as e:
+            if is_upstream_failure(e) and not isinstance(e, CircuitOpenError):
+                self.record_failure()
+            else:
+                self.release()
+            raise
+        self.record_success()
+
+    def snapshot(self):
+        with self._lock:
+            return {'name': self.name, 'state': self._current_state(), 'failures': self._failures}
+
+
+snooker_breaker = CircuitBreaker(
+    'snooker.org',
+    failure_threshold=int(api_config.get('breaker_failure_threshold', 5)),
+    recovery_timeout=float(api_config.get('breaker_recovery_seconds', 120)),
+    half_open_max_calls=int(api_config.get('breaker_half_open_calls', 1)),
+)
+
+# (connect, read) deadline in seconds for every snooker.org request
+REQUEST_TIMEOUT = (
+    float(api_config.get('connect_timeout_seconds', 5)),
+    float(api_config.get('read_timeout_seconds', 30)),
+)
+
+
+class GuardedAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that applies default deadlines and reports to a circuit breaker
+
+    Args:
+        shared (bool): Mounted on many sessions; closing one session keeps the pool open
+    """
+
+    def __init__(self, breaker=snooker_breaker, timeout=REQUEST_TIMEOUT, shared=False, **kwargs):
+        self.breaker = breaker
+        self.timeout = timeout
+        self.shared = shared
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        with self.breaker.call():
+            response = super().send(request, **kwargs)
+            if response.status_code == 429 or response.status_code >= 500:
+                raise UpstreamUnavailable(f"snooker.org returned HTTP {response.status_code}")
+        return response
+
+    def close(self):
+        if not self.shared:
+            super().close()
+
+    def reset_pool(self):
+        """Start a new, empty pool, abandoning connections inherited over fork() without closing them."""
+        self.init_poolmanager(self._pool_connections, self._pool_maxsize, block=self._pool_block)
+
+    def connection_stats(self):
+        """Requests sent and connections opened by the pools this adapter currently holds."""
+        sent = opened = 0
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            try:
+                pool = pools[key]
+            except KeyError:
+                continue
+            sent += pool.num_requests
+            opened += pool.num_connections
+        reused = max(sent - opened, 0)
+        return {'requests': sent, 'new_connections': opened, 'reused': reused,
+                'reuse_ratio': round(reused / sent, 3) if sent else 0.0}
+
+
+def _retry_policy():
+    retries = int(api_config.get('http_retries', 2))
+    return Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=float(api_config.get('http_backoff_seconds', 0.5)),
+        # 429 is left to the breaker and the rate limiter rather than retried in a tight loop
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False,
+    )
+
+
+# Process-wide keep-alive pool shared by every snooker.org session
+snooker_transport = GuardedAdapter(
+    snooker_breaker,
+    REQUEST_TIMEOUT,
+    shared=True,
+    pool_connections=4,
+    pool_maxsize=int(api_config.get('http_pool_size', 10)),
+    max_retries=_retry_policy(),
+)
+
+
+def transport_stats():
+    return snooker_transport.connection_stats()
+
+
+def reset_transport():
+    """Call in a forked child before its first request; sockets must not be shared with the parent."""
+    snooker_transport.reset_pool()
+
+
+def create_session(headers=None, transport=None):
+    """requests.Session that sends everything through the shared snooker.org transport."""
+    session = requests.Session()
+    if headers:
+        session.headers.update(headers)
+    transport = transport or snooker_transport
+    session.mount('http://', transport)
+    session.mount('https://', transport)
+    return session
+
+
+def create_snooker_client(headers=None, transport=None):
+    """SnookerOrgApi on the shared pooled transport, with deadlines and the circuit breaker."""
+    if headers is None:
+        headers = {'X-Requested-By': api_config['x_requested_by']}
+    client = SnookerOrgApi(headers=headers)
+    transport = transport or snooker_transport
+    client.session.mount('http://', transport)
+    client.session.mount('https://', transport)
+    return client